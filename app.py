@@ -1,12 +1,13 @@
 import os
 import logging
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from flask_socketio import SocketIO
 import threading
 import time
 import json
 import re
 import mimetypes
+import uuid
 import eventlet
 
 # Set up logging
@@ -14,10 +15,20 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Import RAG components
-from pathway_processor import PathwayProcessor
+from pathway_processor import PathwayProcessor, IngestQueueFull
+from document_stream import DOCUMENT_EXTENSIONS, iter_document_text
 from vector_store import VectorStore
+from sharded_store import ShardedVectorStore, SHARDS_FILE
 from llm_integration import TogetherAILLM
 from rag_orchestrator import RAGOrchestrator
+from embeddings import create_embedding_provider
+from chunking import create_chunker
+from query_batcher import QueryCoalescer
+from query_cache import QueryCache
+from reranking import Reranker, create_scorer
+from context_assembly import ContextAssembler
+from semantic_cache import SemanticCache
+from llm_transport import LLMTransport, CircuitBreaker, set_default_transport
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -31,11 +42,185 @@ together_api_key = os.environ.get("TOGETHER_API_KEY", "")
 if not together_api_key:
     logger.warning("TOGETHER_API_KEY environment variable not set. Using mock LLM responses.")
 
-# Initialize RAG components
-vector_store = VectorStore(vector_dim=16)  # Using 16-dim for demonstration
+# Select the embedding provider: "hash" (default) or "sentence-transformer"
+embedding_provider_name = os.environ.get("EMBEDDING_PROVIDER", "hash")
+if embedding_provider_name == "hash":
+    embedding_options = {"vector_dim": int(os.environ.get("EMBEDDING_DIM", "16"))}
+else:
+    embedding_options = {
+        "model_path": os.environ.get("EMBEDDING_MODEL_PATH", ""),
+        "batch_size": int(os.environ.get("EMBEDDING_BATCH_SIZE", "32")),
+        "num_threads": int(os.environ.get("EMBEDDING_THREADS", "0")) or None
+    }
+embedder = create_embedding_provider(embedding_provider_name, **embedding_options)
+
+# Initialize RAG components; the index is sized from the embedding provider.
+# If a snapshot exists at VECTOR_STORE_PATH, restart from it instead of re-ingesting.
+# VECTOR_STORE_SHARDS > 1 partitions the chunks across several stores that
+# are searched in parallel, in this process or (shard mode "process") in
+# one child process per shard.
+vector_store_path = os.environ.get("VECTOR_STORE_PATH", "")
+vector_store_shards = int(os.environ.get("VECTOR_STORE_SHARDS", "1"))
+vector_store_shard_mode = os.environ.get("VECTOR_STORE_SHARD_MODE", "thread")
+if vector_store_path and (os.path.exists(os.path.join(vector_store_path, SHARDS_FILE))
+                          or os.path.exists(os.path.join(vector_store_path, "manifest.json"))):
+    if os.path.exists(os.path.join(vector_store_path, SHARDS_FILE)):
+        vector_store = ShardedVectorStore.load(vector_store_path, shard_mode=vector_store_shard_mode)
+    else:
+        vector_store = VectorStore.load(vector_store_path)
+    if vector_store.vector_dim != embedder.dimension:
+        raise ValueError(
+            f"Snapshot at {vector_store_path} has dimension {vector_store.vector_dim}, "
+            f"but the embedding provider produces {embedder.dimension}"
+        )
+else:
+    vector_store_options = dict(
+        vector_dim=embedder.dimension,
+        index_type=os.environ.get("VECTOR_INDEX_TYPE", "flat"),
+        nlist=int(os.environ.get("VECTOR_INDEX_NLIST", "100")),
+        nprobe=int(os.environ.get("VECTOR_INDEX_NPROBE", "8")),
+        hnsw_m=int(os.environ.get("VECTOR_INDEX_HNSW_M", "32")),
+        ef_search=int(os.environ.get("VECTOR_INDEX_EF_SEARCH", "64")),
+        pq_m=int(os.environ.get("VECTOR_INDEX_PQ_M", "8")),
+        lexical_search=os.environ.get("LEXICAL_SEARCH", "1") == "1",
+        rrf_k=int(os.environ.get("HYBRID_RRF_K", "60"))
+    )
+    if vector_store_shards > 1:
+        vector_store = ShardedVectorStore(
+            num_shards=vector_store_shards,
+            partition=os.environ.get("VECTOR_STORE_PARTITION", "hash"),
+            shard_mode=vector_store_shard_mode,
+            **vector_store_options
+        )
+    else:
+        vector_store = VectorStore(**vector_store_options)
+# Shared pooled HTTP transport for all LLM calls
+set_default_transport(LLMTransport(
+    pool_maxsize=int(os.environ.get("LLM_POOL_SIZE", "32")),
+    max_retries=int(os.environ.get("LLM_MAX_RETRIES", "3")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get("LLM_BREAKER_THRESHOLD", "5")),
+        reset_timeout=float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+    )
+))
 llm = TogetherAILLM()
-pathway_processor = PathwayProcessor(vector_store)
-rag_orchestrator = RAGOrchestrator(vector_store, llm)
+
+# Chunking: "sentence" (default) packs whole sentences up to the embedding model's
+# token limit; "fixed" keeps the original character windows
+chunking_strategy = os.environ.get("CHUNKING_STRATEGY", "sentence")
+if chunking_strategy == "fixed":
+    chunking_options = {
+        "chunk_size": int(os.environ.get("CHUNK_SIZE", "1000")),
+        "overlap": int(os.environ.get("CHUNK_OVERLAP", "200"))
+    }
+else:
+    chunking_options = {
+        "max_tokens": int(os.environ.get("CHUNK_MAX_TOKENS", "0")) or None,
+        "overlap_tokens": int(os.environ.get("CHUNK_OVERLAP_TOKENS", "32"))
+    }
+chunker = create_chunker(chunking_strategy, embedder=embedder, **chunking_options)
+
+pathway_processor = PathwayProcessor(
+    vector_store, embedder,
+    max_queue_size=int(os.environ.get("INGEST_QUEUE_SIZE", "1000")),
+    max_batch_size=int(os.environ.get("INGEST_MAX_BATCH", "32")),
+    num_workers=int(os.environ.get("INGEST_WORKERS", "0")),
+    worker_mode=os.environ.get("INGEST_WORKER_MODE", "thread"),
+    chunker=chunker
+)
+
+# Optionally stream a directory (e.g. "test data/") into the index with Pathway;
+# new, changed and deleted files are applied as upserts and deletes
+directory_watcher = None
+watch_directory = os.environ.get("WATCH_DIRECTORY", "")
+if watch_directory:
+    from pathway_ingest import PathwayDirectoryWatcher
+    directory_watcher = PathwayDirectoryWatcher(watch_directory, pathway_processor)
+    directory_watcher.start()
+
+# Coalesce concurrent /api/query searches into batched FAISS calls; set
+# QUERY_COALESCE_MAX_WAIT_MS=0 to search each query on its own
+coalesce_max_wait_ms = float(os.environ.get("QUERY_COALESCE_MAX_WAIT_MS", "2"))
+query_coalescer = None
+if coalesce_max_wait_ms > 0:
+    query_coalescer = QueryCoalescer(
+        vector_store,
+        max_wait_ms=coalesce_max_wait_ms,
+        max_batch=int(os.environ.get("QUERY_COALESCE_MAX_BATCH", "32"))
+    )
+
+# Cache retrieval results and answers for repeated questions; set
+# QUERY_CACHE_MAX_ENTRIES=0 to disable
+query_cache_max_entries = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", "1024"))
+query_cache = None
+if query_cache_max_entries > 0:
+    query_cache = QueryCache(
+        max_entries=query_cache_max_entries,
+        ttl=float(os.environ.get("QUERY_CACHE_TTL", "300")),
+        max_bytes=int(os.environ.get("QUERY_CACHE_MAX_MB", "64")) * 1024 * 1024
+    )
+
+# Rerank retrieved candidates before generation; RERANKER is "overlap" (no
+# model) or "cross-encoder" (needs RERANK_MODEL_PATH), unset to disable
+reranker_name = os.environ.get("RERANKER", "")
+reranker = None
+if reranker_name:
+    reranker_options = {}
+    if reranker_name == "cross-encoder":
+        reranker_options = {
+            "model_path": os.environ.get("RERANK_MODEL_PATH", ""),
+            "batch_size": int(os.environ.get("RERANK_BATCH_SIZE", "16")),
+            "num_threads": int(os.environ.get("RERANK_THREADS", "0")) or None
+        }
+    reranker = Reranker(
+        create_scorer(reranker_name, **reranker_options),
+        candidates=int(os.environ.get("RERANK_CANDIDATES", "20")),
+        batch_size=int(os.environ.get("RERANK_BATCH_SIZE", "16")),
+        time_budget_ms=float(os.environ.get("RERANK_TIME_BUDGET_MS", "100"))
+    )
+
+# Merge overlapping chunks, drop duplicates and cap the prompt context at
+# CONTEXT_MAX_TOKENS; set it to 0 to send the retrieved chunks as they are
+context_max_tokens = int(os.environ.get("CONTEXT_MAX_TOKENS", "2048"))
+context_assembler = None
+if context_max_tokens > 0:
+    context_assembler = ContextAssembler(
+        max_tokens=context_max_tokens,
+        near_duplicate_threshold=float(os.environ.get("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+    )
+
+# Answer paraphrases of recent questions from a semantic cache of query
+# embeddings; set SEMANTIC_CACHE_MAX_ENTRIES=0 to disable. Hash embeddings
+# do not capture meaning, so the cache is only used with a real model.
+semantic_cache_max_entries = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+semantic_cache = None
+if semantic_cache_max_entries > 0 and embedding_provider_name != "hash":
+    semantic_cache = SemanticCache(
+        embedder.dimension,
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        max_entries=semantic_cache_max_entries,
+        ttl=float(os.environ.get("SEMANTIC_CACHE_TTL", "3600"))
+    )
+    # Evict cached answers as soon as a chunk they were built from changes
+    vector_store.removal_listeners.append(semantic_cache.invalidate_chunks)
+
+rag_orchestrator = RAGOrchestrator(
+    vector_store, llm, embedder,
+    max_concurrent_generations=int(os.environ.get("MAX_CONCURRENT_GENERATIONS", "8")),
+    query_coalescer=query_coalescer,
+    query_cache=query_cache,
+    reranker=reranker,
+    top_k=int(os.environ.get("RETRIEVAL_TOP_K", "5")),
+    context_assembler=context_assembler,
+    semantic_cache=semantic_cache
+)
+
+# Uploads larger than this are decoded, parsed and chunked as a stream instead of in memory
+UPLOAD_STREAM_THRESHOLD = int(os.environ.get("UPLOAD_STREAM_THRESHOLD_MB", "8")) * 1024 * 1024
+UPLOAD_STREAM_SEGMENT_CHUNKS = int(os.environ.get("UPLOAD_STREAM_SEGMENT_CHUNKS", "64"))
+
+# Upper bound on the number of queries accepted by /api/query/batch
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", "500"))
 
 # Global variables for streaming stats
 processor_metrics = {
@@ -61,6 +246,7 @@ mimetypes.add_type('text/markdown', '.md')
 mimetypes.add_type('text/csv', '.csv')
 mimetypes.add_type('text/plain', '.txt')
 mimetypes.add_type('application/json', '.json')
+mimetypes.add_type('application/jsonl', '.jsonl')
 
 # Socket.IO events
 @socketio.on('connect')
@@ -74,6 +260,17 @@ def handle_connect():
 def handle_disconnect():
     logger.info("Client disconnected")
 
+@socketio.on('query_stream')
+def handle_query_stream(data):
+    """Answer a query over Socket.IO, emitting generation_delta events to the caller."""
+    user_query = (data or {}).get('query', '').strip()
+    if not user_query:
+        socketio.emit('generation_error', {'error': "Query cannot be empty"}, to=request.sid)
+        return
+
+    for _ in stream_query_events(user_query, {}, room=request.sid):
+        pass
+
 # Routes
 @app.route('/')
 def landing():
@@ -96,8 +293,13 @@ def query():
 
         logger.info(f"Processing query: {user_query}")
 
+        # Optional per-query ANN tuning
+        search_options = {
+            key: int(data[key]) for key in ('nprobe', 'ef_search') if data.get(key)
+        }
+
         # Get retrieved context and generated response from RAG
-        context, response, metrics = rag_orchestrator.process_query(user_query)
+        context, response, metrics = rag_orchestrator.process_query(user_query, search_options)
 
         # Emit retrieval metrics via SocketIO
         socketio.emit('retrieval_metrics', metrics)
@@ -118,6 +320,100 @@ def query():
         logger.error(f"Error processing query: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/query/stream', methods=['POST'])
+def query_stream():
+    """Answer a query with a chunked response of newline-delimited JSON events."""
+    data = request.json
+    user_query = data.get('query', '').strip()
+
+    if not user_query:
+        return jsonify({"error": "Query cannot be empty"}), 400
+
+    search_options = {
+        key: int(data[key]) for key in ('nprobe', 'ef_search') if data.get(key)
+    }
+
+    def generate():
+        for event in stream_query_events(user_query, search_options):
+            yield json.dumps(event) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def stream_query_events(user_query, search_options, room=None):
+    """Run a streaming query and mirror its progress as Socket.IO events.
+
+    Yields the orchestrator events tagged with a query id. Socket.IO events go
+    to `room` if given, otherwise to all clients.
+    """
+    query_id = uuid.uuid4().hex
+    logger.info(f"Processing streaming query {query_id}: {user_query}")
+    socketio.emit('generation_started', {'query_id': query_id, 'query': user_query}, to=room)
+
+    try:
+        for event in rag_orchestrator.process_query_stream(user_query, search_options):
+            event = dict(event, query_id=query_id)
+            if event["type"] == "delta":
+                socketio.emit('generation_delta', {'query_id': query_id, 'text': event["text"]}, to=room)
+            elif event["type"] == "done":
+                socketio.emit('generation_completed', {
+                    'query_id': query_id,
+                    'query': user_query,
+                    'response': event["response"]
+                }, to=room)
+                socketio.emit('retrieval_metrics', event["metrics"])
+            yield event
+    except Exception as e:
+        logger.error(f"Error processing streaming query: {str(e)}", exc_info=True)
+        socketio.emit('generation_error', {'query_id': query_id, 'error': str(e)}, to=room)
+        yield {"type": "error", "query_id": query_id, "error": str(e)}
+        return
+
+    update_metrics_data()
+    socketio.emit('metrics_update', processor_metrics)
+
+@app.route('/api/query/batch', methods=['POST'])
+def query_batch():
+    """Answer many queries with one batched retrieval."""
+    try:
+        data = request.json
+        queries = [q.strip() for q in data.get('queries', []) if isinstance(q, str) and q.strip()]
+
+        if not queries:
+            return jsonify({"error": "Queries cannot be empty"}), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries are allowed per batch"}), 400
+
+        logger.info(f"Processing batch of {len(queries)} queries")
+        start_time = time.time()
+
+        search_options = {
+            key: int(data[key]) for key in ('nprobe', 'ef_search') if data.get(key)
+        }
+        results = rag_orchestrator.process_queries(queries, search_options)
+
+        # Force metrics update
+        update_metrics_data()
+        socketio.emit('metrics_update', processor_metrics)
+
+        return jsonify({
+            "results": [
+                {
+                    "query": user_query,
+                    "context": context,
+                    "response": response,
+                    "metrics": metrics
+                }
+                for user_query, (context, response, metrics) in zip(queries, results)
+            ],
+            "metrics": {
+                "total_time": time.time() - start_time,
+                "query_count": len(queries)
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error processing query batch: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/upload', methods=['POST'])
 def upload_document():
     try:
@@ -130,51 +426,39 @@ def upload_document():
             return jsonify({"error": "No selected file"}), 400
 
         # Check file extension
-        allowed_extensions = ['.txt', '.md', '.csv', '.json']
         file_ext = os.path.splitext(file.filename)[1].lower()
 
-        if file_ext not in allowed_extensions:
+        if file_ext not in DOCUMENT_EXTENSIONS:
             return jsonify({
-                "error": f"Unsupported file type. Supported types: {', '.join(allowed_extensions)}"
+                "error": f"Unsupported file type. Supported types: {', '.join(DOCUMENT_EXTENSIONS)}"
             }), 400
 
+        if (request.content_length or 0) > UPLOAD_STREAM_THRESHOLD:
+            return upload_document_stream(file, file_ext)
+
         try:
-            content = file.read().decode('utf-8')
+            content = "".join(iter_document_text(file.stream, file_ext))
         except UnicodeDecodeError:
             return jsonify({"error": "File encoding not supported. Please upload UTF-8 encoded text files."}), 400
+        except json.JSONDecodeError:
+            return jsonify({"error": "Invalid JSON file format"}), 400
 
         if not content.strip():
             return jsonify({"error": "File appears to be empty"}), 400
 
-        # Format content based on file type
-        if file_ext == '.json':
-            try:
-                json_data = json.loads(content)
-                # Extract text from common JSON formats
-                if isinstance(json_data, dict):
-                    if 'text' in json_data:
-                        content = json_data['text']
-                    elif 'content' in json_data:
-                        content = json_data['content']
-                    else:
-                        # Format the JSON nicely for processing
-                        content = json.dumps(json_data, indent=2)
-                elif isinstance(json_data, list):
-                    # Join list items into text
-                    content = '\n\n'.join([str(item) for item in json_data])
-            except json.JSONDecodeError:
-                return jsonify({"error": "Invalid JSON file format"}), 400
-
         # Log document information
         logger.info(f"Processing document: {file.filename}, size: {len(content)} bytes")
 
-        # Process the document with Pathway
-        doc_id = pathway_processor.add_document(content, file.filename)
+        # Re-uploading a file replaces its previous version; only changed chunks are re-embedded.
+        # Reject with 503 when the ingest queue is full
+        try:
+            doc_id = pathway_processor.upsert_document(content, file.filename, block=False)
+        except IngestQueueFull as e:
+            response = jsonify({"error": str(e)})
+            response.headers["Retry-After"] = "5"
+            return response, 503
         logger.info(f"Document {file.filename} uploaded and queued for processing as {doc_id}")
 
-        # Give pathway processor a moment to start processing 
-        time.sleep(1)
-
         # Force metrics update
         update_metrics_data()
         socketio.emit('metrics_update', processor_metrics)
@@ -193,12 +477,96 @@ def upload_document():
         logger.error(f"Error uploading document: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+def upload_document_stream(file, file_ext):
+    """Ingest a large upload without holding it in memory.
+
+    The file is decoded and parsed incrementally and its chunks are queued
+    as they are produced; queueing blocks while the ingest queue is full.
+    """
+    doc_id = file.filename
+    logger.info(f"Streaming document: {doc_id}, size: {request.content_length} bytes")
+
+    start_time = time.time()
+    chunks = chunker.iter_chunks(iter_document_text(file.stream, file_ext))
+    try:
+        chunk_count = pathway_processor.stream_document(chunks, doc_id, segment_size=UPLOAD_STREAM_SEGMENT_CHUNKS)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        # stream_document has already undone the segments queued before the error
+        if isinstance(e, UnicodeDecodeError):
+            return jsonify({"error": "File encoding not supported. Please upload UTF-8 encoded text files."}), 400
+        return jsonify({"error": "Invalid JSON file format"}), 400
+
+    if chunk_count == 0:
+        return jsonify({"error": "File appears to be empty"}), 400
+
+    update_metrics_data()
+    socketio.emit('metrics_update', processor_metrics)
+
+    return jsonify({
+        "message": "Document streamed and processing started",
+        "document_id": doc_id,
+        "chunks_queued": chunk_count,
+        "stream_time": time.time() - start_time,
+        "current_metrics": {
+            "docs_processed": processor_metrics["documents_processed"],
+            "chunks_count": processor_metrics["chunks_count"]
+        }
+    })
+
+@app.route('/api/documents/<path:doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    """Queue the removal of every chunk of an uploaded document."""
+    try:
+        pathway_processor.delete_document(doc_id, block=False)
+    except IngestQueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+
+    return jsonify({"message": "Document deletion queued", "document_id": doc_id}), 202
+
 @app.route('/api/metrics', methods=['GET'])
 def get_metrics():
     """Get current system metrics."""
     update_metrics_data()
     return jsonify(processor_metrics)
 
+@app.route('/api/sources', methods=['GET'])
+def get_sources():
+    """Per-source chunk counts, largest first; `limit` caps the number of sources."""
+    source_counts = vector_store.get_source_stats()
+    sources = sorted(source_counts.items(), key=lambda item: item[1], reverse=True)
+
+    limit = request.args.get('limit', type=int)
+    if limit:
+        sources = sources[:limit]
+
+    return jsonify({
+        "unique_sources": len(source_counts),
+        "chunk_count": sum(source_counts.values()),
+        "sources": [{"source": source, "chunks": chunks} for source, chunks in sources]
+    })
+
+@app.route('/api/snapshot', methods=['POST'])
+def save_snapshot():
+    """Save the vector store to VECTOR_STORE_PATH for fast restarts."""
+    try:
+        if not vector_store_path:
+            return jsonify({"error": "VECTOR_STORE_PATH is not configured"}), 400
+
+        start_time = time.time()
+        vector_store.save(vector_store_path)
+
+        return jsonify({
+            "message": "Vector store snapshot saved",
+            "path": vector_store_path,
+            "document_count": vector_store.get_metrics()["document_count"],
+            "save_time": time.time() - start_time
+        })
+    except Exception as e:
+        logger.error(f"Error saving snapshot: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/setkey', methods=['POST'])
 def set_api_key():
     """Set the Together AI API key."""
@@ -217,9 +585,8 @@ def set_api_key():
         together_api_key = api_key
         llm = TogetherAILLM()  # This will pick up the new environment variable
 
-        # Update orchestrator
-        global rag_orchestrator
-        rag_orchestrator = RAGOrchestrator(vector_store, llm)
+        # Point the orchestrator at the new LLM, keeping its configuration
+        rag_orchestrator.llm = llm
 
         logger.info("Together AI API key updated")
 
@@ -261,12 +628,18 @@ def update_metrics_data():
             "documents_processed": docs_processed,
             "document_count": vs_metrics.get("document_count", 0),
             "chunks_count": vs_metrics.get("document_count", 0),  # Each document is a chunk
-            "vector_dimensions": vs_metrics.get("vector_dimension", 16),
+            "vector_dimensions": vs_metrics.get("vector_dimension", vector_store.vector_dim),
             "last_update": current_time,
             "processing_rate": processing_rate,
             "recent_documents": recent_docs,
-            "sources": vs_metrics.get("sources", []),
             "unique_sources": vs_metrics.get("unique_sources", 0),
+            "ingest_queue": pathway_processor.get_queue_metrics(),
+            "directory_watcher": directory_watcher.get_metrics() if directory_watcher else {},
+            "query_batching": query_coalescer.get_metrics() if query_coalescer else {},
+            "query_cache": query_cache.get_metrics() if query_cache else {},
+            "reranking": reranker.get_metrics() if reranker else {},
+            "context_assembly": context_assembler.get_metrics() if context_assembler else {},
+            "semantic_cache": semantic_cache.get_metrics() if semantic_cache else {},
             "llm_stats": {
                 "has_api_key": bool(together_api_key),
                 "model": llm_metrics.get("model", "unknown"),
@@ -0,0 +1,106 @@
+# ASGI entry point serving the async query pipeline next to the Flask app.
+# It shares the RAG components created in app.py. Run it with:
+#
+#     uvicorn asgi:application --host 127.0.0.1 --port 3001
+import asyncio
+import json
+import logging
+
+from app import rag_orchestrator
+
+logger = logging.getLogger(__name__)
+
+async def read_body(receive):
+    """Read the full request body from the ASGI receive channel."""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionAbortedError("Client disconnected while sending the request")
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+async def send_json(send, status, payload):
+    """Send a complete JSON response."""
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def wait_for_disconnect(receive):
+    """Return once the client has gone away."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def handle_query(receive, send):
+    """POST /api/query backed by RAGOrchestrator.aprocess_query."""
+    try:
+        data = json.loads(await read_body(receive) or b"{}")
+    except json.JSONDecodeError:
+        await send_json(send, 400, {"error": "Invalid JSON body"})
+        return
+    except ConnectionAbortedError:
+        return
+
+    user_query = str(data.get("query", "")).strip()
+    if not user_query:
+        await send_json(send, 400, {"error": "Query cannot be empty"})
+        return
+
+    search_options = {
+        key: int(data[key]) for key in ("nprobe", "ef_search") if data.get(key)
+    }
+
+    query_task = asyncio.create_task(rag_orchestrator.aprocess_query(user_query, search_options))
+    disconnect_task = asyncio.create_task(wait_for_disconnect(receive))
+
+    done, _ = await asyncio.wait({query_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    if query_task not in done:
+        # The client went away; cancelling propagates into the LLM request
+        logger.info(f"Client disconnected, cancelling query: {user_query}")
+        query_task.cancel()
+        return
+    disconnect_task.cancel()
+
+    try:
+        context, response, metrics = query_task.result()
+    except Exception as e:
+        logger.error(f"Error processing async query: {str(e)}", exc_info=True)
+        await send_json(send, 500, {"error": str(e)})
+        return
+
+    await send_json(send, 200, {
+        "query": user_query,
+        "context": context,
+        "response": response,
+        "metrics": metrics
+    })
+
+async def application(scope, receive, send):
+    """ASGI application."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/api/query" and scope["method"] == "POST":
+        await handle_query(receive, send)
+    else:
+        await send_json(send, 404, {"error": "Not found"})
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(application, host="127.0.0.1", port=3001)
@@ -0,0 +1,359 @@
+import json
+import logging
+import mmap
+import os
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ARENA_FILE = "texts.bin"
+SOURCES_FILE = "sources.json"
+KEYS_FILE = "irregular_keys.json"
+
+# Per-row columns, saved as <name>.npy in snapshots
+COLUMNS = {
+    "alive": (np.bool_, False),
+    "added_at": (np.float64, 0.0),
+    "source_ids": (np.int32, -1),
+    "chunk_numbers": (np.int64, -1),
+    "hashes": ("S8", b""),
+    "text_offsets": (np.int64, 0),
+    "text_lengths": (np.int64, 0),
+    "doc_starts": (np.int64, -1),
+    "doc_ends": (np.int64, -1),
+    # End of the whitespace after the chunk in the source document
+    "doc_space_ends": (np.int64, -1),
+}
+
+def parse_document_id(document_id):
+    """Split `<source>_chunk_<n>` into `(source, n)`; other ids are `(id, -1)`.
+
+    Splits at the last `_chunk_`, as the source name may contain it too.
+    """
+    source, separator, number = document_id.rpartition("_chunk_")
+    if separator and number.isdigit():
+        return source, int(number)
+    return document_id, -1
+
+def encode_spans(text, spans):
+    """Encode the part of `text` covered by `spans` once.
+
+    Returns the UTF-8 bytes from the first span start to the last span end
+    and the byte offsets and lengths of every span within them.
+    """
+    low = min(start for start, _ in spans)
+    high = max(end for _, end in spans)
+
+    # Walk the span boundaries in order, encoding each stretch of text once
+    byte_positions = {}
+    position, byte_position = low, 0
+    for boundary in sorted({point for span in spans for point in span}):
+        byte_position += len(text[position:boundary].encode("utf-8"))
+        byte_positions[boundary] = byte_position
+        position = boundary
+
+    offsets = np.array([byte_positions[start] for start, _ in spans], dtype=np.int64)
+    lengths = np.array([byte_positions[end] - byte_positions[start] for start, end in spans], dtype=np.int64)
+    return text[low:high].encode("utf-8"), offsets, lengths
+
+def encode_texts(texts=None, spans=None, source_text=None):
+    """Encode chunk texts for `ChunkStore.append_encoded`; see `append_text`.
+
+    Returns the UTF-8 bytes and each text's byte offset and length in them.
+    """
+    if spans is not None and source_text is not None:
+        return encode_spans(source_text, spans)
+
+    encoded = [text.encode("utf-8") for text in texts]
+    lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return b"".join(encoded), offsets, lengths
+
+class ChunkStore:
+    """Columnar chunk storage indexed directly by FAISS id.
+
+    Per-chunk metadata lives in NumPy arrays where row `i` belongs to FAISS
+    id `i`: liveness, timestamp, interned source id, chunk number, content
+    hash, the chunk's byte range in the text arena and its character span in
+    the source document, with the end of the whitespace that follows it. Chunk text is UTF-8 in one contiguous arena; chunks
+    cut from the same document share the bytes of a single copy. Document
+    keys are rebuilt from the source, chunk number and id, so only keys that
+    do not follow the `<source>_chunk_<n>` pattern are stored. Removed rows
+    leave dead bytes behind that `compact` reclaims.
+
+    Not thread-safe; VectorStore serializes access with its locks.
+    """
+
+    def __init__(self, capacity=1024):
+        for name, (dtype, fill) in COLUMNS.items():
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+        self.arena = bytearray()
+        self.sources = []  # source id -> name
+        self.source_lookup = {}  # name -> source id
+        self.source_counts = {}  # name -> live chunks, for sources that have any
+        self.irregular_keys = {}  # FAISS id -> document key
+        self.size = 0  # one past the highest id ever stored
+        self.count = 0  # live chunks
+        self.removed_since_compaction = 0
+        # Set while columns and arena are read-only snapshot memory maps
+        self.read_only = False
+
+    # Writing
+
+    def append_text(self, texts=None, spans=None, source_text=None):
+        """Copy chunk texts into the arena and return their `(offsets, lengths)`.
+
+        With `spans` and `source_text` the covered part of the document is
+        stored once and the chunks point into it; otherwise each text is
+        stored on its own.
+        """
+        return self.append_encoded(encode_texts(texts, spans, source_text))
+
+    def append_encoded(self, encoded):
+        """Append the result of `encode_texts` and return the `(offsets, lengths)` of its texts."""
+        self._ensure_writable()
+        data, offsets, lengths = encoded
+        base = len(self.arena)
+        self.arena += data
+        return offsets + base, lengths
+
+    def add(self, faiss_ids, document_ids, hashes, added_at, text_refs, spans=None, space_ends=None):
+        """Store new chunks. `text_refs` is the result of `append_text`.
+
+        `space_ends` holds, for each span, where the whitespace after it ends
+        in the source document.
+        """
+        self._ensure_writable()
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)
+        if len(faiss_ids) == 0:
+            return
+        self._reserve(int(faiss_ids.max()) + 1)
+
+        source_ids = np.empty(len(faiss_ids), dtype=np.int32)
+        chunk_numbers = np.empty(len(faiss_ids), dtype=np.int64)
+        for row, (faiss_id, document_id) in enumerate(zip(faiss_ids, document_ids)):
+            source, chunk_number = parse_document_id(document_id)
+            source_id = self.intern_source(source)
+            source_ids[row] = source_id
+            chunk_numbers[row] = chunk_number
+            self.source_counts[source] = self.source_counts.get(source, 0) + 1
+            if self._canonical_document_id(source, chunk_number) != document_id:
+                self.irregular_keys[int(faiss_id)] = f"{document_id}_{faiss_id}"
+
+        self.alive[faiss_ids] = True
+        self.added_at[faiss_ids] = added_at
+        self.source_ids[faiss_ids] = source_ids
+        self.chunk_numbers[faiss_ids] = chunk_numbers
+        self.hashes[faiss_ids] = [h.encode("ascii") for h in hashes]
+        self.text_offsets[faiss_ids], self.text_lengths[faiss_ids] = text_refs
+        if spans is not None:
+            spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+            self.doc_starts[faiss_ids] = spans[:, 0]
+            self.doc_ends[faiss_ids] = spans[:, 1]
+            self.doc_space_ends[faiss_ids] = spans[:, 1] if space_ends is None else space_ends
+
+        self.size = max(self.size, int(faiss_ids.max()) + 1)
+        self.count += len(faiss_ids)
+
+    def set_text(self, faiss_ids, text_refs, spans, space_ends=None):
+        """Point existing chunks at new text, e.g. the latest copy of their document."""
+        self._ensure_writable()
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)
+        if len(faiss_ids) == 0:
+            return
+        self.text_offsets[faiss_ids], self.text_lengths[faiss_ids] = text_refs
+        spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+        self.doc_starts[faiss_ids] = spans[:, 0]
+        self.doc_ends[faiss_ids] = spans[:, 1]
+        self.doc_space_ends[faiss_ids] = spans[:, 1] if space_ends is None else space_ends
+        self.removed_since_compaction += len(faiss_ids)
+
+    def remove(self, faiss_ids):
+        """Remove chunks; returns the ids that were live."""
+        self._ensure_writable()
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)
+        faiss_ids = faiss_ids[(faiss_ids >= 0) & (faiss_ids < self.size)]
+        faiss_ids = np.unique(faiss_ids[self.alive[faiss_ids]])
+
+        self.alive[faiss_ids] = False
+        for source_id in self.source_ids[faiss_ids].tolist():
+            source = self.sources[source_id]
+            if self.source_counts[source] == 1:
+                del self.source_counts[source]
+            else:
+                self.source_counts[source] -= 1
+        for faiss_id in faiss_ids:
+            self.irregular_keys.pop(int(faiss_id), None)
+
+        self.count -= len(faiss_ids)
+        self.removed_since_compaction += len(faiss_ids)
+        return faiss_ids
+
+    def needs_compaction(self):
+        """Whether enough text was released since the last compaction to run `compact`."""
+        return self.removed_since_compaction > max(self.count, 1024)
+
+    def intern_source(self, source):
+        source_id = self.source_lookup.get(source)
+        if source_id is None:
+            source_id = len(self.sources)
+            self.sources.append(source)
+            self.source_lookup[source] = source_id
+        return source_id
+
+    def compact(self):
+        """Rewrite the arena with only the bytes that live chunks still use."""
+        self.finish_compaction(self.plan_compaction())
+
+    def plan_compaction(self):
+        """Build the compacted arena without changing the store; see `compact`.
+
+        Overlapping chunks of one document keep sharing their bytes: live
+        byte ranges are merged into regions and each region is copied once.
+        Only reads the store, so it can run alongside searches. Returns a
+        plan for `finish_compaction`, valid until the store is next written.
+        """
+        live_ids = self.live_ids()
+        if len(live_ids) == 0:
+            return live_ids, bytearray(), np.empty(0, dtype=np.int64)
+
+        starts = self.text_offsets[live_ids]
+        ends = starts + self.text_lengths[live_ids]
+        order = np.argsort(starts, kind="stable")
+        starts, ends, live_ids = starts[order], ends[order], live_ids[order]
+
+        # A new region starts wherever a range begins after everything before it ended
+        reach = np.maximum.accumulate(ends)
+        region_begins = np.concatenate(([True], starts[1:] > reach[:-1]))
+        region_of_row = np.cumsum(region_begins) - 1
+        first_rows = np.flatnonzero(region_begins)
+        region_starts = starts[first_rows]
+        region_ends = np.maximum.reduceat(ends, first_rows)
+
+        arena = bytearray()
+        new_region_starts = np.empty(len(first_rows), dtype=np.int64)
+        for region, (start, end) in enumerate(zip(region_starts, region_ends)):
+            new_region_starts[region] = len(arena)
+            arena += self.arena[start:end]
+
+        offsets = new_region_starts[region_of_row] + (starts - region_starts[region_of_row])
+        return live_ids, arena, offsets
+
+    def finish_compaction(self, plan):
+        """Switch to the arena built by `plan_compaction`."""
+        self._ensure_writable()
+        live_ids, arena, offsets = plan
+        before = len(self.arena)
+        self.text_offsets[live_ids] = offsets
+        self.arena = arena
+        self.removed_since_compaction = 0
+        logger.info(f"Compacted chunk text arena from {before} to {len(arena)} bytes")
+
+    # Reading
+
+    def is_alive(self, faiss_id):
+        return 0 <= faiss_id < self.size and bool(self.alive[faiss_id])
+
+    def live_ids(self):
+        return np.flatnonzero(self.alive[:self.size])
+
+    def text(self, faiss_id):
+        offset = int(self.text_offsets[faiss_id])
+        return bytes(self.arena[offset:offset + int(self.text_lengths[faiss_id])]).decode("utf-8")
+
+    def source(self, faiss_id):
+        return self.sources[self.source_ids[faiss_id]]
+
+    def key(self, faiss_id):
+        """Document key of a chunk: `<document id>_<FAISS id>`."""
+        faiss_id = int(faiss_id)
+        key = self.irregular_keys.get(faiss_id)
+        if key is not None:
+            return key
+        document_id = self._canonical_document_id(self.source(faiss_id), int(self.chunk_numbers[faiss_id]))
+        return f"{document_id}_{faiss_id}"
+
+    def ids_for_source(self, source):
+        """Live FAISS ids of a source's chunks, in id order."""
+        source_id = self.source_lookup.get(source)
+        if source_id is None or source not in self.source_counts:
+            return np.empty(0, dtype=np.int64)
+        rows = self.source_ids[:self.size]
+        return np.flatnonzero((rows == source_id) & self.alive[:self.size])
+
+    def nbytes(self):
+        """Memory held by the columns and the arena."""
+        return sum(getattr(self, name).nbytes for name in COLUMNS) + len(self.arena)
+
+    # Persistence
+
+    def save(self, directory):
+        """Write columns, arena and source table into `directory`."""
+        for name in COLUMNS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name)[:self.size])
+        with open(os.path.join(directory, ARENA_FILE), "wb") as f:
+            f.write(self.arena)
+        with open(os.path.join(directory, SOURCES_FILE), "w") as f:
+            json.dump({"sources": self.sources, "counts": self.source_counts}, f)
+        with open(os.path.join(directory, KEYS_FILE), "w") as f:
+            json.dump({str(faiss_id): key for faiss_id, key in self.irregular_keys.items()}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=True):
+        """Load a store written by `save`, memory-mapping it with `mmap_mode`.
+
+        A memory-mapped store is copied into memory on its first write.
+        """
+        store = cls(capacity=0)
+        for name, (dtype, fill) in COLUMNS.items():
+            column_path = os.path.join(directory, f"{name}.npy")
+            if os.path.exists(column_path):
+                setattr(store, name, np.load(column_path, mmap_mode="r" if mmap_mode else None))
+            else:
+                # Snapshot from before the column existed
+                setattr(store, name, np.full(len(store.alive), fill, dtype=dtype))
+
+        arena_path = os.path.join(directory, ARENA_FILE)
+        if mmap_mode and os.path.getsize(arena_path) > 0:
+            with open(arena_path, "rb") as f:
+                store.arena = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(arena_path, "rb") as f:
+                store.arena = bytearray(f.read())
+        store.read_only = bool(mmap_mode)
+
+        with open(os.path.join(directory, SOURCES_FILE)) as f:
+            sources = json.load(f)
+        store.sources = sources["sources"]
+        store.source_counts = sources["counts"]
+        store.source_lookup = {source: source_id for source_id, source in enumerate(store.sources)}
+        with open(os.path.join(directory, KEYS_FILE)) as f:
+            store.irregular_keys = {int(faiss_id): key for faiss_id, key in json.load(f).items()}
+
+        store.size = len(store.alive)
+        store.count = int(np.count_nonzero(store.alive))
+        return store
+
+    # Internals
+
+    def _canonical_document_id(self, source, chunk_number):
+        return f"{source}_chunk_{chunk_number}" if chunk_number >= 0 else source
+
+    def _reserve(self, capacity):
+        current = len(self.alive)
+        if capacity <= current:
+            return
+        new_capacity = max(capacity, current * 2, 1024)
+        for name, (dtype, fill) in COLUMNS.items():
+            column = np.full(new_capacity, fill, dtype=dtype)
+            column[:current] = getattr(self, name)
+            setattr(self, name, column)
+
+    def _ensure_writable(self):
+        """Copy memory-mapped snapshot data into memory before the first write."""
+        if not self.read_only:
+            return
+        for name in COLUMNS:
+            setattr(self, name, np.array(getattr(self, name)))
+        self.arena = bytearray(self.arena)
+        self.read_only = False
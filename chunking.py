@@ -0,0 +1,203 @@
+import logging
+import re
+import document_stream
+
+logger = logging.getLogger(__name__)
+
+# Rough stand-in for a subword tokenizer: words and punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# A blank line ends a paragraph; sentence punctuation (optionally followed by
+# a closing quote or bracket) or a single newline ends a sentence
+BOUNDARY_PATTERN = re.compile(
+    r"(?P<paragraph>\n[ \t]*\n\s*)|(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+|\n\s*"
+)
+
+WORD_PATTERN = re.compile(r"\S+")
+
+def approximate_token_count(text):
+    """Approximate number of model tokens in `text`."""
+    return len(TOKEN_PATTERN.findall(text))
+
+def strip_span(text, start, end):
+    """Shrink `(start, end)` so the span neither starts nor ends with whitespace."""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def whitespace_end(text, position):
+    """Offset of the first non-whitespace character of `text` at or after `position`."""
+    while position < len(text) and text[position].isspace():
+        position += 1
+    return position
+
+class FixedSizeChunker:
+    """Fixed-size character windows with a character overlap."""
+
+    name = "fixed"
+
+    def __init__(self, chunk_size=1000, overlap=200):
+        if not 0 <= overlap < chunk_size:
+            raise ValueError(f"Overlap {overlap} must be smaller than chunk size {chunk_size}")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    def split(self, text):
+        """Return `(start, end)` spans of the chunks of `text`."""
+        if not text or not text.strip():
+            return []
+        # Handle short documents without chunking
+        if len(text) < self.chunk_size:
+            return [(0, len(text))]
+        spans = []
+        for start in range(0, len(text), self.chunk_size - self.overlap):
+            end = min(start + self.chunk_size, len(text))
+            if text[start:end].strip():
+                spans.append((start, end))
+        return spans
+
+    def iter_chunks(self, pieces):
+        """Chunk streamed text pieces; see document_stream.iter_chunks."""
+        return document_stream.iter_chunks(pieces, self.chunk_size, self.overlap)
+
+class SentenceChunker:
+    """Packs whole sentences into chunks of at most `max_tokens` tokens.
+
+    Chunks end at sentence boundaries and, once they are half full, at
+    paragraph breaks. Up to `overlap_tokens` of trailing sentences are
+    repeated at the start of the next chunk within a paragraph. A sentence
+    longer than the budget is split between words. `count_tokens` should be
+    the embedding model's tokenizer when there is one.
+    """
+
+    name = "sentence"
+
+    def __init__(self, max_tokens=256, overlap_tokens=32, count_tokens=None, stream_window=64 * 1024):
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError(f"Overlap {overlap_tokens} must be smaller than max_tokens {max_tokens}")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = count_tokens or approximate_token_count
+        self.stream_window = stream_window
+
+    def split(self, text):
+        """Return `(start, end)` spans of the chunks of `text`."""
+        if not text or not text.strip():
+            return []
+
+        spans = []
+        current = []  # (start, end, tokens) of the sentences in the chunk being built
+        current_tokens = 0
+        has_new = False  # whether `current` holds more than the overlap of the last chunk
+
+        for start, end, tokens, paragraph_end in self._units(text):
+            if current and current_tokens + tokens > self.max_tokens:
+                spans.append((current[0][0], current[-1][1]))
+                current, current_tokens = self._overlap(current, tokens)
+            current.append((start, end, tokens))
+            current_tokens += tokens
+            has_new = True
+
+            if paragraph_end and current_tokens * 2 >= self.max_tokens:
+                spans.append((current[0][0], current[-1][1]))
+                current, current_tokens, has_new = [], 0, False
+
+        if current and has_new:
+            spans.append((current[0][0], current[-1][1]))
+        return spans
+
+    def iter_chunks(self, pieces):
+        """Chunk streamed text pieces, holding about `stream_window` characters.
+
+        The last chunk of each window is held back and re-chunked together
+        with the following text, so chunks never end at a window boundary.
+        """
+        buffer = ""
+        for piece in pieces:
+            buffer += piece
+            if len(buffer) < self.stream_window:
+                continue
+            spans = self.split(buffer)
+            if len(spans) < 2:
+                continue
+            for start, end in spans[:-1]:
+                yield buffer[start:end]
+            buffer = buffer[spans[-1][0]:]
+
+        for start, end in self.split(buffer):
+            yield buffer[start:end]
+
+    def _units(self, text):
+        """Yield `(start, end, tokens, paragraph_end)` for each sentence.
+
+        Sentences over the token budget are broken into runs of words.
+        """
+        position = 0
+        for match in BOUNDARY_PATTERN.finditer(text):
+            yield from self._sentence(text, position, match.start(), match.group("paragraph") is not None)
+            position = match.end()
+        yield from self._sentence(text, position, len(text), True)
+
+    def _sentence(self, text, start, end, paragraph_end):
+        start, end = strip_span(text, start, end)
+        if start == end:
+            return
+        tokens = self.count_tokens(text[start:end])
+        if tokens <= self.max_tokens:
+            yield start, end, tokens, paragraph_end
+            return
+
+        # Too long for one chunk: emit word runs that fit the budget
+        run_start = run_end = None
+        run_tokens = 0
+        for word in WORD_PATTERN.finditer(text, start, end):
+            word_tokens = self.count_tokens(word.group())
+            if run_start is not None and run_tokens + word_tokens > self.max_tokens:
+                yield run_start, run_end, run_tokens, False
+                run_start = None
+                run_tokens = 0
+            if run_start is None:
+                run_start = word.start()
+            run_end = word.end()
+            run_tokens += word_tokens
+        if run_start is not None:
+            yield run_start, run_end, run_tokens, paragraph_end
+
+    def _overlap(self, sentences, next_tokens):
+        """Trailing sentences to repeat in the next chunk, and their token count."""
+        overlap = []
+        tokens = 0
+        for sentence in reversed(sentences):
+            if tokens + sentence[2] > self.overlap_tokens or tokens + sentence[2] + next_tokens > self.max_tokens:
+                break
+            overlap.insert(0, sentence)
+            tokens += sentence[2]
+        return overlap, tokens
+
+CHUNKERS = {
+    SentenceChunker.name: SentenceChunker,
+    FixedSizeChunker.name: FixedSizeChunker,
+}
+
+def create_chunker(strategy="sentence", embedder=None, **options):
+    """Create the chunker registered under `strategy`.
+
+    A sentence chunker counts tokens with the embedder's tokenizer when it
+    has one, and is limited to the model's maximum sequence length unless
+    `max_tokens` is given.
+    """
+    chunker_class = CHUNKERS.get(strategy)
+    if chunker_class is None:
+        raise ValueError(f"Unknown chunking strategy {strategy!r}. Available strategies: {', '.join(CHUNKERS)}")
+
+    if chunker_class is SentenceChunker and embedder is not None:
+        options.setdefault("count_tokens", getattr(embedder, "count_tokens", None))
+        model_max_tokens = getattr(embedder, "max_tokens", None)
+        if model_max_tokens and not options.get("max_tokens"):
+            options["max_tokens"] = model_max_tokens
+    options = {key: value for key, value in options.items() if value is not None}
+
+    logger.info(f"Creating chunker: {strategy}")
+    return chunker_class(**options)
@@ -0,0 +1,214 @@
+import logging
+import re
+import threading
+from chunking import approximate_token_count
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_PATTERN = re.compile(r"\w+")
+
+def shingles(text, size=3):
+    """Set of lowercased word `size`-grams, for near-duplicate detection."""
+    words = SHINGLE_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def text_overlap(left, right, min_overlap=20, max_overlap=2000):
+    """Length of the longest suffix of `left` that is a prefix of `right`, or 0.
+
+    Overlaps shorter than `min_overlap` characters are ignored, as they are
+    more likely coincidence than chunk overlap.
+    """
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    head = right[:min_overlap]
+    window_start = max(0, len(left) - max_overlap)
+    position = left.find(head, window_start)
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(head, position + 1)
+    return 0
+
+class ContextAssembler:
+    """Turns retrieved chunks into the passages sent to the LLM.
+
+    Chunks of the same source that overlap or touch are stitched into one
+    passage, by their document offsets when the store kept them and by
+    matching the overlapping text otherwise. Chunks separated only by
+    whitespace in the source count as touching and are joined with
+    `separator`. Passages that repeat another
+    one (exactly, contained in it, or with a shingle Jaccard similarity of
+    at least `near_duplicate_threshold`) are dropped. The rest are packed
+    best first into `max_tokens`, ranked by reranker score when the chunks
+    were reranked and by retrieval score otherwise; a passage that does not fit is
+    skipped so smaller ones can still use the budget.
+    """
+
+    def __init__(self, max_tokens=2048, count_tokens=None, near_duplicate_threshold=0.9, min_overlap=20,
+                 separator="\n"):
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or approximate_token_count
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.min_overlap = min_overlap
+        self.separator = separator
+
+        self.lock = threading.Lock()
+        self.total_assemblies = 0
+        self.total_input_tokens = 0
+        self.total_output_tokens = 0
+
+    def assemble(self, context):
+        """Merge, dedupe and pack `context`. Returns `(passages, stats)`.
+
+        Each passage is shaped like a search result, with the ids of the
+        chunks it was built from under "chunk_ids" and the best chunk score
+        (and reranker score) as its score.
+        """
+        input_tokens = sum(self.count_tokens(doc.get("text", "")) for doc in context)
+
+        passages = self._merge(context)
+        merged = len(context) - len(passages)
+        passages, duplicates = self._dedupe(passages)
+
+        packed = []
+        output_tokens = 0
+        for passage in passages:
+            tokens = self.count_tokens(passage["text"])
+            if output_tokens + tokens > self.max_tokens:
+                continue
+            packed.append(passage)
+            output_tokens += tokens
+
+        stats = {
+            "input_chunks": len(context),
+            "passages": len(packed),
+            "merged_chunks": merged,
+            "duplicates_dropped": duplicates,
+            "over_budget_dropped": len(passages) - len(packed),
+            "input_tokens": input_tokens,
+            "context_tokens": output_tokens,
+            "prompt_tokens_saved": input_tokens - output_tokens
+        }
+        with self.lock:
+            self.total_assemblies += 1
+            self.total_input_tokens += input_tokens
+            self.total_output_tokens += output_tokens
+
+        logger.info(f"Assembled {len(context)} chunks into {len(packed)} passages, "
+                    f"{input_tokens} -> {output_tokens} tokens")
+        return packed, stats
+
+    def _merge(self, context):
+        """Stitch overlapping or adjacent chunks of each source, best first."""
+        by_source = {}
+        for doc in context:
+            by_source.setdefault(doc.get("source"), []).append(doc)
+
+        passages = []
+        for docs in by_source.values():
+            spanned = sorted((doc for doc in docs if doc.get("span")), key=lambda doc: doc["span"][0])
+            unspanned = [doc for doc in docs if not doc.get("span")]
+
+            source_passages = []
+            for doc in spanned:
+                last = source_passages[-1] if source_passages else None
+                if last is not None and doc["span"][0] <= last["space_end"]:
+                    start, end = doc["span"]
+                    if start > last["span"][1]:
+                        # Only whitespace lies between them
+                        last["text"] += self.separator + doc["text"]
+                    elif end > last["span"][1]:
+                        last["text"] += doc["text"][last["span"][1] - start:]
+                    if end > last["span"][1]:
+                        last["span"] = (last["span"][0], end)
+                        last["space_end"] = self._space_end(doc)
+                    self._absorb(last, doc)
+                else:
+                    source_passages.append(self._passage(doc))
+
+            for doc in unspanned:
+                self._merge_by_text(source_passages, self._passage(doc))
+            passages.extend(source_passages)
+
+        passages.sort(key=self._rank, reverse=True)
+        return passages
+
+    def _merge_by_text(self, passages, passage):
+        """Append `passage`, joining it to a passage whose text it continues or precedes."""
+        for other in passages:
+            overlap = text_overlap(other["text"], passage["text"], self.min_overlap)
+            if overlap:
+                other["text"] += passage["text"][overlap:]
+                other["span"] = None
+                self._absorb(other, passage)
+                return
+            overlap = text_overlap(passage["text"], other["text"], self.min_overlap)
+            if overlap:
+                other["text"] = passage["text"] + other["text"][overlap:]
+                other["span"] = None
+                self._absorb(other, passage)
+                return
+        passages.append(passage)
+
+    def _dedupe(self, passages):
+        """Drop passages repeating a better-ranked one. Returns `(kept, dropped count)`."""
+        kept = []
+        kept_shingles = []
+        for passage in passages:
+            text = passage["text"].strip()
+            passage_shingles = shingles(text)
+            duplicate = False
+            for other, other_shingles in zip(kept, kept_shingles):
+                if text in other["text"]:
+                    duplicate = True
+                elif passage_shingles and other_shingles:
+                    similarity = len(passage_shingles & other_shingles) / len(passage_shingles | other_shingles)
+                    duplicate = similarity >= self.near_duplicate_threshold
+                if duplicate:
+                    self._absorb(other, passage)
+                    break
+            if not duplicate:
+                kept.append(passage)
+                kept_shingles.append(passage_shingles)
+        return kept, len(passages) - len(kept)
+
+    @staticmethod
+    def _passage(doc):
+        passage = dict(doc)
+        passage["chunk_ids"] = [doc.get("id")]
+        passage["span"] = tuple(doc["span"]) if doc.get("span") else None
+        if passage["span"]:
+            passage["space_end"] = ContextAssembler._space_end(doc)
+        passage.setdefault("score", 0.0)
+        return passage
+
+    @staticmethod
+    def _space_end(doc):
+        """Where the whitespace after a spanned chunk ends, or its span end if unknown."""
+        return max(doc["span"][1], doc.get("space_end") or 0)
+
+    @staticmethod
+    def _rank(passage):
+        """Sort key: the reranker's score if the chunks were reranked, else the retrieval score."""
+        return passage.get("rerank_score", passage["score"])
+
+    @staticmethod
+    def _absorb(passage, doc):
+        """Credit `passage` with the chunks and scores of `doc`, which it now covers."""
+        passage["chunk_ids"].extend(doc.get("chunk_ids", [doc.get("id")]))
+        passage["score"] = max(passage["score"], doc.get("score", 0.0))
+        if "rerank_score" in doc:
+            passage["rerank_score"] = max(passage.get("rerank_score", doc["rerank_score"]), doc["rerank_score"])
+
+    def get_metrics(self):
+        """Get prompt token totals before and after assembly."""
+        with self.lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "total_assemblies": self.total_assemblies,
+                "input_tokens": self.total_input_tokens,
+                "context_tokens": self.total_output_tokens,
+                "prompt_tokens_saved": self.total_input_tokens - self.total_output_tokens
+            }
@@ -0,0 +1,196 @@
+import codecs
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the upload per decode step
+READ_SIZE = 64 * 1024
+
+# File types that can be ingested, whether uploaded or picked up from a watched directory
+DOCUMENT_EXTENSIONS = ('.txt', '.md', '.csv', '.json', '.jsonl')
+
+def iter_text(stream, encoding="utf-8", read_size=READ_SIZE):
+    """Decode a binary stream incrementally, yielding text pieces.
+
+    Multi-byte characters split across reads are handled by the incremental
+    decoder. Raises UnicodeDecodeError on invalid input.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def iter_lines(pieces):
+    """Regroup text pieces into lines, keeping line endings."""
+    pending = ""
+    for piece in pieces:
+        pending += piece
+        lines = pending.splitlines(keepends=True)
+        # The last line may continue in the next piece
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        yield from lines
+    if pending:
+        yield pending
+
+def iter_json_array(pieces):
+    """Yield the items of a top-level JSON array one at a time.
+
+    Only the item being decoded is held in memory. Raises json.JSONDecodeError
+    (a ValueError) if the text is not a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    pieces = iter(pieces)
+    buffer = ""
+    exhausted = False
+    expected = "["
+
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if exhausted:
+                raise json.JSONDecodeError("Unterminated JSON array", buffer, 0)
+            piece = next(pieces, None)
+            exhausted = piece is None
+            buffer = piece or ""
+            continue
+
+        if expected == "[":
+            if buffer[0] != "[":
+                raise json.JSONDecodeError("Expected a JSON array", buffer, 0)
+            buffer = buffer[1:]
+            expected = "item or ]"
+        elif expected == ", or ]" or (expected == "item or ]" and buffer[0] == "]"):
+            if buffer[0] == "]":
+                return
+            if buffer[0] != ",":
+                raise json.JSONDecodeError("Expected ',' or ']' in JSON array", buffer, 0)
+            buffer = buffer[1:]
+            expected = "item"
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                item, end = None, None
+            # Read more if the item is incomplete, or is a number that may continue
+            # in the next piece ("4" of "45.5e3")
+            incomplete = end is None or (
+                isinstance(item, (int, float)) and not isinstance(item, bool)
+                and (end == len(buffer) or buffer[end] not in ",] \t\r\n")
+            )
+            if incomplete and not exhausted:
+                piece = next(pieces, None)
+                exhausted = piece is None
+                buffer += piece or ""
+                continue
+            if end is None:
+                raise json.JSONDecodeError("Invalid item in JSON array", buffer, 0)
+            yield item
+            buffer = buffer[end:]
+            expected = ", or ]"
+
+def format_json_document(json_data):
+    """Turn a parsed JSON upload into text for chunking."""
+    # Extract text from common JSON formats
+    if isinstance(json_data, dict):
+        if 'text' in json_data:
+            return json_data['text']
+        if 'content' in json_data:
+            return json_data['content']
+        # Format the JSON nicely for processing
+        return json.dumps(json_data, indent=2)
+    if isinstance(json_data, list):
+        # Join list items into text
+        return '\n\n'.join([str(item) for item in json_data])
+    return str(json_data)
+
+def format_json_record(record):
+    """Text of one JSON Lines record."""
+    if isinstance(record, dict):
+        return str(record.get('text', record.get('content', json.dumps(record))))
+    return str(record)
+
+def _join_records(records):
+    """Yield records as text separated by blank lines."""
+    for i, record in enumerate(records):
+        if i:
+            yield '\n\n'
+        yield record
+
+def iter_document_text(stream, file_ext):
+    """Yield the text of an uploaded document piece by piece.
+
+    Plain text, Markdown and CSV are passed through as decoded. JSON Lines
+    and JSON arrays are parsed one record at a time and rendered the same
+    way as a whole-file upload. A top-level JSON object cannot be split
+    without knowing which field holds the text, so it is parsed whole.
+    """
+    pieces = iter_text(stream)
+
+    if file_ext == '.jsonl':
+        records = (
+            format_json_record(json.loads(line))
+            for line in iter_lines(pieces) if line.strip()
+        )
+        yield from _join_records(records)
+        return
+
+    if file_ext == '.json':
+        # Peek at the first significant character to pick the parser
+        head = ""
+        for piece in pieces:
+            head += piece
+            if head.strip():
+                break
+        rest = _prepend(head, pieces)
+        if head.lstrip().startswith("["):
+            yield from _join_records(str(item) for item in iter_json_array(rest))
+        else:
+            yield format_json_document(json.loads("".join(rest)))
+        return
+
+    yield from pieces
+
+def _prepend(head, pieces):
+    if head:
+        yield head
+    yield from pieces
+
+def iter_chunks(pieces, chunk_size=1000, overlap=200):
+    """Split streamed text into overlapping chunks.
+
+    Produces the same chunks as slicing the whole text at multiples of
+    `chunk_size - overlap`, but only keeps one chunk plus the current piece
+    in memory. Whitespace-only chunks are skipped.
+    """
+    step = chunk_size - overlap
+    buffer = ""
+    split = False
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            chunk = buffer[:chunk_size]
+            if chunk.strip():
+                yield chunk
+            buffer = buffer[step:]
+            split = True
+
+    # Handle short documents without chunking
+    if not split:
+        if buffer.strip():
+            yield buffer
+        return
+
+    # Chunks starting in the tail, as whole-text slicing would produce them
+    while buffer:
+        chunk = buffer[:chunk_size]
+        if chunk.strip():
+            yield chunk
+        buffer = buffer[step:]
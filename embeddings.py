@@ -0,0 +1,145 @@
+import logging
+import os
+import hashlib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# An MD5 digest is 16 bytes, so hash embeddings carry at most 16 dimensions
+HASH_DIGEST_SIZE = 16
+
+def embed(texts, vector_dim=HASH_DIGEST_SIZE):
+    """Create deterministic hash-based embeddings for a batch of texts.
+
+    Returns an (N, vector_dim) float32 matrix of L2-normalized rows. The MD5
+    digests of all texts are concatenated and viewed as one uint8 buffer, so
+    the per-text work is a single hash call.
+    """
+    count = len(texts)
+    matrix = np.zeros((count, vector_dim), dtype=np.float32)
+    if count == 0:
+        return matrix
+
+    digests = b"".join(hashlib.md5(text.encode()).digest() for text in texts)
+    raw = np.frombuffer(digests, dtype=np.uint8).reshape(count, HASH_DIGEST_SIZE)
+
+    # Pad or truncate to vector_dim; the 1/255 byte scaling is dropped because
+    # normalization below cancels it
+    min_dim = min(HASH_DIGEST_SIZE, vector_dim)
+    matrix[:, :min_dim] = raw[:, :min_dim]
+
+    # Normalize every row in one step (important for meaningful cosine similarity)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+    return matrix
+
+def embed_one(text, vector_dim=HASH_DIGEST_SIZE):
+    """Create a hash-based embedding for a single text as a 1-D vector."""
+    return embed([text], vector_dim)[0]
+
+class HashEmbeddingProvider:
+    """Embedding provider backed by the deterministic MD5 hasher."""
+
+    name = "hash"
+
+    def __init__(self, vector_dim=HASH_DIGEST_SIZE):
+        self.dimension = vector_dim
+
+    def embed(self, texts):
+        """Embed a batch of texts into an (N, dimension) float32 matrix."""
+        return embed(texts, self.dimension)
+
+    def embed_one(self, text):
+        """Embed a single text into a 1-D vector."""
+        return embed_one(text, self.dimension)
+
+class SentenceTransformerProvider:
+    """Embedding provider that runs a sentence-transformer model on the CPU.
+
+    The model is loaded from a local directory with the Hugging Face hub
+    switched to offline mode, so no network access is needed.
+    """
+
+    name = "sentence-transformer"
+
+    def __init__(self, model_path, batch_size=32, num_threads=None):
+        if not model_path or not os.path.isdir(model_path):
+            raise ValueError(f"Embedding model directory not found: {model_path!r}")
+
+        # Never reach out to the hub; the model must be fully local
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "The sentence-transformer embedding provider requires the "
+                "'sentence-transformers' package"
+            ) from e
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.model = SentenceTransformer(model_path, device="cpu")
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        # Longest input the model reads; the special tokens take two positions
+        self.max_tokens = max(1, self.model.max_seq_length - 2)
+
+        logger.info(f"Loaded embedding model from {model_path} with dimension {self.dimension}")
+
+    def __getstate__(self):
+        # Ship only the configuration to worker processes; they load the model themselves
+        return {"model_path": self.model_path, "batch_size": self.batch_size, "num_threads": self.num_threads}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def embed(self, texts):
+        """Embed a batch of texts into an (N, dimension) float32 matrix."""
+        if len(texts) == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        matrix = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return np.ascontiguousarray(matrix, dtype=np.float32)
+
+    def embed_one(self, text):
+        """Embed a single text into a 1-D vector."""
+        return self.embed([text])[0]
+
+    def count_tokens(self, text):
+        """Number of model tokens in `text`, without special tokens."""
+        return len(self.model.tokenizer.tokenize(text))
+
+EMBEDDING_PROVIDERS = {
+    HashEmbeddingProvider.name: HashEmbeddingProvider,
+    SentenceTransformerProvider.name: SentenceTransformerProvider,
+}
+
+def create_embedding_provider(provider="hash", **options):
+    """Create the embedding provider registered under `provider`.
+
+    Options are passed to the provider constructor, e.g. `vector_dim` for the
+    hash provider or `model_path`, `batch_size` and `num_threads` for the
+    sentence-transformer provider.
+    """
+    provider_class = EMBEDDING_PROVIDERS.get(provider)
+    if provider_class is None:
+        raise ValueError(
+            f"Unknown embedding provider {provider!r}. "
+            f"Available providers: {', '.join(EMBEDDING_PROVIDERS)}"
+        )
+
+    logger.info(f"Creating embedding provider: {provider}")
+    return provider_class(**options)
@@ -0,0 +1,86 @@
+import logging
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Supported FAISS index layouts
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+
+# Index types that have to be trained before vectors can be added
+TRAINED_INDEX_TYPES = ("ivf", "ivfpq")
+
+# FAISS warns when it gets fewer than 39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+def create_index(index_type, vector_dim, nlist=100, hnsw_m=32, pq_m=8, pq_nbits=8):
+    """Create an empty L2 FAISS index of the requested type.
+
+    Every index accepts explicit ids through `add_with_ids`: IVF indexes
+    natively, flat and HNSW through an IndexIDMap2 wrapper. IVF indexes are
+    returned untrained; call `training_size` to find out how many vectors
+    they need before `train` can be called.
+    """
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(vector_dim))
+    if index_type == "hnsw":
+        return faiss.IndexIDMap2(faiss.IndexHNSWFlat(vector_dim, hnsw_m))
+    if index_type == "ivf":
+        quantizer = faiss.IndexFlatL2(vector_dim)
+        return faiss.IndexIVFFlat(quantizer, vector_dim, nlist, faiss.METRIC_L2)
+    if index_type == "ivfpq":
+        if vector_dim % pq_m != 0:
+            raise ValueError(f"Vector dimension {vector_dim} is not divisible by pq_m={pq_m}")
+        quantizer = faiss.IndexFlatL2(vector_dim)
+        return faiss.IndexIVFPQ(quantizer, vector_dim, nlist, pq_m, pq_nbits)
+
+    raise ValueError(f"Unknown index type {index_type!r}. Supported types: {', '.join(INDEX_TYPES)}")
+
+def supports_removal(index_type):
+    """Whether vectors can be physically removed from this index type.
+
+    HNSW graphs cannot drop nodes, so deleted HNSW vectors stay in place and
+    are filtered out at search time.
+    """
+    return index_type != "hnsw"
+
+def export_vectors(index):
+    """Return `(vectors, ids)` for every vector in an id-mapped flat or HNSW index."""
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    return vectors, ids
+
+def training_size(index_type, nlist=100, pq_nbits=8):
+    """Number of vectors needed before an index of this type can be trained."""
+    if index_type == "ivf":
+        return MIN_POINTS_PER_CENTROID * nlist
+    if index_type == "ivfpq":
+        # The PQ codebooks need enough points for their 2**nbits centroids too
+        return MIN_POINTS_PER_CENTROID * max(nlist, 2 ** pq_nbits)
+    return 0
+
+def mmap_read_flag(index_type, is_trained=True):
+    """FAISS `read_index` flag that memory-maps a saved index, or None if unsupported.
+
+    IO_FLAG_MMAP only maps the inverted lists of IVF indexes. Flat and HNSW
+    indexes, including the flat buffer of an untrained IVF store, need
+    IO_FLAG_MMAP_IFC (FAISS 1.8+), which maps their vector storage.
+    """
+    if index_type in TRAINED_INDEX_TYPES and is_trained:
+        return faiss.IO_FLAG_MMAP
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+
+def search_parameters(index, nprobe=None, ef_search=None):
+    """Build per-query FAISS search parameters for `index`, or None for defaults.
+
+    Passing parameters per call avoids mutating the shared index, so
+    concurrent queries can use different settings.
+    """
+    if isinstance(index, faiss.IndexIDMap):
+        # IndexIDMap forwards search parameters to the index it wraps
+        index = faiss.downcast_index(index.index)
+    if nprobe and isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
@@ -0,0 +1,268 @@
+import json
+import logging
+import math
+import os
+import re
+from array import array
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Snapshot files: flat postings of all terms, each term's slice of them
+# starting at its offset, and the length of every chunk
+POSTINGS_IDS_FILE = "bm25_ids.npy"
+POSTINGS_TFS_FILE = "bm25_tfs.npy"
+OFFSETS_FILE = "bm25_offsets.npy"
+DOC_LENGTHS_FILE = "bm25_doc_lengths.npy"
+TERMS_FILE = "bm25_terms.json"
+
+def tokenize(text):
+    """Lowercased word tokens used for indexing and querying."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def term_frequencies(text):
+    """Map of term -> count for one text."""
+    counts = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+class BM25Index:
+    """In-memory BM25 inverted index over chunks, keyed by FAISS id.
+
+    Postings live in two flat arrays, chunk ids (int64) and term
+    frequencies (int32), with each term's postings a slice starting at its
+    offset, so a posting costs 12 bytes. Loaded from a snapshot these are
+    read-only memory maps. A write copies the postings of each term it
+    touches into growable arrays, which shadow the flat slice from then on.
+    Removals only mark the chunk dead and adjust document frequencies, and
+    dead postings are dropped by `compact`, which rebuilds the flat arrays;
+    `needs_compaction` says when they make up half of all postings. Not
+    thread-safe; VectorStore guards it with its lock.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms = {}  # term -> term id
+        self.flat_ids = np.empty(0, dtype=np.int64)
+        self.flat_tfs = np.empty(0, dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)  # term id -> start of its slice, one past the last term at the end
+        self.postings_ids = {}  # term id -> array('q'), for terms written since the flat arrays were built
+        self.postings_tfs = {}  # term id -> array('i')
+        self.doc_freqs = []  # term id -> live chunks containing the term
+        self.doc_lengths = np.zeros(0, dtype=np.int32)  # FAISS id -> tokens, 0 once removed
+        self.doc_count = 0
+        self.total_length = 0
+        self.total_postings = 0
+        self.dead_postings = 0
+        # Set while doc_lengths is a read-only snapshot memory map
+        self.read_only = False
+
+    def add(self, faiss_ids, term_counts):
+        """Index new chunks; `term_counts` holds `term_frequencies` of each chunk's text."""
+        if len(faiss_ids) == 0:
+            return
+        self._ensure_writable()
+        self._reserve(int(max(faiss_ids)) + 1)
+
+        for faiss_id, counts in zip(faiss_ids, term_counts):
+            faiss_id = int(faiss_id)
+            length = sum(counts.values())
+            for term, count in counts.items():
+                term_id = self.terms.get(term)
+                if term_id is None:
+                    term_id = len(self.doc_freqs)
+                    self.terms[term] = term_id
+                    self.doc_freqs.append(0)
+                term_ids, term_tfs = self._writable_postings(term_id)
+                term_ids.append(faiss_id)
+                term_tfs.append(count)
+                self.doc_freqs[term_id] += 1
+
+            # Empty chunks count as one token, so a length of 0 can mark removal
+            self.doc_lengths[faiss_id] = max(length, 1)
+            self.doc_count += 1
+            self.total_length += int(self.doc_lengths[faiss_id])
+            self.total_postings += len(counts)
+
+    def remove(self, faiss_ids, term_counts):
+        """Unindex chunks; `term_counts` are the term frequencies they were added with."""
+        self._ensure_writable()
+        for faiss_id, counts in zip(faiss_ids, term_counts):
+            faiss_id = int(faiss_id)
+            if faiss_id >= len(self.doc_lengths) or self.doc_lengths[faiss_id] == 0:
+                continue
+            for term in counts:
+                term_id = self.terms.get(term)
+                if term_id is not None:
+                    self.doc_freqs[term_id] -= 1
+
+            self.doc_count -= 1
+            self.total_length -= int(self.doc_lengths[faiss_id])
+            self.doc_lengths[faiss_id] = 0
+            self.dead_postings += len(counts)
+
+    def needs_compaction(self):
+        """Whether dead postings make up enough of the index to run `compact`."""
+        return self.dead_postings * 2 > self.total_postings
+
+    def search(self, query, top_k=5):
+        """Return `(faiss_ids, scores)` of the best BM25 matches, best first."""
+        if self.doc_count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        average_length = max(self.total_length / self.doc_count, 1.0)
+        matched_ids = []
+        matched_scores = []
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None or self.doc_freqs[term_id] == 0:
+                continue
+
+            ids, tfs = self._postings(term_id)
+            tfs = tfs.astype(np.float32)
+            lengths = self.doc_lengths[ids]
+            live = lengths > 0
+            ids, tfs, lengths = ids[live], tfs[live], lengths[live]
+
+            doc_freq = self.doc_freqs[term_id]
+            idf = math.log(1 + (self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths / average_length)
+            matched_ids.append(ids)
+            matched_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+        if not matched_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # Sum the per-term contributions of every matched chunk
+        unique_ids, inverse = np.unique(np.concatenate(matched_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(matched_scores)).astype(np.float32)
+
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return unique_ids[best], scores[best]
+
+    def compact(self):
+        """Rebuild the flat postings without removed chunks."""
+        self.finish_compaction(self.plan_compaction())
+
+    def plan_compaction(self):
+        """Build the compacted postings without changing the index; see `compact`.
+
+        Only reads the index, so it can run alongside searches. The plan is
+        valid until the index is next written.
+        """
+        return self._live_postings()
+
+    def finish_compaction(self, plan):
+        """Switch to the postings built by `plan_compaction`."""
+        self.flat_ids, self.flat_tfs, self.offsets = plan
+        self.postings_ids = {}
+        self.postings_tfs = {}
+        self.total_postings = len(self.flat_ids)
+        self.dead_postings = 0
+        logger.info(f"Compacted BM25 postings to {self.total_postings} entries")
+
+    def nbytes(self):
+        """Approximate memory held by postings and document lengths."""
+        return self.total_postings * 12 + self.dead_postings * 12 + self.doc_lengths.nbytes
+
+    def save(self, directory):
+        """Write the live postings into `directory` as flat arrays."""
+        ids, tfs, offsets = self._live_postings()
+        np.save(os.path.join(directory, POSTINGS_IDS_FILE), ids)
+        np.save(os.path.join(directory, POSTINGS_TFS_FILE), tfs)
+        np.save(os.path.join(directory, OFFSETS_FILE), offsets)
+        np.save(os.path.join(directory, DOC_LENGTHS_FILE), self.doc_lengths)
+        terms = sorted(self.terms, key=self.terms.get)
+        with open(os.path.join(directory, TERMS_FILE), "w") as f:
+            json.dump({
+                "k1": self.k1, "b": self.b,
+                "doc_count": self.doc_count, "total_length": self.total_length,
+                "terms": terms
+            }, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load an index written by `save`, or None if the snapshot has none.
+
+        With `mmap` the postings and document lengths are memory-mapped, so
+        loading costs only the term table and worker processes share the
+        pages. Postings are copied into memory term by term as writes touch
+        them.
+        """
+        terms_path = os.path.join(directory, TERMS_FILE)
+        if not os.path.exists(terms_path) or not os.path.exists(os.path.join(directory, OFFSETS_FILE)):
+            return None
+        with open(terms_path) as f:
+            header = json.load(f)
+        index = cls(k1=header["k1"], b=header["b"])
+        index.terms = {term: term_id for term_id, term in enumerate(header["terms"])}
+
+        mmap_mode = "r" if mmap else None
+        index.flat_ids = np.load(os.path.join(directory, POSTINGS_IDS_FILE), mmap_mode=mmap_mode)
+        index.flat_tfs = np.load(os.path.join(directory, POSTINGS_TFS_FILE), mmap_mode=mmap_mode)
+        index.offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode=mmap_mode)
+        index.doc_lengths = np.load(os.path.join(directory, DOC_LENGTHS_FILE), mmap_mode=mmap_mode)
+        index.read_only = mmap
+
+        # Saved postings are all live, so each term's slice length is its document frequency
+        index.doc_freqs = np.diff(index.offsets).tolist()
+        index.doc_count = header["doc_count"]
+        index.total_length = header["total_length"]
+        index.total_postings = len(index.flat_ids)
+        return index
+
+    def _postings(self, term_id):
+        """`(ids, tfs)` arrays of a term's postings, live or not."""
+        if term_id in self.postings_ids:
+            return (np.array(self.postings_ids[term_id], dtype=np.int64),
+                    np.array(self.postings_tfs[term_id], dtype=np.int32))
+        if term_id + 1 < len(self.offsets):
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            return self.flat_ids[start:end], self.flat_tfs[start:end]
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+
+    def _writable_postings(self, term_id):
+        """Growable postings arrays of a term, copied from the flat arrays on first use."""
+        if term_id not in self.postings_ids:
+            ids, tfs = self._postings(term_id)
+            self.postings_ids[term_id] = array("q", np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+            self.postings_tfs[term_id] = array("i", np.ascontiguousarray(tfs, dtype=np.int32).tobytes())
+        return self.postings_ids[term_id], self.postings_tfs[term_id]
+
+    def _live_postings(self):
+        """Flat `(ids, tfs, offsets)` of every term's postings of live chunks."""
+        all_ids = []
+        all_tfs = []
+        for term_id in range(len(self.doc_freqs)):
+            ids, tfs = self._postings(term_id)
+            live = self.doc_lengths[ids] > 0
+            all_ids.append(ids[live])
+            all_tfs.append(tfs[live])
+        lengths = np.array([len(ids) for ids in all_ids], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        ids = np.concatenate(all_ids).astype(np.int64) if all_ids else np.empty(0, dtype=np.int64)
+        tfs = np.concatenate(all_tfs).astype(np.int32) if all_tfs else np.empty(0, dtype=np.int32)
+        return ids, tfs, offsets
+
+    def _ensure_writable(self):
+        """Copy memory-mapped document lengths into memory before the first write."""
+        if not self.read_only:
+            return
+        self.doc_lengths = np.array(self.doc_lengths)
+        self.read_only = False
+
+    def _reserve(self, capacity):
+        current = len(self.doc_lengths)
+        if capacity <= current:
+            return
+        lengths = np.zeros(max(capacity, current * 2, 1024), dtype=np.int32)
+        lengths[:current] = self.doc_lengths
+        self.doc_lengths = lengths
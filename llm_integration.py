@@ -4,13 +4,19 @@ import requests
 import json
 import time
 import re
+import httpx
+from llm_transport import get_default_transport, get_default_async_transport
 
 logger = logging.getLogger(__name__)
 
 class TogetherAILLM:
-    def __init__(self):
+    def __init__(self, transport=None):
         self.api_key = os.environ.get("TOGETHER_API_KEY", "8f4e453642e216b2300307f5babe482dc8f3ee0f00f5e19a7636ae79ec47f3a8")
-        self.base_url = "https://api.together.xyz/v1"
+        self.base_url = os.environ.get("TOGETHER_API_BASE_URL", "https://api.together.xyz/v1")
+        # Pooled, retrying HTTP transport shared by all LLM clients
+        self.transport = transport or get_default_transport()
+        # Async transport for agenerate_response, created on first use
+        self.async_transport = None
         self.model = "mistralai/Mixtral-8x7B-Instruct-v0.1"  # Default model
         
         # Check API key on initialization
@@ -32,88 +38,228 @@ class TogetherAILLM:
         self.total_requests += 1
         
         # Extract key terms for better mock responses if API key is missing
-        key_terms = self._extract_key_terms(prompt)
-        if context:
-            for doc in context:
-                key_terms.extend(self._extract_key_terms(doc.get('text', '')))
-                
-        # Prepare the full prompt with context
-        full_prompt = self._prepare_prompt(prompt, context)
-        
-        # Prepare request payload
-        payload = {
-            "model": self.model,
-            "prompt": full_prompt,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "top_p": 0.9,
-            "top_k": 50,
-            "stop": ["User:", "<|im_end|>"]
-        }
+        key_terms = self._collect_key_terms(prompt, context)
+        payload = self._build_payload(prompt, context, max_tokens, temperature)
         
         # Check if API key exists
         if not self.api_key:
-            # Generate a more contextualized mock response using the context and query
-            mock_response = self._generate_mock_response(prompt, context, key_terms)
-            self.successful_requests += 1
-            
-            return mock_response, {
-                "latency": time.time() - start_time, 
-                "tokens": len(mock_response.split()),
-                "is_mock": True
-            }
+            return self._mock_result(prompt, context, key_terms, start_time)
         
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
             logger.info(f"Sending request to Together AI API for '{prompt[:50]}...'")
-            response = requests.post(
+            response = self.transport.post(
                 f"{self.base_url}/completions",
-                headers=headers,
+                headers=self._headers(),
                 json=payload,
                 timeout=10  # Adding timeout to avoid hanging
             )
             
-            response.raise_for_status()
-            response_data = response.json()
+            response_text, metrics = self._completion_result(response.json(), start_time)
+            logger.info(f"Generated response with {metrics['tokens_generated']} tokens in {metrics['latency']:.2f}s")
+            return response_text, metrics
             
-            response_text = response_data.get("choices", [{}])[0].get("text", "")
-            tokens_generated = response_data.get("usage", {}).get("completion_tokens", 0)
-            tokens_total = response_data.get("usage", {}).get("total_tokens", 0)
+        except (requests.RequestException, json.JSONDecodeError) as e:
+            return self._handle_failure(e, prompt, context, key_terms, start_time)
+    
+    async def agenerate_response(self, prompt, context=None, max_tokens=1024, temperature=0.7):
+        """Generate a response from the LLM without blocking the event loop.
+        
+        Returns the same `(response, metrics)` pair as `generate_response`.
+        Cancelling the awaiting task aborts the upstream request.
+        """
+        start_time = time.time()
+        self.total_requests += 1
+        
+        key_terms = self._collect_key_terms(prompt, context)
+        payload = self._build_payload(prompt, context, max_tokens, temperature)
+        
+        if not self.api_key:
+            return self._mock_result(prompt, context, key_terms, start_time)
+        
+        if self.async_transport is None:
+            self.async_transport = get_default_async_transport()
+        
+        try:
+            logger.info(f"Sending async request to Together AI API for '{prompt[:50]}...'")
+            response = await self.async_transport.post(
+                f"{self.base_url}/completions",
+                headers=self._headers(),
+                json=payload,
+                timeout=10
+            )
             
-            # Update stats
-            self.successful_requests += 1
-            self.total_tokens_generated += tokens_generated
+            response_text, metrics = self._completion_result(response.json(), start_time)
+            logger.info(f"Generated async response with {metrics['tokens_generated']} tokens in {metrics['latency']:.2f}s")
+            return response_text, metrics
             
-            metrics = {
-                "latency": time.time() - start_time,
-                "tokens_generated": tokens_generated,
-                "tokens_total": tokens_total,
-                "model": self.model,
-                "is_mock": False
-            }
+        except (httpx.HTTPError, requests.RequestException, json.JSONDecodeError) as e:
+            return self._handle_failure(e, prompt, context, key_terms, start_time)
+    
+    def generate_response_stream(self, prompt, context=None, max_tokens=1024, temperature=0.7):
+        """Stream a response from the LLM as it is generated.
+        
+        Yields `{"type": "delta", "text": ...}` events for each chunk of text
+        and finishes with a `{"type": "done", "response": ..., "metrics": ...}`
+        event carrying the full response and the same metrics as
+        `generate_response`.
+        """
+        start_time = time.time()
+        self.total_requests += 1
+        
+        key_terms = self._collect_key_terms(prompt, context)
+        payload = self._build_payload(prompt, context, max_tokens, temperature, stream=True)
+        
+        if not self.api_key:
+            mock_response, metrics = self._mock_result(prompt, context, key_terms, start_time)
+            yield from self._stream_text(mock_response)
+            yield {"type": "done", "response": mock_response, "metrics": dict(metrics, time_to_first_token=0.0)}
+            return
+        
+        parts = []
+        first_token_time = None
+        tokens_generated = 0
+        tokens_total = 0
+        try:
+            logger.info(f"Sending streaming request to Together AI API for '{prompt[:50]}...'")
+            # The read timeout applies between chunks, not to the whole completion
+            with self.transport.post(
+                f"{self.base_url}/completions",
+                headers=self._headers(),
+                json=payload,
+                timeout=(5, 30),
+                stream=True
+            ) as response:
+                for chunk in self._iter_sse_events(response):
+                    text = chunk.get("choices", [{}])[0].get("text", "")
+                    usage = chunk.get("usage") or {}
+                    if usage:
+                        tokens_generated = usage.get("completion_tokens", tokens_generated)
+                        tokens_total = usage.get("total_tokens", tokens_total)
+                    if not text:
+                        continue
+                    
+                    if first_token_time is None:
+                        first_token_time = time.time() - start_time
+                    parts.append(text)
+                    yield {"type": "delta", "text": text}
             
-            logger.info(f"Generated response with {tokens_generated} tokens in {metrics['latency']:.2f}s")
-            return response_text, metrics
+            response_text = "".join(parts)
+            metrics = self._record_success(
+                tokens_generated or len(parts), tokens_total, start_time, time_to_first_token=first_token_time
+            )
+            logger.info(f"Streamed response with {metrics['tokens_generated']} tokens in {metrics['latency']:.2f}s")
+            yield {"type": "done", "response": response_text, "metrics": metrics}
             
         except (requests.RequestException, json.JSONDecodeError) as e:
-            logger.error(f"Error calling Together AI API: {str(e)}")
-            self.failed_requests += 1
-            self.last_error = str(e)
-            
-            # Fallback to a mock response with the error information
-            error_response = f"I apologize, but I encountered an error while processing your request through the API. Using fallback response mechanism instead.\n\n"
-            error_response += self._generate_mock_response(prompt, context, key_terms)
+            # Before the first token we can still fall back to a mock response;
+            # afterwards the client already has a partial answer
+            if not parts:
+                response_text, metrics = self._handle_failure(e, prompt, context, key_terms, start_time)
+                yield from self._stream_text(response_text)
+            else:
+                self._record_failure(e)
+                response_text = "".join(parts)
+                metrics = {"latency": time.time() - start_time, "error": str(e), "is_mock": False}
             
-            return error_response, {
-                "latency": time.time() - start_time, 
-                "error": str(e),
-                "is_mock": True
+            yield {
+                "type": "done",
+                "response": response_text,
+                "metrics": dict(metrics, time_to_first_token=first_token_time)
             }
     
+    def _collect_key_terms(self, prompt, context):
+        """Key terms of the prompt and context, for mock responses."""
+        key_terms = self._extract_key_terms(prompt)
+        if context:
+            for doc in context:
+                key_terms.extend(self._extract_key_terms(doc.get('text', '')))
+        return key_terms
+    
+    def _build_payload(self, prompt, context, max_tokens, temperature, stream=False):
+        """Completions request body for a prompt and its retrieved context."""
+        payload = {
+            "model": self.model,
+            "prompt": self._prepare_prompt(prompt, context),
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": 0.9,
+            "top_k": 50,
+            "stop": ["User:", "<|im_end|>"]
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    def _mock_result(self, prompt, context, key_terms, start_time):
+        """`(response, metrics)` of a mock response, used when there is no API key."""
+        # Generate a more contextualized mock response using the context and query
+        mock_response = self._generate_mock_response(prompt, context, key_terms)
+        self.successful_requests += 1
+        return mock_response, {
+            "latency": time.time() - start_time,
+            "tokens": len(mock_response.split()),
+            "is_mock": True
+        }
+    
+    def _completion_result(self, response_data, start_time):
+        """`(response, metrics)` of a completed, non-streamed API response."""
+        usage = response_data.get("usage", {})
+        response_text = response_data.get("choices", [{}])[0].get("text", "")
+        metrics = self._record_success(usage.get("completion_tokens", 0), usage.get("total_tokens", 0), start_time)
+        return response_text, metrics
+    
+    def _record_success(self, tokens_generated, tokens_total, start_time, **extra):
+        """Update the usage stats for a successful API call and return its metrics."""
+        self.successful_requests += 1
+        self.total_tokens_generated += tokens_generated
+        return dict({
+            "latency": time.time() - start_time,
+            "tokens_generated": tokens_generated,
+            "tokens_total": tokens_total,
+            "model": self.model,
+            "is_mock": False
+        }, **extra)
+    
+    def _record_failure(self, error):
+        logger.error(f"Error calling Together AI API: {str(error)}")
+        self.failed_requests += 1
+        self.last_error = str(error)
+    
+    def _handle_failure(self, error, prompt, context, key_terms, start_time):
+        """Record a failed API call and return a fallback `(response, metrics)` built from the context."""
+        self._record_failure(error)
+        
+        # Fallback to a mock response with the error information
+        error_response = f"I apologize, but I encountered an error while processing your request through the API. Using fallback response mechanism instead.\n\n"
+        error_response += self._generate_mock_response(prompt, context, key_terms)
+        
+        return error_response, {
+            "latency": time.time() - start_time,
+            "error": str(error),
+            "is_mock": True
+        }
+    
+    def _iter_sse_events(self, response):
+        """Parse server-sent events from a streaming completions response."""
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            yield json.loads(data)
+    
+    def _stream_text(self, text):
+        """Yield an already complete text as word-sized delta events."""
+        for word in re.findall(r'\S+\s*|\s+', text):
+            yield {"type": "delta", "text": word}
+    
     def _extract_key_terms(self, text):
         """Extract key terms from a text for better mock responses."""
         if not text:
@@ -254,5 +400,6 @@ You are a helpful assistant.
             "total_tokens_generated": self.total_tokens_generated,
             "has_api_key": bool(self.api_key),
             "model": self.model,
-            "last_error": self.last_error
+            "last_error": self.last_error,
+            "transport": self.transport.get_metrics()
         }
@@ -1,9 +1,9 @@
 import os
 import logging
-import requests
 import json
 import time
 from flask import current_app
+from llm_transport import get_default_transport
 from app import socketio
 from langchain.agents import AgentExecutor
 from langchain.agents.format_scratchpad import format_to_openai_function_messages
@@ -37,7 +37,9 @@ class TogetherAIService:
         if not self.api_key:
             logging.error("Together AI API key not found in environment or app config")
         
-        self.api_url = "https://api.together.xyz/v1/completions"
+        self.base_url = os.environ.get("TOGETHER_API_BASE_URL", "https://api.together.xyz/v1")
+        self.api_url = f"{self.base_url}/completions"
+        self.transport = get_default_transport()
         self.model = "togethercomputer/llama-2-70b-chat"  # Default model
     
     def generate_completion(self, prompt, max_tokens=512, temperature=0.7):
@@ -62,14 +64,50 @@ class TogetherAIService:
         }
         
         try:
-            response = requests.post(self.api_url, headers=headers, json=data)
-            response.raise_for_status()
+            response = self.transport.post(self.api_url, headers=headers, json=data)
             result = response.json()
             return result.get("choices", [{}])[0].get("text", "")
         except Exception as e:
             logging.error(f"Error calling Together AI API: {str(e)}")
             raise
     
+    def generate_completion_stream(self, prompt, max_tokens=512, temperature=0.7):
+        """
+        Stream a completion from Together AI API, yielding text chunks as they arrive
+        """
+        if not self.api_key:
+            raise ValueError("Together AI API key not configured")
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": 0.9,
+            "top_k": 50,
+            "stream": True
+        }
+        
+        try:
+            with self.transport.post(self.api_url, headers=headers, json=data, stream=True, timeout=(5, 30)) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    text = json.loads(payload).get("choices", [{}])[0].get("text", "")
+                    if text:
+                        yield text
+        except Exception as e:
+            logging.error(f"Error streaming from Together AI API: {str(e)}")
+            raise
+    
     def generate_rag_response(self, query, context_docs):
         """
         Generate a RAG response using retrieved documents as context
@@ -99,7 +137,11 @@ RESPONSE:
         socketio.emit('generation_started', {'query': query})
         
         try:
-            response = self.generate_completion(prompt, max_tokens=1024, temperature=0.7)
+            parts = []
+            for text in self.generate_completion_stream(prompt, max_tokens=1024, temperature=0.7):
+                parts.append(text)
+                socketio.emit('generation_delta', {'query': query, 'text': text})
+            response = "".join(parts)
             
             # Emit the completed response
             socketio.emit('generation_completed', {
@@ -0,0 +1,331 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import httpx
+import requests
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: rate limiting and transient upstream failures
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def backoff_delay(attempt, base, maximum, retry_after=None):
+    """Full-jitter exponential backoff, or the server's Retry-After if it is longer."""
+    delay = random.uniform(0, min(maximum, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, maximum))
+    return delay
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling the upstream while the circuit breaker is open.
+
+    It subclasses RequestException, so callers that already fall back on
+    request errors handle it the same way.
+    """
+
+class CircuitBreaker:
+    """Stops calls to an unhealthy upstream for a cool-down period.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    rejects calls for `reset_timeout` seconds. It then lets a single trial
+    call through (half-open) and closes again if that call succeeds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.trial_number = 0  # identifies the latest half-open trial
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """Decide whether a call may go ahead. Returns `(allowed, trial)`.
+
+        `trial` is None unless this caller took the half-open trial; it is
+        then the trial's number, to pass to release_trial if the call ends
+        without recording a success or failure.
+        """
+        with self.lock:
+            if self.state == "closed":
+                return True, None
+            if self.state == "open" and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.trial_in_flight = False
+            if self.state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                self.trial_number += 1
+                return True, self.trial_number
+            return False, None
+
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                logger.info("LLM circuit breaker closed")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+    def release_trial(self, trial):
+        """Give up half-open trial `trial` if it ended without an outcome, e.g. cancelled.
+
+        The next caller is then allowed to run a new trial. Does nothing if
+        the trial already recorded a success or failure, or if a later trial
+        has taken its place.
+        """
+        with self.lock:
+            if self.state == "half_open" and self.trial_in_flight and trial == self.trial_number:
+                self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"LLM circuit breaker opened after {self.consecutive_failures} failures")
+                self.state = "open"
+                self.opened_at = time.time()
+
+class LLMTransport:
+    """Pooled HTTP transport for LLM API calls.
+
+    Keeps connections alive in a shared `requests.Session`, retries rate
+    limited and transient failures with jittered exponential backoff that
+    honours `Retry-After`, and short-circuits through a CircuitBreaker while
+    the upstream is unhealthy.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=32, max_retries=3, backoff_base=0.5,
+                 backoff_max=8.0, timeout=10, breaker=None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        # Retries are handled here, so the adapter must not retry on its own
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.metrics_lock = threading.Lock()
+        self.total_calls = 0
+        self.total_retries = 0
+        self.rejected_calls = 0
+
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        """POST to `url`, retrying transient failures.
+
+        Returns a successful response or raises a RequestException;
+        CircuitOpenError if the breaker is open.
+        """
+        allowed, trial = self.breaker.allow_request()
+        if not allowed:
+            with self.metrics_lock:
+                self.rejected_calls += 1
+            raise CircuitOpenError(f"Circuit breaker is open; not calling {url}")
+
+        with self.metrics_lock:
+            self.total_calls += 1
+
+        try:
+            return self._post_with_retries(url, headers, json, timeout, stream)
+        finally:
+            # Frees this call's half-open trial if it ended without recording an outcome
+            if trial is not None:
+                self.breaker.release_trial(trial)
+
+    def _post_with_retries(self, url, headers, json, timeout, stream):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(
+                    url, headers=headers, json=json, timeout=timeout or self.timeout, stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response = None
+                retry_after = None
+                error = e
+            except requests.RequestException:
+                self.breaker.record_failure()
+                raise
+
+            if response is not None:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    # Client errors are the caller's problem, not an upstream health issue
+                    if response.status_code >= 500:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    response.raise_for_status()
+                    return response
+
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+                response.close()
+
+            if attempt >= self.max_retries:
+                self.breaker.record_failure()
+                raise error
+
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+            attempt += 1
+            with self.metrics_lock:
+                self.total_retries += 1
+            logger.warning(f"LLM request failed ({error}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+    def get_metrics(self):
+        """Get call, retry and circuit breaker metrics."""
+        with self.metrics_lock:
+            return {
+                "total_calls": self.total_calls,
+                "total_retries": self.total_retries,
+                "rejected_calls": self.rejected_calls,
+                "circuit_state": self.breaker.state
+            }
+
+class AsyncLLMTransport:
+    """asyncio counterpart of LLMTransport built on a pooled `httpx.AsyncClient`.
+
+    Uses the same retry policy and can share a CircuitBreaker with the
+    blocking transport, so both see the same upstream health. Cancelling the
+    calling task aborts the in-flight request.
+    """
+
+    def __init__(self, pool_maxsize=100, max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 timeout=10, breaker=None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.limits = httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+        # Created lazily so the client binds to the event loop that uses it
+        self.client = None
+
+        self.total_calls = 0
+        self.total_retries = 0
+        self.rejected_calls = 0
+
+    async def post(self, url, headers=None, json=None, timeout=None):
+        """POST to `url`, retrying transient failures; see LLMTransport.post."""
+        allowed, trial = self.breaker.allow_request()
+        if not allowed:
+            self.rejected_calls += 1
+            raise CircuitOpenError(f"Circuit breaker is open; not calling {url}")
+
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        self.total_calls += 1
+
+        try:
+            return await self._post_with_retries(url, headers, json, timeout)
+        finally:
+            # A cancelled call (e.g. the client disconnected) records neither
+            # success nor failure, so free its half-open trial for the next caller
+            if trial is not None:
+                self.breaker.release_trial(trial)
+
+    async def _post_with_retries(self, url, headers, json, timeout):
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.post(url, headers=headers, json=json, timeout=timeout or self.timeout)
+            except httpx.TransportError as e:
+                response = None
+                retry_after = None
+                error = e
+            except httpx.HTTPError:
+                self.breaker.record_failure()
+                raise
+
+            if response is not None:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    if response.status_code >= 500:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    response.raise_for_status()
+                    return response
+
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = httpx.HTTPStatusError(
+                    f"{response.status_code} from {url}", request=response.request, response=response
+                )
+
+            if attempt >= self.max_retries:
+                self.breaker.record_failure()
+                raise error
+
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+            attempt += 1
+            self.total_retries += 1
+            logger.warning(f"Async LLM request failed ({error}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def get_metrics(self):
+        """Get call, retry and circuit breaker metrics."""
+        return {
+            "total_calls": self.total_calls,
+            "total_retries": self.total_retries,
+            "rejected_calls": self.rejected_calls,
+            "circuit_state": self.breaker.state
+        }
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+def get_default_transport():
+    """Transport shared by all LLM clients in this process."""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = LLMTransport()
+        return _default_transport
+
+def set_default_transport(transport):
+    """Replace the shared transport, e.g. with one configured from the environment."""
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
+
+_default_async_transport = None
+
+def get_default_async_transport():
+    """Async transport shared by all LLM clients in this process.
+
+    It shares the circuit breaker of the blocking default transport.
+    """
+    global _default_async_transport
+    with _default_transport_lock:
+        if _default_async_transport is None:
+            breaker = _default_transport.breaker if _default_transport is not None else None
+            _default_async_transport = AsyncLLMTransport(breaker=breaker)
+        return _default_async_transport
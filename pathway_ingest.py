@@ -0,0 +1,123 @@
+import io
+import json
+import logging
+import os
+import threading
+import pathway as pw
+
+from document_stream import DOCUMENT_EXTENSIONS, iter_document_text
+
+logger = logging.getLogger(__name__)
+
+# Pending change for a file that could not be decoded: keep its indexed version
+SKIPPED = object()
+
+class PathwayDirectoryWatcher:
+    """Streams a local directory into the ingest queue with the Pathway engine.
+
+    `pw.io.fs.read` in streaming mode emits a row per file and retracts it
+    when the file changes or disappears. Changes are collected per Pathway
+    timestamp and applied when that timestamp closes: a file that was added
+    or modified becomes an upsert, and a file whose row was only retracted
+    becomes a delete. Documents are keyed on their path relative to the
+    watched directory. File contents go through `iter_document_text`, so a
+    file is indexed the same way as when it is uploaded.
+    """
+
+    def __init__(self, directory, processor, extensions=DOCUMENT_EXTENSIONS):
+        self.directory = os.path.abspath(directory)
+        self.processor = processor
+        self.extensions = tuple(extensions)
+        self.pending_changes = {}  # doc_id -> content, None for a delete, or SKIPPED
+        self.pending_lock = threading.Lock()
+        self.thread = None
+
+        self.upserts = 0
+        self.deletes = 0
+        self.skipped = 0
+
+    def start(self):
+        """Build the Pathway pipeline and run it on a background thread."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        files = pw.io.fs.read(
+            self.directory,
+            format="binary",
+            mode="streaming",
+            with_metadata=True
+        )
+        pw.io.subscribe(files, on_change=self._on_change, on_time_end=self._on_time_end)
+
+        self.thread = threading.Thread(target=self._run, name="pathway-directory-watcher")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Watching {self.directory} for document changes with Pathway")
+
+    def _run(self):
+        try:
+            pw.run(monitoring_level=pw.MonitoringLevel.NONE)
+        except Exception as e:
+            logger.error(f"Pathway directory watcher stopped: {str(e)}", exc_info=True)
+
+    def _doc_id(self, row):
+        """Document id of a file row: its path relative to the watched directory."""
+        metadata = row["_metadata"]
+        metadata = getattr(metadata, "value", metadata)
+        path = metadata.get("path", "")
+        return os.path.relpath(path, self.directory)
+
+    def _on_change(self, key, row, time, is_addition):
+        """Record one file addition or retraction for the current timestamp."""
+        doc_id = self._doc_id(row)
+        if not doc_id.lower().endswith(self.extensions):
+            return
+
+        if is_addition:
+            content = self._document_text(doc_id, row["data"])
+
+        with self.pending_lock:
+            if is_addition:
+                self.pending_changes[doc_id] = content
+            elif doc_id not in self.pending_changes:
+                # A modification retracts the old row and adds a new one at the
+                # same timestamp; only a retraction on its own is a delete
+                self.pending_changes[doc_id] = None
+
+    def _document_text(self, doc_id, data):
+        """Text of a file, extracted the same way as an upload, or SKIPPED if it cannot be decoded."""
+        file_ext = os.path.splitext(doc_id)[1].lower()
+        try:
+            return "".join(iter_document_text(io.BytesIO(data), file_ext))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logger.warning(f"Skipping {doc_id}: {str(e)}")
+            return SKIPPED
+
+    def _on_time_end(self, time):
+        """Apply the changes collected for a closed timestamp, in order."""
+        with self.pending_lock:
+            changes = self.pending_changes
+            self.pending_changes = {}
+
+        for doc_id, content in changes.items():
+            if content is SKIPPED:
+                self.skipped += 1
+            elif content is None:
+                self.processor.delete_document(doc_id)
+                self.deletes += 1
+            else:
+                self.processor.upsert_document(content, doc_id)
+                self.upserts += 1
+
+        if changes:
+            logger.info(f"Applied {len(changes)} file changes from {self.directory}")
+
+    def get_metrics(self):
+        """Get watcher counters."""
+        return {
+            "directory": self.directory,
+            "running": self.thread is not None and self.thread.is_alive(),
+            "upserts": self.upserts,
+            "deletes": self.deletes,
+            "skipped": self.skipped
+        }
@@ -1,21 +1,118 @@
 import logging
+import queue
 import threading
 import time
 import numpy as np
-import hashlib
-from vector_store import VectorStore
+import chunking
+import embeddings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from vector_store import VectorStore, content_hash
 
 logger = logging.getLogger(__name__)
 
+# Queue operations that carry no content to chunk or embed
+UNPREPARED_OPS = ("delete", "stream_end", "stream_abort")
+
+# Embedding provider and chunker of a process-pool worker, set once by _init_pool_worker
+_worker_embedder = None
+_worker_chunker = None
+
+def _init_pool_worker(embedder, chunker):
+    """Initializer for ingest process-pool workers."""
+    global _worker_embedder, _worker_chunker
+    _worker_embedder = embedder
+    _worker_chunker = chunker
+
+def prepare_document(content, doc_id, embedder=None, known_hashes=None, chunker=None):
+    """Chunk and embed one document; the CPU-heavy part of ingest.
+    
+    Runs inline, on a thread pool or in a worker process (where `embedder`
+    and `chunker` default to the ones installed by the pool initializer).
+    Returns the chunk ids, texts, `(start, end)` spans into `content` and
+    embedding matrix, or None if the document yields no chunks. Chunks whose
+    content hash is in `known_hashes` are already stored and are not
+    embedded; `embedded` marks the rows that were.
+    """
+    # Skip empty documents
+    if not content or not content.strip():
+        logger.warning(f"Skipping empty document {doc_id}")
+        return None
+        
+    # Split document into chunks
+    chunker = chunker or _worker_chunker or chunking.FixedSizeChunker()
+    spans = chunker.split(content)
+    if not spans:
+        logger.warning(f"No chunks generated for document {doc_id}")
+        return None
+    
+    logger.info(f"Processing document {doc_id} into {len(spans)} chunks")
+    prepared = prepare_chunks([content[start:end] for start, end in spans], doc_id, embedder, known_hashes)
+    prepared["spans"] = spans
+    return prepared
+
+def prepare_chunks(chunks, doc_id, embedder=None, known_hashes=None, first_chunk=0):
+    """Embed already chunked text of `doc_id`; see prepare_document.
+    
+    Chunk ids are numbered from `first_chunk`, so a document streamed in
+    segments keeps one numbering.
+    """
+    embedder = embedder or _worker_embedder
+    known_hashes = known_hashes or set()
+    embedded = np.array([content_hash(chunk) not in known_hashes for chunk in chunks], dtype=bool)
+    
+    chunk_embeddings = np.zeros((len(chunks), embedder.dimension), dtype=np.float32)
+    if embedded.any():
+        chunk_embeddings[embedded] = embedder.embed([chunk for chunk, new in zip(chunks, embedded) if new])
+    
+    return {
+        "id": doc_id,
+        "chunk_ids": [f"{doc_id}_chunk_{first_chunk + i}" for i in range(len(chunks))],
+        "chunks": chunks,
+        "embeddings": chunk_embeddings,
+        "embedded": embedded
+    }
+
+class IngestQueueFull(Exception):
+    """Raised when a document is offered while the ingest queue is at capacity."""
+
 class PathwayProcessor:
-    def __init__(self, vector_store):
+    def __init__(self, vector_store, embedder=None, max_queue_size=1000, max_batch_size=32,
+                 num_workers=0, worker_mode="thread", chunker=None):
         self.vector_store = vector_store
-        self.documents_queue = []
+        # Embedding provider shared with the query path; defaults to hash embeddings
+        self.embedder = embedder or embeddings.HashEmbeddingProvider(vector_store.vector_dim)
+        # Splits documents into chunks sized for the embedding model
+        self.chunker = chunker or chunking.create_chunker("sentence", embedder=self.embedder)
+        # Bounded so a burst of uploads applies backpressure instead of growing without limit
+        self.documents_queue = queue.Queue(maxsize=max_queue_size)
+        self.max_batch_size = max_batch_size
         self.processed_count = 0
+        self.enqueued_count = 0
+        self.rejected_count = 0
         self.processing_lock = threading.Lock()
         self.is_running = False
         self.recently_processed_docs = []
         self.processor_thread = None
+        self.recent_wait_times = deque(maxlen=1000)
+        self.recent_batch_sizes = deque(maxlen=1000)
+        
+        # Optional pool that chunks and embeds several documents at once. Use
+        # threads for embedders that release the GIL and processes for pure
+        # Python work; results are written back by the single worker thread.
+        self.num_workers = num_workers
+        self.worker_mode = worker_mode
+        self.executor = None
+        if num_workers > 0:
+            if worker_mode == "process":
+                self.executor = ProcessPoolExecutor(
+                    max_workers=num_workers, initializer=_init_pool_worker, initargs=(self.embedder, self.chunker)
+                )
+            elif worker_mode == "thread":
+                self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="ingest")
+            else:
+                raise ValueError(f"Unknown ingest worker mode {worker_mode!r}; use 'thread' or 'process'")
+            logger.info(f"Using {worker_mode} pool with {num_workers} workers for ingest")
         
     def get_processed_count(self):
         """Returns the count of processed documents."""
@@ -25,22 +122,111 @@ class PathwayProcessor:
         """Returns a list of recently processed documents."""
         with self.processing_lock:
             return self.recently_processed_docs.copy()
+    
+    def get_queue_metrics(self):
+        """Returns queue depth, backpressure and wait-time metrics."""
+        with self.processing_lock:
+            wait_times = list(self.recent_wait_times)
+            batch_sizes = list(self.recent_batch_sizes)
+            enqueued = self.enqueued_count
+            rejected = self.rejected_count
+        
+        return {
+            "queue_depth": self.documents_queue.qsize(),
+            "queue_capacity": self.documents_queue.maxsize,
+            "enqueued": enqueued,
+            "rejected": rejected,
+            "wait_ms_p50": float(np.percentile(wait_times, 50) * 1000) if wait_times else 0,
+            "wait_ms_p95": float(np.percentile(wait_times, 95) * 1000) if wait_times else 0,
+            "avg_batch_size": float(np.mean(batch_sizes)) if batch_sizes else 0
+        }
         
     def add_document(self, content, doc_id):
-        """Add a document to the processing queue."""
+        """Add a document to the processing queue.
+        
+        Raises IngestQueueFull if the queue is at capacity.
+        """
+        return self._enqueue("add", content, doc_id, block=False)
+    
+    def upsert_document(self, content, doc_id, block=True):
+        """Queue a document that replaces any chunks previously stored for `doc_id`.
+        
+        Blocks while the queue is full unless `block` is False, in which case
+        IngestQueueFull is raised.
+        """
+        return self._enqueue("upsert", content, doc_id, block=block)
+    
+    def delete_document(self, doc_id, block=True):
+        """Queue the removal of all chunks stored for `doc_id`."""
+        return self._enqueue("delete", None, doc_id, block=block)
+    
+    def stream_document(self, chunks, doc_id, segment_size=64):
+        """Queue a document from a chunk iterator without materializing it.
+        
+        Chunks are queued in segments of `segment_size` as they are produced.
+        Like an upsert, they are matched on content hash against the chunks
+        stored for the previous version of `doc_id`: those are kept instead
+        of being re-embedded, and the ones no segment matched are removed
+        after the last segment. An empty `chunks` changes nothing, and if
+        `chunks` raises, the chunks this stream added are removed again, so
+        the previous version stays whole. Blocks while the queue is full, so
+        a fast producer is paced by ingest. Returns the number of chunks
+        queued.
+        """
+        # Shared by the stream's segments; the worker fills in the FAISS ids
+        # stored before the stream and those still unmatched (content hash
+        # -> FAISS ids)
+        stream = {"stored_ids": None, "unmatched": None}
+        chunk_count = 0
+        segment = []
+        try:
+            for chunk in chunks:
+                segment.append(chunk)
+                if len(segment) >= segment_size:
+                    self._enqueue("chunks", segment, doc_id, block=True, first_chunk=chunk_count, stream=stream)
+                    chunk_count += len(segment)
+                    segment = []
+            if segment:
+                self._enqueue("chunks", segment, doc_id, block=True, first_chunk=chunk_count, stream=stream)
+                chunk_count += len(segment)
+        except Exception:
+            self._enqueue("stream_abort", None, doc_id, block=True, stream=stream)
+            raise
+        # An empty upload is rejected and leaves the stored version as it is
+        if chunk_count:
+            self._enqueue("stream_end", None, doc_id, block=True, stream=stream)
+        
+        logger.info(f"Streamed {chunk_count} chunks of document {doc_id} to the ingest queue")
+        return chunk_count
+    
+    def _enqueue(self, op, content, doc_id, block, first_chunk=0, stream=None):
+        """Put an ingest operation on the queue, in order with all other operations."""
         with self.processing_lock:
             # Generate a unique document ID if one isn't provided
             if not doc_id:
-                doc_id = f"doc_{int(time.time())}_{len(self.documents_queue)}"
-                
-            self.documents_queue.append({"content": content, "id": doc_id})
-            logger.info(f"Document {doc_id} added to queue")
+                doc_id = f"doc_{int(time.time())}_{self.enqueued_count}"
+            self.enqueued_count += 1
             
             # Start processing thread if not running
             if not self.is_running or self.processor_thread is None or not self.processor_thread.is_alive():
                 self.start_processing()
-            
-            return doc_id
+        
+        item = {
+            "op": op, "content": content, "id": doc_id, "first_chunk": first_chunk, "stream": stream,
+            "enqueued_at": time.time()
+        }
+        try:
+            # Block outside processing_lock so the worker can keep draining
+            self.documents_queue.put(item, block=block)
+        except queue.Full:
+            with self.processing_lock:
+                self.enqueued_count -= 1
+                self.rejected_count += 1
+            logger.warning(f"Ingest queue full, rejecting document {doc_id}")
+            raise IngestQueueFull(f"Ingest queue is full ({self.documents_queue.maxsize} documents)")
+        
+        logger.info(f"Document {doc_id} added to queue ({op})")
+        return doc_id
             
     def start_processing(self):
         """Start the Pathway data processing pipeline."""
@@ -53,86 +239,169 @@ class PathwayProcessor:
         self.processor_thread.daemon = True
         self.processor_thread.start()
         logger.info("Started document processing thread")
+    
+    def _next_batch(self):
+        """Block until documents are queued and take a batch of them.
+        
+        The batch grows with the backlog: a lone upload is processed right
+        away, while a deep queue is drained up to max_batch_size at a time.
+        """
+        first = self.documents_queue.get()
+        if first is None:
+            return None
+        
+        batch = [first]
+        while len(batch) < self.max_batch_size:
+            try:
+                doc = self.documents_queue.get_nowait()
+            except queue.Empty:
+                break
+            if doc is None:
+                # Stop requested; finish this batch first
+                self.is_running = False
+                break
+            batch.append(doc)
+        return batch
         
     def _processing_worker(self):
         """Worker thread for document processing."""
         logger.info("Document processing worker started")
         
         while self.is_running:
-            documents_to_process = []
+            documents_to_process = self._next_batch()
+            if documents_to_process is None:
+                break
             
-            # Get documents from queue
+            now = time.time()
             with self.processing_lock:
-                if self.documents_queue:
-                    # Process up to 5 documents at a time
-                    documents_to_process = self.documents_queue[:5]
-                    self.documents_queue = self.documents_queue[5:]
+                self.recent_batch_sizes.append(len(documents_to_process))
+                self.recent_wait_times.extend(now - doc["enqueued_at"] for doc in documents_to_process)
             
-            if documents_to_process:
-                logger.info(f"Processing batch of {len(documents_to_process)} documents")
-                batch_successful = 0
-                
-                for doc in documents_to_process:
-                    try:
-                        # Process the document
-                        processed = self._process_document(doc["content"], doc["id"])
-                        if processed:
-                            batch_successful += 1
-                            
-                            # Add to recent documents
-                            with self.processing_lock:
-                                # Keep only the 10 most recent documents
-                                self.recently_processed_docs = ([
-                                    {
-                                        "id": doc["id"],
-                                        "title": doc["id"],
-                                        "timestamp": time.time()
-                                    }
-                                ] + self.recently_processed_docs)[:10]
-                    except Exception as e:
-                        logger.error(f"Error processing document {doc['id']}: {str(e)}")
-                
-                # Update processed count
-                with self.processing_lock:
-                    self.processed_count += batch_successful
+            logger.info(f"Processing batch of {len(documents_to_process)} documents")
+            batch_successful = 0
+            
+            # Chunk and embed in parallel, then write in queue order so ids stay deterministic
+            for doc, prepared in self._prepare_batch(documents_to_process):
+                try:
+                    if isinstance(prepared, Exception):
+                        raise prepared
                     
-                logger.info(f"Successfully processed {batch_successful}/{len(documents_to_process)} documents, total: {self.processed_count}")
+                    if doc["op"] == "delete":
+                        self.vector_store.delete_source(doc["id"])
+                        continue
+                    if doc["op"] == "stream_end":
+                        self._finish_stream(doc["id"], doc["stream"])
+                        continue
+                    if doc["op"] == "stream_abort":
+                        self._abort_stream(doc["id"], doc["stream"])
+                        continue
+                    if doc["op"] == "upsert":
+                        processed = self._upsert_document(doc["id"], prepared, doc["content"])
+                    elif doc["op"] == "chunks":
+                        processed = self._write_stream_segment(doc["id"], prepared, doc["stream"])
+                    else:
+                        processed = self._write_document(doc["id"], prepared, doc["content"])
+                    # Later segments of a streamed document are not new documents
+                    if processed and doc["first_chunk"] == 0:
+                        batch_successful += 1
+                        
+                        # Add to recent documents
+                        with self.processing_lock:
+                            # Keep only the 10 most recent documents
+                            self.recently_processed_docs = ([
+                                {
+                                    "id": doc["id"],
+                                    "title": doc["id"],
+                                    "timestamp": time.time()
+                                }
+                            ] + self.recently_processed_docs)[:10]
+                except Exception as e:
+                    logger.error(f"Error processing document {doc['id']}: {str(e)}")
             
-            # Sleep before checking for more documents
-            time.sleep(0.5)
+            # Update processed count
+            with self.processing_lock:
+                self.processed_count += batch_successful
+                
+            logger.info(f"Successfully processed {batch_successful}/{len(documents_to_process)} documents, total: {self.processed_count}")
         
         logger.info("Document processing worker stopped")
     
-    def _process_document(self, content, doc_id):
-        """Process a single document."""
-        # Skip empty documents
-        if not content or not content.strip():
-            logger.warning(f"Skipping empty document {doc_id}")
-            return False
-            
-        # Split document into chunks
-        chunks = self._chunk_document(content)
-        if not chunks:
-            logger.warning(f"No chunks generated for document {doc_id}")
-            return False
+    def _prepare_batch(self, documents):
+        """Yield `(doc, prepared)` pairs in input order.
         
-        logger.info(f"Processing document {doc_id} into {len(chunks)} chunks")
-            
-        # Process each chunk
-        chunk_ids = []
-        successful_chunks = 0
-        for i, chunk in enumerate(chunks):
+        `prepared` is the result of `prepare_document`, or the exception it
+        raised.
+        """
+        # Deletions have nothing to prepare; upserts and streamed segments
+        # skip embedding chunks that are already stored
+        if self.executor is None:
+            for doc in documents:
+                if doc["op"] in UNPREPARED_OPS:
+                    yield doc, None
+                    continue
+                try:
+                    if doc["op"] == "chunks":
+                        yield doc, prepare_chunks(
+                            doc["content"], doc["id"], self.embedder, self._known_hashes(doc), doc["first_chunk"]
+                        )
+                    else:
+                        yield doc, prepare_document(
+                            doc["content"], doc["id"], self.embedder, self._known_hashes(doc), self.chunker
+                        )
+                except Exception as e:
+                    yield doc, e
+            return
+        
+        # Process workers use the embedder and chunker installed by their initializer
+        embedder = None if self.worker_mode == "process" else self.embedder
+        chunker = None if self.worker_mode == "process" else self.chunker
+        futures = []
+        for doc in documents:
+            if doc["op"] in UNPREPARED_OPS:
+                futures.append(None)
+            elif doc["op"] == "chunks":
+                futures.append(self.executor.submit(
+                    prepare_chunks, doc["content"], doc["id"], embedder, self._known_hashes(doc), doc["first_chunk"]
+                ))
+            else:
+                futures.append(self.executor.submit(
+                    prepare_document, doc["content"], doc["id"], embedder, self._known_hashes(doc), chunker
+                ))
+        
+        for doc, future in zip(documents, futures):
+            if future is None:
+                yield doc, None
+                continue
             try:
-                # Create embedding for chunk
-                embedding = self._create_embedding(chunk)
-                
-                # Add to vector store with a unique ID
-                chunk_id = f"{doc_id}_chunk_{i}"
-                doc_key = self.vector_store.add_document(chunk_id, chunk, embedding)
-                chunk_ids.append(doc_key)
-                successful_chunks += 1
+                yield doc, future.result()
             except Exception as e:
-                logger.error(f"Error processing chunk {i} of document {doc_id}: {str(e)}")
+                yield doc, e
+    
+    def _known_hashes(self, doc):
+        """Content hashes already stored for an upserted or streamed document."""
+        if doc["op"] not in ("upsert", "chunks"):
+            return None
+        return self.vector_store.source_hashes(doc["id"])
+    
+    def _write_document(self, doc_id, prepared, content=None):
+        """Add a prepared document's chunks to the vector store in one batch.
+        
+        Chunks with spans are stored as slices of `content`.
+        """
+        if prepared is None:
+            return False
+        
+        chunks = prepared["chunks"]
+        spans = prepared.get("spans")
+        successful_chunks = 0
+        try:
+            doc_keys = self.vector_store.add_documents(
+                prepared["chunk_ids"], chunks, prepared["embeddings"],
+                spans=spans, source_text=content if spans else None
+            )
+            successful_chunks = len(doc_keys)
+        except Exception as e:
+            logger.error(f"Error adding chunks of document {doc_id}: {str(e)}")
                 
         # Only count as successful if we processed at least one chunk
         if successful_chunks > 0:
@@ -142,45 +411,103 @@ class PathwayProcessor:
             logger.warning(f"Failed to process any chunks for document {doc_id}")
             return False
     
-    def _chunk_document(self, text, chunk_size=1000, overlap=200):
-        """Split document into chunks."""
-        # Skip empty documents
-        if not text or not text.strip():
-            return []
-            
-        # Handle short documents without chunking
-        if len(text) < chunk_size:
-            return [text]
-            
-        chunks = []
-        for i in range(0, len(text), chunk_size - overlap):
-            chunk = text[i:i + chunk_size]
-            # Skip empty chunks
-            if chunk and chunk.strip():
-                chunks.append(chunk)
-                
-        return chunks
-    
-    def _create_embedding(self, text):
-        """Create an embedding for a text chunk."""
-        # This would use a real embedding model in production
-        # For demonstration purposes, we create a deterministic hash-based embedding
-        
-        # Create a deterministic embedding based on content hash
-        hash_bytes = hashlib.md5(text.encode()).digest()
-        # Create a vector of 16 dimensions from the hash
-        embedding = np.array([float(byte) / 255.0 for byte in hash_bytes])
-        # Normalize the embedding vector (important for meaningful cosine similarity)
-        norm = np.linalg.norm(embedding)
-        if norm > 0:
-            embedding = embedding / norm
-            
-        return embedding.tolist()  # Convert to list
+    def _upsert_document(self, doc_id, prepared, content):
+        """Replace the stored chunks of `doc_id`, re-embedding only changed chunks."""
+        if prepared is None:
+            # The new version is empty, so nothing of the old one should remain
+            self.vector_store.delete_source(doc_id)
+            return False
+        
+        try:
+            changes = self.vector_store.upsert_source(
+                doc_id,
+                prepared["chunk_ids"],
+                prepared["chunks"],
+                prepared["embeddings"],
+                prepared["embedded"],
+                embed_fn=self.embedder.embed,
+                spans=prepared["spans"],
+                source_text=content
+            )
+        except Exception as e:
+            logger.error(f"Error upserting chunks of document {doc_id}: {str(e)}")
+            return False
+        
+        logger.info(f"Upserted document {doc_id}: {changes['added']} added, {changes['removed']} removed, "
+                    f"{changes['unchanged']} unchanged")
+        return True
+    
+    def _write_stream_segment(self, doc_id, prepared, stream):
+        """Add the chunks of a streamed segment that are not stored yet.
+        
+        The first segment takes the stored chunks of `doc_id` as candidates;
+        each chunk whose content hash matches one keeps it instead of adding
+        a copy. Unmatched candidates are removed by `_finish_stream`.
+        """
+        if stream["unmatched"] is None:
+            stream["unmatched"] = self.vector_store.source_hash_ids(doc_id)
+            stream["stored_ids"] = {
+                faiss_id for faiss_ids in stream["unmatched"].values() for faiss_id in faiss_ids
+            }
+        unmatched = stream["unmatched"]
+        
+        new_rows = []
+        for row, chunk in enumerate(prepared["chunks"]):
+            stored_ids = unmatched.get(content_hash(chunk))
+            if stored_ids:
+                stored_ids.pop()
+            else:
+                new_rows.append(row)
+        if not new_rows:
+            logger.info(f"Kept all {len(prepared['chunks'])} chunks of segment of document {doc_id}")
+            return True
+        
+        # Chunks skipped at prepare time because their hash was stored may
+        # still be new, when the document repeats them more often than before
+        embeddings = prepared["embeddings"][new_rows]
+        missing = [i for i, row in enumerate(new_rows) if not prepared["embedded"][row]]
+        if missing:
+            embeddings[missing] = self.embedder.embed([prepared["chunks"][new_rows[i]] for i in missing])
+        
+        return self._write_document(doc_id, {
+            "chunk_ids": [prepared["chunk_ids"][row] for row in new_rows],
+            "chunks": [prepared["chunks"][row] for row in new_rows],
+            "embeddings": embeddings
+        })
+    
+    def _finish_stream(self, doc_id, stream):
+        """Remove the stored chunks of `doc_id` that no streamed segment matched."""
+        if stream["unmatched"] is None:
+            # No segment was written, so there is nothing to replace the stored chunks with
+            return
+        stale_ids = [faiss_id for faiss_ids in stream["unmatched"].values() for faiss_id in faiss_ids]
+        if stale_ids:
+            self.vector_store.remove_source_chunks(doc_id, stale_ids)
+    
+    def _abort_stream(self, doc_id, stream):
+        """Remove the chunks a failed stream added, leaving the stored version of `doc_id` whole."""
+        if stream["stored_ids"] is None:
+            # No segment was written
+            return
+        added_ids = [
+            faiss_id
+            for faiss_ids in self.vector_store.source_hash_ids(doc_id).values()
+            for faiss_id in faiss_ids
+            if faiss_id not in stream["stored_ids"]
+        ]
+        if added_ids:
+            self.vector_store.remove_source_chunks(doc_id, added_ids)
+        logger.info(f"Aborted stream of document {doc_id}, removed {len(added_ids)} added chunks")
     
     def stop_processing(self):
         """Stop the Pathway data processing pipeline."""
         logger.info("Stopping document processing")
         self.is_running = False
+        # Wake the worker if it is waiting for documents
+        try:
+            self.documents_queue.put_nowait(None)
+        except queue.Full:
+            pass
         # Wait for the thread to terminate
         if self.processor_thread and self.processor_thread.is_alive():
             self.processor_thread.join(timeout=2.0)
@@ -0,0 +1,117 @@
+import logging
+import queue
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+class QueryCoalescer:
+    """Coalesces concurrent vector searches into batched FAISS searches.
+
+    Callers block in `search` while a dispatcher thread collects the queries
+    that arrive within `max_wait_ms` of the first one (up to `max_batch`),
+    runs them through `VectorStore.search_batch` and hands each caller its own
+    `(results, distances)` pair.
+    """
+
+    def __init__(self, vector_store, max_wait_ms=2.0, max_batch=32, num_dispatchers=2):
+        self.vector_store = vector_store
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+
+        # Metrics
+        self.metrics_lock = threading.Lock()
+        self.total_batches = 0
+        self.total_queries = 0
+        self.max_batch_seen = 0
+        self.recent_batch_sizes = deque(maxlen=1000)
+        self.recent_queue_delays = deque(maxlen=1000)
+
+        self.dispatchers = []
+        for i in range(num_dispatchers):
+            dispatcher = threading.Thread(target=self._dispatch_loop, name=f"query-coalescer-{i}")
+            dispatcher.daemon = True
+            dispatcher.start()
+            self.dispatchers.append(dispatcher)
+
+        logger.info(f"Started query coalescer: max_wait={max_wait_ms}ms, max_batch={max_batch}")
+
+    def search(self, query_embedding, top_k=5, query_text=None):
+        """Search like `VectorStore.search`, sharing a FAISS call with concurrent callers."""
+        future = Future()
+        embedding = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        self.requests.put((embedding, top_k, query_text, time.time(), future))
+        return future.result()
+
+    def _dispatch_loop(self):
+        """Collect requests into batches and run them."""
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.time() + self.max_wait
+
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        """Run one batched search and resolve each caller's future."""
+        dispatch_time = time.time()
+        top_k = max(top_k for _, top_k, _, _, _ in batch)
+
+        try:
+            query_matrix = np.vstack([embedding for embedding, _, _, _, _ in batch])
+            # Queries without text get no keyword hits, so their fused ranking
+            # follows the vector ranking
+            query_texts = [query_text or "" for _, _, query_text, _, _ in batch]
+            if not any(query_texts):
+                query_texts = None
+            batch_results = self.vector_store.search_batch(query_matrix, top_k, query_texts=query_texts)
+        except Exception as e:
+            logger.error(f"Error running coalesced search batch: {str(e)}")
+            for _, _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        # The batch searched with the largest top_k; trim to each caller's own
+        for (_, request_top_k, _, _, future), (results, distances) in zip(batch, batch_results):
+            future.set_result((results[:request_top_k], distances[:request_top_k]))
+
+        with self.metrics_lock:
+            self.total_batches += 1
+            self.total_queries += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.recent_batch_sizes.append(len(batch))
+            self.recent_queue_delays.extend(dispatch_time - enqueued_at for _, _, _, enqueued_at, _ in batch)
+
+        logger.debug(f"Ran coalesced search batch of {len(batch)} queries")
+
+    def get_metrics(self):
+        """Get batch size and queueing delay metrics."""
+        with self.metrics_lock:
+            batch_sizes = list(self.recent_batch_sizes)
+            delays = list(self.recent_queue_delays)
+            total_batches = self.total_batches
+            total_queries = self.total_queries
+            max_batch_seen = self.max_batch_seen
+
+        return {
+            "total_batches": total_batches,
+            "total_queries": total_queries,
+            "avg_batch_size": total_queries / total_batches if total_batches else 0,
+            "max_batch_size": max_batch_seen,
+            "recent_avg_batch_size": float(np.mean(batch_sizes)) if batch_sizes else 0,
+            "queue_delay_ms_p50": float(np.percentile(delays, 50) * 1000) if delays else 0,
+            "queue_delay_ms_p95": float(np.percentile(delays, 95) * 1000) if delays else 0,
+            "queue_depth": self.requests.qsize()
+        }
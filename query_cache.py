@@ -0,0 +1,131 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(query):
+    """Normalize query text so trivially different spellings share cache entries."""
+    return re.sub(r"\s+", " ", query.lower()).strip()
+
+def estimate_size(value):
+    """Rough size in bytes of a cached value, used for the memory cap."""
+    if isinstance(value, (str, bytes)):
+        return len(value) + 50
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value) + 56
+    return 32
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTL, a memory cap and version tags.
+
+    Every entry remembers the version it was stored under; a lookup with a
+    different version counts as a miss and drops the entry.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, expires_at, version, size)
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version=None):
+        """Return the cached value for `key`, or None on a miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, entry_version, _ = entry
+            if expires_at < time.time() or entry_version != version:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None):
+        """Store `value` under `key`, evicting least recently used entries if needed."""
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (value, time.time() + self.ttl, version, size)
+            self.current_bytes += size
+
+            while len(self.entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries."""
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key):
+        _, _, _, size = self.entries.pop(key)
+        self.current_bytes -= size
+
+    def get_metrics(self):
+        """Get hit/miss and size metrics."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+class QueryCache:
+    """Two-level cache for the RAG pipeline.
+
+    The retrieval level maps a normalized query plus search settings to the
+    retrieved context and is tagged with the vector store's index version, so
+    any write to the store invalidates it. The answer level maps a query, the
+    ids of the context it was built from and the model parameters to the
+    generated response. Chunk ids are never reused, so answers stay valid for
+    as long as the same chunks are retrieved.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, max_bytes=64 * 1024 * 1024):
+        self.retrieval = TTLCache(max_entries, ttl, max_bytes // 2)
+        self.answers = TTLCache(max_entries, ttl, max_bytes // 2)
+
+    def retrieval_key(self, query, top_k, search_options=None):
+        return (normalize_query(query), top_k, tuple(sorted((search_options or {}).items())))
+
+    def answer_key(self, query, context, model_params):
+        # A stitched passage lists every chunk it was built from under "chunk_ids"
+        context_ids = tuple(tuple(doc.get("chunk_ids", [doc.get("id", "")])) for doc in context)
+        return (normalize_query(query), context_ids, tuple(sorted(model_params.items())))
+
+    def get_metrics(self):
+        return {
+            "retrieval": self.retrieval.get_metrics(),
+            "answers": self.answers.get_metrics()
+        }
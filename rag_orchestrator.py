@@ -1,28 +1,54 @@
+import asyncio
 import logging
 import time
-import numpy as np
-import hashlib
+import embeddings
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 class RAGOrchestrator:
-    def __init__(self, vector_store, llm):
+    def __init__(self, vector_store, llm, embedder=None, max_concurrent_generations=8, query_coalescer=None,
+                 query_cache=None, reranker=None, top_k=5, context_assembler=None, semantic_cache=None):
         self.vector_store = vector_store
         self.llm = llm
+        self.max_concurrent_generations = max_concurrent_generations
+        # Optional QueryCoalescer that batches concurrent single-query searches
+        self.query_coalescer = query_coalescer
+        # Optional QueryCache for retrieval results and generated answers
+        self.query_cache = query_cache
+        # Optional SemanticCache that answers paraphrases of past queries
+        # before anything is retrieved
+        self.semantic_cache = semantic_cache
+        # Must be the same provider the document processor uses
+        self.embedder = embedder or embeddings.HashEmbeddingProvider(vector_store.vector_dim)
+        # Optional Reranker; when set, more candidates are retrieved and
+        # rescored, and only the best top_k go to the LLM
+        self.reranker = reranker
+        self.top_k = top_k
+        # Optional ContextAssembler that merges, dedupes and budgets the
+        # retrieved chunks before they are put in the prompt
+        self.context_assembler = context_assembler
+        self.generation_params = {"max_tokens": 1024, "temperature": 0.7}
         
-    def process_query(self, query):
-        """Process a user query through the RAG pipeline."""
+    def process_query(self, query, search_options=None):
+        """Process a user query through the RAG pipeline.
+        
+        `search_options` are passed through to `VectorStore.search`, e.g.
+        `nprobe` or `ef_search` to trade recall for latency on this query.
+        """
         start_time = time.time()
         
         # Log the query
         logger.info(f"Processing query: {query}")
         
-        # Create a query embedding
-        query_embedding = self._create_embedding(query)
+        query_embedding, semantic_hit = self._semantic_lookup(query)
+        if semantic_hit is not None:
+            return self._semantic_result(semantic_hit, start_time)
         
         # Retrieve relevant context from vector store
         retrieve_start = time.time()
-        context, distances = self.vector_store.search(query_embedding, top_k=5)
+        context, distances, retrieval_cached = self._retrieve(query, search_options, query_embedding)
+        context, assembly = self._assemble(context)
         retrieve_time = time.time() - retrieve_start
         
         # Log the retrieved context
@@ -34,7 +60,8 @@ class RAGOrchestrator:
         
         # Generate response using LLM with retrieved context
         generate_start = time.time()
-        response, llm_metrics = self.llm.generate_response(query, context)
+        response, llm_metrics, answer_cached = self._generate(query, context)
+        self._store_semantic(query, query_embedding, context, response, llm_metrics)
         generate_time = time.time() - generate_start
         
         # Calculate metrics
@@ -45,40 +72,387 @@ class RAGOrchestrator:
             "generation_time": generate_time,
             "context_chunks": len(context),
             "distances": distances,
+            "context_assembly": assembly,
             "llm_metrics": llm_metrics,
-            "retrieved_documents": [doc.get("id", "unknown") for doc in context]
+            "retrieved_documents": [doc.get("id", "unknown") for doc in context],
+            "cache": {"retrieval_hit": retrieval_cached, "answer_hit": answer_cached, "semantic_hit": False}
         }
         
         logger.info(f"Processed query in {total_time:.2f}s: retrieval={retrieve_time:.2f}s, generation={generate_time:.2f}s")
         
         return context, response, metrics
     
+    def process_query_stream(self, query, search_options=None):
+        """Process a query like `process_query`, streaming the generated answer.
+        
+        Yields a `{"type": "context", ...}` event once retrieval is done,
+        `{"type": "delta", "text": ...}` events while the LLM generates, and a
+        final `{"type": "done", "response": ..., "metrics": ...}` event.
+        """
+        start_time = time.time()
+        logger.info(f"Processing streaming query: {query}")
+        
+        query_embedding, semantic_hit = self._semantic_lookup(query)
+        if semantic_hit is not None:
+            context, response, metrics = self._semantic_result(semantic_hit, start_time)
+            yield {"type": "context", "context": context}
+            yield {"type": "delta", "text": response}
+            yield {"type": "done", "response": response, "metrics": metrics}
+            return
+        
+        retrieve_start = time.time()
+        context, distances, retrieval_cached = self._retrieve(query, search_options, query_embedding)
+        context, assembly = self._assemble(context)
+        retrieve_time = time.time() - retrieve_start
+        
+        yield {"type": "context", "context": context}
+        
+        generate_start = time.time()
+        response = None
+        llm_metrics = {}
+        answer_cached = False
+        
+        cache_key, cached = self._lookup_answer(query, context)
+        if cached is not None:
+            response, llm_metrics = cached
+            answer_cached = True
+            yield {"type": "delta", "text": response}
+        else:
+            for event in self.llm.generate_response_stream(query, context, **self.generation_params):
+                if event["type"] == "done":
+                    response = event["response"]
+                    llm_metrics = event["metrics"]
+                else:
+                    yield event
+            
+            self._store_answer(cache_key, response, llm_metrics)
+            self._store_semantic(query, query_embedding, context, response, llm_metrics)
+        
+        generate_time = time.time() - generate_start
+        total_time = time.time() - start_time
+        metrics = {
+            "total_time": total_time,
+            "retrieval_time": retrieve_time,
+            "generation_time": generate_time,
+            "time_to_first_token": retrieve_time + (llm_metrics.get("time_to_first_token") or 0.0),
+            "context_chunks": len(context),
+            "distances": distances,
+            "context_assembly": assembly,
+            "llm_metrics": llm_metrics,
+            "retrieved_documents": [doc.get("id", "unknown") for doc in context],
+            "cache": {"retrieval_hit": retrieval_cached, "answer_hit": answer_cached, "semantic_hit": False}
+        }
+        
+        logger.info(f"Streamed query in {total_time:.2f}s: retrieval={retrieve_time:.2f}s, generation={generate_time:.2f}s")
+        
+        yield {"type": "done", "response": response, "metrics": metrics}
+    
+    async def aprocess_query(self, query, search_options=None):
+        """Async version of `process_query` for asyncio servers.
+        
+        Retrieval runs in a thread executor so FAISS never blocks the event
+        loop, and generation awaits the async LLM client. Cancelling the task,
+        e.g. when the client disconnects, stops the pending LLM request.
+        """
+        start_time = time.time()
+        logger.info(f"Processing async query: {query}")
+        loop = asyncio.get_running_loop()
+        
+        query_embedding, semantic_hit = await loop.run_in_executor(None, self._semantic_lookup, query)
+        if semantic_hit is not None:
+            return self._semantic_result(semantic_hit, start_time)
+        
+        retrieve_start = time.time()
+        context, distances, retrieval_cached = await loop.run_in_executor(
+            None, self._retrieve, query, search_options, query_embedding
+        )
+        context, assembly = self._assemble(context)
+        retrieve_time = time.time() - retrieve_start
+        
+        if not context:
+            logger.warning(f"No context found for query: {query}")
+        
+        generate_start = time.time()
+        cache_key, cached = self._lookup_answer(query, context)
+        if cached is not None:
+            response, llm_metrics = cached
+            answer_cached = True
+        else:
+            response, llm_metrics = await self.llm.agenerate_response(query, context, **self.generation_params)
+            self._store_answer(cache_key, response, llm_metrics)
+            self._store_semantic(query, query_embedding, context, response, llm_metrics)
+            answer_cached = False
+        generate_time = time.time() - generate_start
+        
+        total_time = time.time() - start_time
+        metrics = {
+            "total_time": total_time,
+            "retrieval_time": retrieve_time,
+            "generation_time": generate_time,
+            "context_chunks": len(context),
+            "distances": distances,
+            "context_assembly": assembly,
+            "llm_metrics": llm_metrics,
+            "retrieved_documents": [doc.get("id", "unknown") for doc in context],
+            "cache": {"retrieval_hit": retrieval_cached, "answer_hit": answer_cached, "semantic_hit": False}
+        }
+        
+        logger.info(f"Processed async query in {total_time:.2f}s: retrieval={retrieve_time:.2f}s, generation={generate_time:.2f}s")
+        
+        return context, response, metrics
+    
+    def process_queries(self, queries, search_options=None):
+        """Process many queries with one embedding batch and one FAISS search.
+        
+        Generation for the individual queries is fanned out over a thread pool.
+        Returns a list of `(context, response, metrics)` tuples in query order.
+        """
+        if not queries:
+            return []
+        
+        start_time = time.time()
+        logger.info(f"Processing batch of {len(queries)} queries")
+        
+        retrieve_start = time.time()
+        version = self.vector_store.index_version
+        search_results = [None] * len(queries)
+        retrieval_cached = [False] * len(queries)
+        
+        # Answer paraphrases of recent questions from the semantic cache;
+        # their embeddings are reused for retrieval
+        all_embeddings = None
+        semantic_hits = [None] * len(queries)
+        if self.semantic_cache is not None:
+            all_embeddings = self.embedder.embed([self._prepare_query_text(query) for query in queries])
+            model_params = self._model_params()
+            for i, embedding in enumerate(all_embeddings):
+                semantic_hits[i] = self.semantic_cache.lookup(embedding, model_params)
+                if semantic_hits[i] is not None:
+                    search_results[i] = ([], [])
+        
+        # Serve what we can from the retrieval cache
+        if self.query_cache is not None:
+            for i, query in enumerate(queries):
+                if semantic_hits[i] is not None:
+                    continue
+                key = self.query_cache.retrieval_key(query, self.top_k, search_options)
+                cached = self.query_cache.retrieval.get(key, version)
+                if cached is not None:
+                    search_results[i] = cached
+                    retrieval_cached[i] = True
+        
+        # Embed the remaining queries at once and retrieve them with a single matrix search
+        missing = [i for i, result in enumerate(search_results) if result is None]
+        if missing:
+            if all_embeddings is not None:
+                query_embeddings = all_embeddings[missing]
+            else:
+                query_embeddings = self.embedder.embed([self._prepare_query_text(queries[i]) for i in missing])
+            batch_results = self.vector_store.search_batch(
+                query_embeddings, top_k=self._candidate_count(), query_texts=[queries[i] for i in missing],
+                **(search_options or {})
+            )
+            for i, (context, distances) in zip(missing, batch_results):
+                context, distances, reranked = self._rerank(queries[i], context, distances)
+                result = (context, distances)
+                search_results[i] = result
+                if self.query_cache is not None and reranked:
+                    key = self.query_cache.retrieval_key(queries[i], self.top_k, search_options)
+                    self.query_cache.retrieval.put(key, result, version)
+        retrieve_time = time.time() - retrieve_start
+        
+        def generate(i):
+            query = queries[i]
+            if semantic_hits[i] is not None:
+                return self._semantic_result(semantic_hits[i], start_time)
+            context, distances = search_results[i]
+            context, assembly = self._assemble(context)
+            generate_start = time.time()
+            response, llm_metrics, answer_cached = self._generate(query, context)
+            if all_embeddings is not None:
+                self._store_semantic(query, all_embeddings[i], context, response, llm_metrics)
+            generate_time = time.time() - generate_start
+            
+            metrics = {
+                "total_time": time.time() - start_time,
+                "retrieval_time": retrieve_time,
+                "generation_time": generate_time,
+                "context_chunks": len(context),
+                "distances": distances,
+                "context_assembly": assembly,
+                "llm_metrics": llm_metrics,
+                "retrieved_documents": [doc.get("id", "unknown") for doc in context],
+                "cache": {"retrieval_hit": retrieval_cached[i], "answer_hit": answer_cached, "semantic_hit": False}
+            }
+            return context, response, metrics
+        
+        # Generate responses concurrently; results keep the order of the queries
+        max_workers = max(1, min(self.max_concurrent_generations, len(queries)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(generate, range(len(queries))))
+        
+        total_time = time.time() - start_time
+        logger.info(f"Processed {len(queries)} queries in {total_time:.2f}s: retrieval={retrieve_time:.2f}s")
+        
+        return results
+    
+    def _retrieve(self, query, search_options=None, query_embedding=None):
+        """Embed a query and retrieve its context, going through the cache.
+        
+        Pass `query_embedding` if the query has already been embedded.
+        Returns `(context, distances, cache_hit)`.
+        """
+        version = self.vector_store.index_version
+        if self.query_cache is not None:
+            key = self.query_cache.retrieval_key(query, self.top_k, search_options)
+            cached = self.query_cache.retrieval.get(key, version)
+            if cached is not None:
+                logger.info(f"Retrieval cache hit for query: {query}")
+                context, distances = cached
+                return context, distances, True
+        
+        # Create a query embedding
+        if query_embedding is None:
+            query_embedding = self._create_embedding(query)
+        
+        candidate_count = self._candidate_count()
+        if self.query_coalescer is not None and not search_options:
+            context, distances = self.query_coalescer.search(query_embedding, top_k=candidate_count, query_text=query)
+        else:
+            context, distances = self.vector_store.search(
+                query_embedding, top_k=candidate_count, query_text=query, **(search_options or {})
+            )
+        context, distances, reranked = self._rerank(query, context, distances)
+        
+        # Results that fell back to first-stage order are not cached, so the
+        # next ask gets reranked once the load has passed
+        if self.query_cache is not None and reranked:
+            self.query_cache.retrieval.put(key, (context, distances), version)
+        
+        return context, distances, False
+    
+    def _candidate_count(self):
+        """Number of first-stage hits to retrieve per query."""
+        if self.reranker is None:
+            return self.top_k
+        return max(self.top_k, self.reranker.candidates)
+    
+    def _rerank(self, query, context, distances):
+        """Rerank first-stage hits if a reranker is configured.
+        
+        Returns `(context, distances, reranked)`, trimmed to top_k; without a
+        reranker `reranked` is True, as the results are final either way.
+        """
+        if self.reranker is None or not context:
+            return context[:self.top_k], distances[:self.top_k], True
+        return self.reranker.rerank(query, context, distances, self.top_k)
+    
+    def _assemble(self, context):
+        """Run the retrieved chunks through the context assembler, if any.
+        
+        Returns `(context, stats)`.
+        """
+        if self.context_assembler is None or not context:
+            return context, {}
+        return self.context_assembler.assemble(context)
+    
+    def _generate(self, query, context):
+        """Generate a response for a query and its context, going through the cache.
+        
+        Returns `(response, llm_metrics, cache_hit)`.
+        """
+        cache_key, cached = self._lookup_answer(query, context)
+        if cached is not None:
+            response, llm_metrics = cached
+            return response, llm_metrics, True
+        
+        response, llm_metrics = self.llm.generate_response(query, context, **self.generation_params)
+        self._store_answer(cache_key, response, llm_metrics)
+        
+        return response, llm_metrics, False
+    
+    def _lookup_answer(self, query, context):
+        """Look up a cached answer. Returns `(cache_key, (response, llm_metrics) or None)`."""
+        if self.query_cache is None:
+            return None, None
+        
+        cache_key = self.query_cache.answer_key(query, context, self._model_params())
+        cached = self.query_cache.answers.get(cache_key)
+        if cached is None:
+            return cache_key, None
+        
+        logger.info(f"Answer cache hit for query: {query}")
+        response, llm_metrics = cached
+        return cache_key, (response, dict(llm_metrics, cached=True))
+    
+    def _model_params(self):
+        """Parameters a cached answer must have been generated with to be reused."""
+        return dict(self.generation_params, model=self.llm.model)
+    
+    def _semantic_lookup(self, query):
+        """Embed a query and look it up in the semantic cache.
+        
+        Returns `(query_embedding, hit)`; both are None without a semantic
+        cache, and `hit` is None on a miss.
+        """
+        if self.semantic_cache is None:
+            return None, None
+        query_embedding = self._create_embedding(query)
+        hit = self.semantic_cache.lookup(query_embedding, self._model_params())
+        if hit is not None:
+            logger.info(f"Semantic cache hit for query: {query} "
+                        f"(cached: {hit['query']}, similarity {hit['similarity']:.3f})")
+        return query_embedding, hit
+    
+    def _semantic_result(self, hit, start_time):
+        """`(context, response, metrics)` for a query answered from the semantic cache."""
+        context = hit["context"]
+        metrics = {
+            "total_time": time.time() - start_time,
+            "retrieval_time": 0.0,
+            "generation_time": 0.0,
+            "context_chunks": len(context),
+            "distances": [],
+            "context_assembly": {},
+            "llm_metrics": dict(hit["llm_metrics"], cached=True),
+            "retrieved_documents": [doc.get("id", "unknown") for doc in context],
+            "cache": {
+                "retrieval_hit": False,
+                "answer_hit": True,
+                "semantic_hit": True,
+                "semantic_similarity": hit["similarity"],
+                "cached_query": hit["query"]
+            }
+        }
+        return context, hit["response"], metrics
+    
+    def _store_semantic(self, query, query_embedding, context, response, llm_metrics):
+        """Add a generated answer to the semantic cache, under the same rules as `_store_answer`."""
+        if self.semantic_cache is None or query_embedding is None:
+            return
+        if llm_metrics.get("is_mock") or "error" in llm_metrics or llm_metrics.get("cached"):
+            return
+        self.semantic_cache.store(query, query_embedding, context, response, llm_metrics, self._model_params())
+    
+    def _store_answer(self, cache_key, response, llm_metrics):
+        """Cache a generated answer; mock and error fallbacks are never cached."""
+        if cache_key is None or llm_metrics.get("is_mock") or "error" in llm_metrics:
+            return
+        self.query_cache.answers.put(cache_key, (response, llm_metrics))
+    
     def _create_embedding(self, text):
         """Create an embedding for query text.
         
         This should use the same embedding method as the document processor
         for consistent results.
         """
-        # Lowercase and clean text for better matching
-        clean_text = text.lower().strip()
-        
-        # Add some extra context words for better results with specific queries
-        # This helps with domain-specific queries like sports categories
-        if "cricket" in clean_text or "trophy" in clean_text or "icc" in clean_text:
-            clean_text += " cricket trophy championship tournament india"
-        elif "paddle" in clean_text or "sport" in clean_text:
-            clean_text += " paddle sports water competition"
-            
-        # Create a deterministic embedding based on content hash
-        hash_bytes = hashlib.md5(clean_text.encode()).digest()
-        
-        # Create a vector of 16 dimensions from the hash
-        embedding = np.array([float(byte) / 255.0 for byte in hash_bytes])
-        
-        # Normalize the embedding vector (important for meaningful cosine similarity)
-        norm = np.linalg.norm(embedding)
-        if norm > 0:
-            embedding = embedding / norm
+        embedding = self.embedder.embed_one(self._prepare_query_text(text))
             
         logger.info(f"Created embedding for query: {text}")
         return embedding
+    
+    def _prepare_query_text(self, text):
+        """Normalize query text before it is embedded."""
+        # Lowercase and clean text for better matching; exact keyword matches
+        # are handled by the vector store's lexical index
+        return text.lower().strip()
@@ -0,0 +1,169 @@
+import logging
+import os
+import threading
+import time
+from lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+class TermOverlapScorer:
+    """Scores a chunk by how much of the query it contains.
+
+    The score is the fraction of distinct query terms found in the chunk
+    plus half the fraction of query bigrams found as adjacent words, so
+    chunks that contain the query's phrases rank above ones that merely
+    mention its words. Needs no model and costs microseconds per chunk.
+    """
+
+    name = "overlap"
+
+    def score(self, query, texts):
+        """Return one relevance score per text, higher is better."""
+        query_tokens = tokenize(query)
+        terms = set(query_tokens)
+        bigrams = set(zip(query_tokens, query_tokens[1:]))
+        if not terms:
+            return [0.0] * len(texts)
+
+        scores = []
+        for text in texts:
+            tokens = tokenize(text)
+            term_score = len(terms.intersection(tokens)) / len(terms)
+            bigram_score = len(bigrams.intersection(zip(tokens, tokens[1:]))) / len(bigrams) if bigrams else 0.0
+            scores.append(term_score + 0.5 * bigram_score)
+        return scores
+
+class CrossEncoderScorer:
+    """Scores (query, chunk) pairs with a local cross-encoder model on the CPU.
+
+    Like the sentence-transformer embedding provider, the model is loaded
+    from a local directory with the Hugging Face hub in offline mode.
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model_path, batch_size=16, num_threads=None, max_length=512):
+        if not model_path or not os.path.isdir(model_path):
+            raise ValueError(f"Reranker model directory not found: {model_path!r}")
+
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+        try:
+            import torch
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("The cross-encoder reranker requires the 'sentence-transformers' package") from e
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_path, device="cpu", max_length=max_length)
+        logger.info(f"Loaded reranker model from {model_path}")
+
+    def score(self, query, texts):
+        """Return one relevance score per text, higher is better."""
+        if len(texts) == 0:
+            return []
+        scores = self.model.predict(
+            [(query, text) for text in texts],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+        return [float(score) for score in scores]
+
+SCORERS = {
+    TermOverlapScorer.name: TermOverlapScorer,
+    CrossEncoderScorer.name: CrossEncoderScorer,
+}
+
+def create_scorer(name="overlap", **options):
+    """Create the reranking scorer registered under `name`."""
+    scorer_class = SCORERS.get(name)
+    if scorer_class is None:
+        raise ValueError(f"Unknown reranker {name!r}. Available rerankers: {', '.join(SCORERS)}")
+
+    logger.info(f"Creating reranker: {name}")
+    return scorer_class(**options)
+
+class Reranker:
+    """Second retrieval stage: rescores first-stage candidates and keeps the best.
+
+    The orchestrator fetches `candidates` hits from the vector store and
+    passes them to `rerank`, which scores them `batch_size` at a time. A
+    running average of the batch latency predicts whether the next batch
+    fits in `time_budget_ms`; if not, scoring stops and the first-stage
+    order is returned unchanged.
+    """
+
+    def __init__(self, scorer, candidates=20, batch_size=16, time_budget_ms=100.0):
+        self.scorer = scorer
+        self.candidates = candidates
+        self.batch_size = max(1, batch_size)
+        self.time_budget = time_budget_ms / 1000.0
+
+        self.lock = threading.Lock()
+        self.batch_time = None  # moving average of one scoring batch, in seconds
+        self.total_queries = 0
+        self.reranked_queries = 0
+        self.fallbacks = 0
+        self.total_rerank_time = 0.0
+
+    def rerank(self, query, results, distances, top_k):
+        """Reorder search results by reranker score and keep `top_k`.
+
+        Returns `(results, distances, reranked)`; `reranked` is False when
+        the time budget forced a fallback to the first-stage order.
+        """
+        start_time = time.time()
+        scores = []
+        for batch_start in range(0, len(results), self.batch_size):
+            with self.lock:
+                batch_time = self.batch_time
+            if batch_time is not None and time.time() - start_time + batch_time > self.time_budget:
+                self._record(start_time, reranked=False)
+                logger.info(f"Reranking {len(results)} candidates would exceed "
+                            f"{self.time_budget * 1000:.0f}ms; using first-stage order")
+                return results[:top_k], distances[:top_k], False
+
+            batch_started = time.time()
+            batch = results[batch_start:batch_start + self.batch_size]
+            scores.extend(self.scorer.score(query, [result["text"] for result in batch]))
+            self._record_batch(time.time() - batch_started)
+
+        order = sorted(range(len(results)), key=lambda i: scores[i], reverse=True)[:top_k]
+        reranked = [dict(results[i], rerank_score=scores[i]) for i in order]
+        self._record(start_time, reranked=True)
+        return reranked, [distances[i] for i in order], True
+
+    def _record_batch(self, elapsed):
+        with self.lock:
+            self.batch_time = elapsed if self.batch_time is None else 0.8 * self.batch_time + 0.2 * elapsed
+
+    def _record(self, start_time, reranked):
+        with self.lock:
+            self.total_queries += 1
+            self.total_rerank_time += time.time() - start_time
+            if reranked:
+                self.reranked_queries += 1
+            else:
+                self.fallbacks += 1
+                # Decay the estimate so a latency spike does not disable
+                # reranking for good
+                self.batch_time *= 0.9
+
+    def get_metrics(self):
+        """Get rerank counts, fallbacks and latency."""
+        with self.lock:
+            return {
+                "scorer": self.scorer.name,
+                "candidates": self.candidates,
+                "batch_size": self.batch_size,
+                "time_budget_ms": self.time_budget * 1000,
+                "total_queries": self.total_queries,
+                "reranked_queries": self.reranked_queries,
+                "fallbacks": self.fallbacks,
+                "avg_rerank_ms": self.total_rerank_time / self.total_queries * 1000 if self.total_queries else 0,
+                "avg_batch_ms": (self.batch_time or 0) * 1000
+            }
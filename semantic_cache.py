@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """Answer cache keyed by query meaning instead of query text.
+
+    Past query embeddings live in a small inner-product FAISS index; a new
+    query whose cosine similarity to a stored one reaches `threshold` (and
+    that asks for the same model parameters) gets the stored answer and
+    context back. Each entry records the ids of the chunks its answer was
+    built from and is evicted as soon as any of them is removed from the
+    vector store. Holds at most `max_entries` entries, least recently used
+    first out, each for at most `ttl` seconds.
+    """
+
+    def __init__(self, vector_dim, threshold=0.92, max_entries=512, ttl=3600, candidates=4):
+        self.vector_dim = vector_dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.candidates = candidates
+
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector_dim))
+        self.entries = OrderedDict()  # entry id -> entry dict, least recently used first
+        self.chunk_entries = {}  # chunk id -> ids of entries built from it
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, query_embedding, model_params):
+        """Return the best matching entry, or None on a miss.
+
+        The entry is a dict with "query", "response", "llm_metrics",
+        "context" and the "similarity" of the match.
+        """
+        query_vector = self._normalize(query_embedding)
+        with self.lock:
+            if self.index.ntotal == 0:
+                self.misses += 1
+                return None
+
+            similarities, entry_ids = self.index.search(query_vector, min(self.candidates, self.index.ntotal))
+            now = time.time()
+            for similarity, entry_id in zip(similarities[0].tolist(), entry_ids[0].tolist()):
+                if entry_id < 0 or similarity < self.threshold:
+                    break
+                entry = self.entries[entry_id]
+                if entry["expires_at"] < now:
+                    self._remove(entry_id)
+                    self.invalidations += 1
+                    continue
+                if entry["model_params"] != model_params:
+                    continue
+                self.entries.move_to_end(entry_id)
+                self.hits += 1
+                return dict(entry, similarity=similarity)
+
+            self.misses += 1
+            return None
+
+    def store(self, query, query_embedding, context, response, llm_metrics, model_params):
+        """Cache an answer with the context it was generated from."""
+        chunk_ids = {
+            chunk_id
+            for doc in context
+            for chunk_id in doc.get("chunk_ids", [doc.get("id")])
+            if chunk_id is not None
+        }
+        if not chunk_ids:
+            # Nothing would ever invalidate an answer given without context
+            return
+
+        query_vector = self._normalize(query_embedding)
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(query_vector, np.array([entry_id], dtype=np.int64))
+            self.entries[entry_id] = {
+                "query": query,
+                "response": response,
+                "llm_metrics": llm_metrics,
+                "context": context,
+                "model_params": model_params,
+                "chunk_ids": chunk_ids,
+                "expires_at": time.time() + self.ttl
+            }
+            for chunk_id in chunk_ids:
+                self.chunk_entries.setdefault(chunk_id, set()).add(entry_id)
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_chunks(self, chunk_ids):
+        """Evict every entry built from any of `chunk_ids`.
+
+        Registered as a VectorStore removal listener, so it runs whenever
+        chunks are deleted or replaced.
+        """
+        with self.lock:
+            entry_ids = set()
+            for chunk_id in chunk_ids:
+                entry_ids.update(self.chunk_entries.get(chunk_id, ()))
+            for entry_id in entry_ids:
+                self._remove(entry_id)
+            self.invalidations += len(entry_ids)
+
+        if entry_ids:
+            logger.info(f"Evicted {len(entry_ids)} semantic cache entries built from changed chunks")
+
+    def clear(self):
+        """Drop all entries."""
+        with self.lock:
+            self.index.reset()
+            self.entries.clear()
+            self.chunk_entries.clear()
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        self.index.remove_ids(np.array([entry_id], dtype=np.int64))
+        for chunk_id in entry["chunk_ids"]:
+            linked = self.chunk_entries.get(chunk_id)
+            if linked is not None:
+                linked.discard(entry_id)
+                if not linked:
+                    del self.chunk_entries[chunk_id]
+
+    def _normalize(self, query_embedding):
+        """Unit-length float32 row, so inner product is cosine similarity."""
+        query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+        if query_vector.shape[1] != self.vector_dim:
+            raise ValueError(f"Got a {query_vector.shape[1]}-dimensional query embedding, expected {self.vector_dim}")
+        faiss.normalize_L2(query_vector)
+        return query_vector
+
+    def get_metrics(self):
+        """Get hit/miss, eviction and size metrics."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
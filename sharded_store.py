@@ -0,0 +1,430 @@
+import hashlib
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import numpy as np
+from chunk_store import parse_document_id
+from vector_store import HYBRID_CANDIDATE_FACTOR, VectorStore, content_hash, fuse_rankings, fused_result
+
+logger = logging.getLogger(__name__)
+
+# Ways of assigning sources to shards
+PARTITIONS = ("hash", "round_robin")
+
+# Ways of running shards
+SHARD_MODES = ("thread", "process")
+
+SHARDS_FILE = "shards.json"
+
+def _serve_shard(connection, store_options, snapshot_path):
+    """Run a VectorStore in a child process and answer calls from a ProcessShard.
+
+    Each request is `(method, args, kwargs)`; each reply is `(ok, result or
+    exception, removed chunk keys)`. None shuts the shard down.
+    """
+    if snapshot_path:
+        store = VectorStore.load(snapshot_path)
+    else:
+        store = VectorStore(**store_options)
+    removed = []
+    store.removal_listeners.append(removed.extend)
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        method, args, kwargs = message
+        try:
+            reply = (True, getattr(store, method)(*args, **kwargs), removed[:])
+        except Exception as e:
+            reply = (False, e, removed[:])
+        removed.clear()
+        connection.send(reply)
+    connection.close()
+
+class LocalShard:
+    """A VectorStore in this process, called directly."""
+
+    remote = False
+
+    def __init__(self, store, on_removed=None):
+        self.store = store
+        if on_removed is not None:
+            store.removal_listeners.append(on_removed)
+
+    def call(self, method, *args, **kwargs):
+        return getattr(self.store, method)(*args, **kwargs)
+
+    def close(self):
+        pass
+
+class ProcessShard:
+    """A VectorStore in a child process, called over a pipe.
+
+    Stands in for a network RPC client: arguments and results are pickled,
+    and calls are serialized per shard, so only the shards themselves run
+    in parallel. Keys of chunks removed by a call come back with its reply
+    and are passed to `on_removed`.
+    """
+
+    remote = True
+
+    def __init__(self, store_options=None, snapshot_path=None, on_removed=None):
+        # The platform's default start method, like the ingest process pool;
+        # create shards before other threads start
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve_shard,
+            args=(child_connection, store_options or {}, snapshot_path),
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.lock = threading.Lock()
+        self.on_removed = on_removed
+
+    def call(self, method, *args, **kwargs):
+        with self.lock:
+            self.connection.send((method, args, kwargs))
+            ok, result, removed = self.connection.recv()
+        if removed and self.on_removed is not None:
+            self.on_removed(removed)
+        if not ok:
+            raise result
+        return result
+
+    def close(self):
+        with self.lock:
+            try:
+                self.connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=5)
+
+class ShardedVectorStore:
+    """Partitions chunks across several VectorStores and searches them together.
+
+    Every chunk of a source lives on one shard, picked by a stable hash of
+    the source name or round-robin as sources are first seen, so upserts
+    and deletes touch a single shard. A search runs on all shards at once
+    on a thread pool (FAISS releases the GIL while searching) and the
+    per-shard top-k lists are merged with a heap, so results have the same
+    shape as `VectorStore.search`. With `shard_mode="process"` each shard
+    runs in its own process behind ProcessShard.
+
+    Vector distances are comparable across shards. For hybrid (BM25 +
+    vector) search each shard returns its unfused vector and BM25
+    candidates; both rankings are merged across shards and fused once, so
+    ranks are global. BM25 scores use each shard's own term statistics.
+    """
+
+    def __init__(self, num_shards=2, partition="hash", shard_mode="thread", snapshot_paths=None,
+                 **store_options):
+        if num_shards < 1:
+            raise ValueError(f"Need at least one shard, got {num_shards}")
+        if partition not in PARTITIONS:
+            raise ValueError(f"Unknown partition {partition!r}. Supported partitions: {', '.join(PARTITIONS)}")
+        if shard_mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode {shard_mode!r}. Supported modes: {', '.join(SHARD_MODES)}")
+
+        self.vector_dim = store_options.get("vector_dim", 16)
+        self.partition = partition
+        self.shard_mode = shard_mode
+        self.store_options = store_options
+        self.lexical_search = store_options.get("lexical_search", True)
+        self.rrf_k = store_options.get("rrf_k", 60)
+        # Called with the keys of removed chunks, as for VectorStore
+        self.removal_listeners = []
+
+        self.shards = []
+        for i in range(num_shards):
+            snapshot_path = snapshot_paths[i] if snapshot_paths else None
+            if shard_mode == "process":
+                self.shards.append(ProcessShard(store_options, snapshot_path, self._notify_removed))
+            else:
+                store = VectorStore.load(snapshot_path) if snapshot_path else VectorStore(**store_options)
+                self.shards.append(LocalShard(store, self._notify_removed))
+
+        # Source -> shard for round-robin partitioning
+        self.assignments = {}
+        self.next_shard = 0
+        self.assignment_lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(max_workers=num_shards, thread_name_prefix="shard-search")
+        # Bumped on every write through this store, for cache invalidation
+        self.index_version = 0
+        self.version_lock = threading.Lock()
+
+        logger.info(f"Initialized ShardedVectorStore with {num_shards} {shard_mode} shards, {partition} partitioning")
+
+    def shard_for(self, source):
+        """Index of the shard that holds `source`."""
+        if self.partition == "hash":
+            # A stable hash, unlike hash(), so shards agree across restarts
+            return int(hashlib.md5(source.encode()).hexdigest()[:8], 16) % len(self.shards)
+
+        with self.assignment_lock:
+            shard = self.assignments.get(source)
+            if shard is None:
+                shard = self.assignments[source] = self.next_shard
+                self.next_shard = (self.next_shard + 1) % len(self.shards)
+            return shard
+
+    # Writes
+
+    def add_document(self, document_id, text, embedding=None):
+        """Add a document to the shard of its source."""
+        source, _ = parse_document_id(document_id)
+        doc_key = self.shards[self.shard_for(source)].call("add_document", document_id, text, embedding)
+        self._bump_version()
+        return doc_key
+
+    def add_documents(self, document_ids, texts, embeddings, spans=None, source_text=None):
+        """Add a batch of documents, split by shard. See VectorStore.add_documents."""
+        if len(document_ids) != len(texts):
+            raise ValueError(f"Got {len(document_ids)} document ids for {len(texts)} texts")
+        if not document_ids:
+            return []
+
+        rows_by_shard = {}
+        for row, document_id in enumerate(document_ids):
+            source, _ = parse_document_id(document_id)
+            rows_by_shard.setdefault(self.shard_for(source), []).append(row)
+
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(document_ids), -1)
+        doc_keys = [None] * len(document_ids)
+        for shard, rows in rows_by_shard.items():
+            shard_keys = self.shards[shard].call(
+                "add_documents",
+                [document_ids[row] for row in rows],
+                [texts[row] for row in rows],
+                embeddings[rows],
+                spans=[spans[row] for row in rows] if spans is not None else None,
+                source_text=source_text
+            )
+            for row, doc_key in zip(rows, shard_keys):
+                doc_keys[row] = doc_key
+
+        self._bump_version()
+        return doc_keys
+
+    def upsert_source(self, source, document_ids, texts, embeddings=None, embedded=None, embed_fn=None,
+                      spans=None, source_text=None):
+        """Upsert a source on its shard. See VectorStore.upsert_source."""
+        shard = self.shards[self.shard_for(source)]
+        if shard.remote and embed_fn is not None:
+            # Callables do not cross the process boundary, so embed the new
+            # chunks here before sending them
+            embeddings, embedded = self._embed_new_chunks(shard, source, texts, embeddings, embedded, embed_fn)
+            embed_fn = None
+
+        changes = shard.call(
+            "upsert_source", source, document_ids, texts, embeddings, embedded,
+            embed_fn=embed_fn, spans=spans, source_text=source_text
+        )
+        self._bump_version()
+        return changes
+
+    def delete_source(self, source):
+        """Delete every chunk of a source. Returns the number removed."""
+        shard = self.shard_for(source)
+        removed = self.shards[shard].call("delete_source", source)
+        if self.partition == "round_robin":
+            with self.assignment_lock:
+                self.assignments.pop(source, None)
+        self._bump_version()
+        return removed
+
+    def source_hashes(self, source):
+        """Content hashes of the chunks currently stored for `source`."""
+        return self.shards[self.shard_for(source)].call("source_hashes", source)
+
+    def source_hash_ids(self, source):
+        """Map of content hash -> shard-local FAISS ids of the chunks stored for `source`."""
+        return self.shards[self.shard_for(source)].call("source_hash_ids", source)
+
+    def remove_source_chunks(self, source, faiss_ids):
+        """Delete chunks of `source` returned by source_hash_ids. Returns the number removed."""
+        removed = self.shards[self.shard_for(source)].call("remove_source_chunks", source, faiss_ids)
+        self._bump_version()
+        return removed
+
+    def _embed_new_chunks(self, shard, source, texts, embeddings, embedded, embed_fn):
+        """Fill in embeddings for the chunks the shard does not have yet."""
+        if embedded is None:
+            embedded = np.full(len(texts), embeddings is not None, dtype=bool)
+        known_hashes = shard.call("source_hashes", source)
+        hashes = [content_hash(text) for text in texts]
+        repeated = {chunk_hash for chunk_hash in hashes if hashes.count(chunk_hash) > 1}
+        # Repeated chunks may need more copies than the shard keeps, so embed them too
+        missing = [
+            i for i, chunk_hash in enumerate(hashes)
+            if not embedded[i] and (chunk_hash not in known_hashes or chunk_hash in repeated)
+        ]
+        if not missing:
+            return embeddings, embedded
+
+        if embeddings is None:
+            embeddings = np.zeros((len(texts), self.vector_dim), dtype=np.float32)
+        else:
+            embeddings = np.array(embeddings, dtype=np.float32)
+        embeddings[missing] = embed_fn([texts[i] for i in missing])
+        embedded = np.array(embedded, dtype=bool)
+        embedded[missing] = True
+        return embeddings, embedded
+
+    def _bump_version(self):
+        with self.version_lock:
+            self.index_version += 1
+
+    def _notify_removed(self, doc_keys):
+        for listener in self.removal_listeners:
+            listener(doc_keys)
+
+    # Search
+
+    def search(self, query_embedding, top_k=5, nprobe=None, ef_search=None, query_text=None):
+        """Search every shard. See VectorStore.search."""
+        query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        query_texts = [query_text] if query_text is not None else None
+        return self.search_batch(query_embedding, top_k, nprobe=nprobe, ef_search=ef_search,
+                                 query_texts=query_texts)[0]
+
+    def search_batch(self, query_embeddings, top_k=5, nprobe=None, ef_search=None, query_texts=None):
+        """Scatter a batch of queries to all shards in parallel and merge the results.
+
+        Returns a list of `(results, distances)` pairs like
+        `VectorStore.search_batch`.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        if query_embeddings.shape[0] == 0:
+            return []
+
+        start_time = time.time()
+        # Hybrid scores depend on ranks, so fuse once over all shards' candidates
+        hybrid = query_texts is not None and self.lexical_search
+        futures = [
+            self.executor.submit(
+                shard.call, "search_candidates" if hybrid else "search_batch", query_embeddings, top_k,
+                nprobe=nprobe, ef_search=ef_search, query_texts=query_texts
+            )
+            for shard in self.shards
+        ]
+        shard_results = [future.result() for future in futures]
+
+        merge = self._fuse if hybrid else self._merge
+        merged = [
+            merge([results[row] for results in shard_results], top_k)
+            for row in range(query_embeddings.shape[0])
+        ]
+        logger.info(f"Searched {len(self.shards)} shards for {len(merged)} queries in "
+                    f"{(time.time() - start_time) * 1000:.1f}ms")
+        return merged
+
+    @staticmethod
+    def _merge(shard_hits, top_k):
+        """Merge per-shard `(results, distances)` lists, each best first, into the global top_k."""
+        hits = heapq.merge(
+            *(zip(results, distances) for results, distances in shard_hits),
+            key=lambda hit: -hit[0]["score"]
+        )
+        best = list(islice(hits, top_k))
+        return [result for result, _ in best], [distance for _, distance in best]
+
+    def _fuse(self, shard_candidates, top_k):
+        """Merge per-shard `(vector_hits, lexical_hits)` rankings and fuse them into the global top_k."""
+        candidate_k = top_k * HYBRID_CANDIDATE_FACTOR
+        vector_hits = list(islice(heapq.merge(
+            *(hits for hits, _ in shard_candidates), key=lambda hit: hit[1]
+        ), candidate_k))
+        lexical_hits = list(islice(heapq.merge(
+            *(hits for _, hits in shard_candidates), key=lambda hit: -hit[1]
+        ), candidate_k))
+
+        by_id = {result["id"]: result for result, _ in vector_hits + lexical_hits}
+        fused = fuse_rankings(
+            [(result["id"], distance) for result, distance in vector_hits],
+            [(result["id"], lexical_score) for result, lexical_score in lexical_hits],
+            self.rrf_k, top_k
+        )
+        return (
+            [fused_result(by_id[key], score, distance, lexical_score) for key, score, distance, lexical_score in fused],
+            [distance for _, _, distance, _ in fused]
+        )
+
+    # Metrics and persistence
+
+    def get_metrics(self):
+        """Totals over all shards, with each shard's own metrics under "shards"."""
+        shard_metrics = [shard.call("get_metrics") for shard in self.shards]
+        summed = ("document_count", "unique_sources", "chunk_store_bytes", "lexical_index_bytes")
+        metrics = {name: sum(metrics.get(name, 0) for metrics in shard_metrics) for name in summed}
+        metrics.update({
+            "last_update": max(metrics["last_update"] for metrics in shard_metrics),
+            "vector_dimension": self.vector_dim,
+            "index_type": shard_metrics[0]["index_type"],
+            "index_trained": all(metrics["index_trained"] for metrics in shard_metrics),
+            "index_version": self.index_version,
+            "shard_count": len(self.shards),
+            "shard_mode": self.shard_mode,
+            "partition": self.partition,
+            "shards": shard_metrics
+        })
+        return metrics
+
+    def get_source_stats(self):
+        """Live chunk count per source across all shards."""
+        source_stats = {}
+        for shard in self.shards:
+            source_stats.update(shard.call("get_source_stats"))
+        return source_stats
+
+    def save(self, path):
+        """Save every shard into its own subdirectory of `path`."""
+        os.makedirs(path, exist_ok=True)
+        for i, shard in enumerate(self.shards):
+            shard.call("save", os.path.join(path, f"shard_{i}"))
+        with self.assignment_lock:
+            layout = {
+                "num_shards": len(self.shards),
+                "partition": self.partition,
+                "assignments": self.assignments,
+                "next_shard": self.next_shard
+            }
+        with open(os.path.join(path, SHARDS_FILE), "w") as f:
+            json.dump(layout, f, indent=2)
+
+    @classmethod
+    def load(cls, path, shard_mode="thread"):
+        """Load a store saved with `save`."""
+        with open(os.path.join(path, SHARDS_FILE)) as f:
+            layout = json.load(f)
+        snapshot_paths = [os.path.join(path, f"shard_{i}") for i in range(layout["num_shards"])]
+        store = cls(
+            num_shards=layout["num_shards"],
+            partition=layout["partition"],
+            shard_mode=shard_mode,
+            snapshot_paths=snapshot_paths
+        )
+        metrics = store.shards[0].call("get_metrics")
+        store.vector_dim = metrics["vector_dimension"]
+        store.lexical_search = metrics["lexical_search"]
+        store.rrf_k = metrics["rrf_k"]
+        store.assignments = layout["assignments"]
+        store.next_shard = layout["next_shard"]
+        logger.info(f"Loaded ShardedVectorStore with {len(store.shards)} shards from {path}")
+        return store
+
+    def close(self):
+        """Stop shard processes and the search pool."""
+        for shard in self.shards:
+            shard.close()
+        self.executor.shutdown(wait=False)
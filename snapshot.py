@@ -0,0 +1,47 @@
+import logging
+import os
+import json
+import shutil
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 3
+
+INDEX_FILE = "index.faiss"
+MANIFEST_FILE = "manifest.json"
+
+def write_snapshot(directory, write_index, manifest, chunk_store, lexical_index=None):
+    """Write a VectorStore snapshot into `directory`, replacing any previous one.
+
+    `write_index(path)` writes the FAISS index and the ChunkStore writes its
+    columns and text arena, which load back as memory maps. A BM25Index, if
+    given, writes its postings next to them. The snapshot is
+    built in a temporary directory and swapped into place at the end.
+    """
+    tmp_directory = f"{directory.rstrip(os.sep)}.tmp"
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    os.makedirs(tmp_directory)
+
+    write_index(os.path.join(tmp_directory, INDEX_FILE))
+    chunk_store.save(tmp_directory)
+    if lexical_index is not None:
+        lexical_index.save(tmp_directory)
+
+    manifest = dict(manifest, version=SNAPSHOT_VERSION, count=chunk_store.count)
+    with open(os.path.join(tmp_directory, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+
+    logger.info(f"Wrote snapshot of {chunk_store.count} chunks to {directory}")
+
+def read_manifest(directory):
+    """Read and validate a snapshot manifest."""
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest.get('version')} in {directory}")
+    return manifest
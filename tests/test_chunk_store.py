@@ -0,0 +1,15 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from chunk_store import parse_document_id
+
+def test_parse_chunk_id():
+    assert parse_document_id("notes.txt_chunk_3") == ("notes.txt", 3)
+
+def test_parse_source_containing_chunk_marker():
+    assert parse_document_id("meeting_chunk_notes.txt_chunk_0") == ("meeting_chunk_notes.txt", 0)
+    assert parse_document_id("meeting_chunk_notes.txt") == ("meeting_chunk_notes.txt", -1)
+
+def test_parse_plain_id():
+    assert parse_document_id("doc-42") == ("doc-42", -1)
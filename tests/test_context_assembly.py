@@ -0,0 +1,51 @@
+from chunking import SentenceChunker, whitespace_end
+from context_assembly import ContextAssembler
+
+TEXT = (
+    "The committee met on Monday. It reviewed the budget for the next year.\n\n"
+    "Spending on research rises by ten percent. Travel is cut in half.\n\n"
+    "The vote is scheduled for Friday. Members may submit amendments until Thursday."
+)
+
+def sentence_chunks(text):
+    spans = SentenceChunker(max_tokens=16, overlap_tokens=0).split(text)
+    return [
+        {
+            "id": f"minutes.txt_chunk_{i}_{i}",
+            "text": text[start:end],
+            "source": "minutes.txt",
+            "score": 1.0 - i * 0.1,
+            "span": (start, end),
+            "space_end": whitespace_end(text, end)
+        }
+        for i, (start, end) in enumerate(spans)
+    ]
+
+def test_adjacent_sentence_chunks_are_stitched():
+    chunks = sentence_chunks(TEXT)
+    assert len(chunks) > 2
+    # The chunker strips whitespace, so consecutive spans never touch
+    assert all(left["span"][1] < right["span"][0] for left, right in zip(chunks, chunks[1:]))
+
+    passages, stats = ContextAssembler(separator=" ").assemble(chunks)
+
+    assert stats["merged_chunks"] == len(chunks) - 1
+    assert passages[0]["text"] == " ".join(chunk["text"] for chunk in chunks)
+    assert passages[0]["chunk_ids"] == [chunk["id"] for chunk in chunks]
+
+def test_chunks_with_text_between_them_stay_apart():
+    chunks = sentence_chunks(TEXT)
+    passages, stats = ContextAssembler().assemble([chunks[0], chunks[2]])
+
+    assert stats["merged_chunks"] == 0
+    assert len(passages) == 2
+
+def test_budget_is_packed_in_rerank_order():
+    context = [
+        {"id": "a.txt_chunk_0_0", "text": "alpha " * 30, "source": "a.txt", "score": 0.9, "rerank_score": 0.1},
+        {"id": "b.txt_chunk_0_1", "text": "beta " * 30, "source": "b.txt", "score": 0.5, "rerank_score": 0.8},
+    ]
+    passages, stats = ContextAssembler(max_tokens=40).assemble(context)
+
+    assert [passage["source"] for passage in passages] == ["b.txt"]
+    assert stats["over_budget_dropped"] == 1
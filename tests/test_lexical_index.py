@@ -0,0 +1,45 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from lexical_index import BM25Index, term_frequencies
+
+def test_total_length_matches_stored_lengths_with_empty_chunks(tmp_path):
+    index = BM25Index()
+    texts = ["", "alpha beta", "...", "alpha gamma gamma"]
+    index.add(np.arange(len(texts)), [term_frequencies(text) for text in texts])
+    assert index.total_length == int(index.doc_lengths.sum())
+
+    index.remove([0, 1], [term_frequencies(texts[0]), term_frequencies(texts[1])])
+    assert index.doc_count == 2
+    assert index.total_length == int(index.doc_lengths.sum())
+
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    assert loaded.total_length == index.total_length
+
+    index.remove([2, 3], [term_frequencies(texts[2]), term_frequencies(texts[3])])
+    assert index.doc_count == 0
+    assert index.total_length == 0
+
+def test_load_maps_postings_and_copies_on_write(tmp_path):
+    index = BM25Index()
+    texts = ["alpha beta", "beta gamma", "gamma delta", "alpha alpha"]
+    index.add(np.arange(len(texts)), [term_frequencies(text) for text in texts])
+    index.save(str(tmp_path))
+
+    loaded = BM25Index.load(str(tmp_path), mmap=True)
+    assert isinstance(loaded.flat_ids, np.memmap)
+    assert loaded.postings_ids == {}
+    for query in ("alpha", "beta gamma", "delta"):
+        expected_ids, expected_scores = index.search(query)
+        ids, scores = loaded.search(query)
+        assert ids.tolist() == expected_ids.tolist()
+        assert np.allclose(scores, expected_scores)
+
+    loaded.add(np.array([4]), [term_frequencies("alpha epsilon")])
+    loaded.remove([0], [term_frequencies(texts[0])])
+    # Only the terms the writes touched were copied out of the flat arrays
+    assert set(loaded.postings_ids) == {loaded.terms["alpha"], loaded.terms["epsilon"]}
+    assert sorted(loaded.search("alpha")[0].tolist()) == [3, 4]
+    assert loaded.search("epsilon")[0].tolist() == [4]
@@ -0,0 +1,60 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("langchain")
+llm_service = pytest.importorskip("llm_service")
+
+class CompletionStub(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests_seen.append((self.path, self.headers["Authorization"], body))
+        if body.get("stream"):
+            payload = "".join(
+                f"data: {json.dumps({'choices': [{'text': text}]})}\n\n" for text in ("Hello", " there")
+            ) + "data: [DONE]\n\n"
+            content_type = "text/event-stream"
+        else:
+            payload = json.dumps({"choices": [{"text": "Hello there"}]})
+            content_type = "application/json"
+        encoded = payload.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def service(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CompletionStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    CompletionStub.requests_seen = []
+    monkeypatch.setenv("TOGETHER_API_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setenv("TOGETHER_API_KEY", "test-key")
+
+    from app import app
+    with app.app_context():
+        yield llm_service.TogetherAIService()
+
+    server.shutdown()
+    server.server_close()
+
+def test_completion_uses_configured_base_url(service):
+    assert service.generate_completion("Hi") == "Hello there"
+
+    path, authorization, body = CompletionStub.requests_seen[0]
+    assert path == "/v1/completions"
+    assert authorization == "Bearer test-key"
+    assert body["prompt"] == "Hi"
+
+def test_completion_stream_uses_configured_base_url(service):
+    assert "".join(service.generate_completion_stream("Hi")) == "Hello there"
+    assert CompletionStub.requests_seen[0][0] == "/v1/completions"
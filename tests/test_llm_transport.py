@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("requests")
+
+from llm_transport import AsyncLLMTransport, CircuitBreaker
+
+def half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+def test_cancelled_half_open_trial_is_released():
+    breaker = half_open_breaker()
+    transport = AsyncLLMTransport(breaker=breaker, max_retries=0)
+
+    async def hang(request):
+        await asyncio.sleep(60)
+
+    async def run():
+        transport.client = httpx.AsyncClient(transport=httpx.MockTransport(hang))
+        task = asyncio.create_task(transport.post("http://stub.invalid/v1/completions", json={}))
+        await asyncio.sleep(0.05)
+        assert breaker.state == "half_open"
+        assert breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await transport.aclose()
+
+    asyncio.run(run())
+
+    assert breaker.state == "half_open"
+    assert not breaker.trial_in_flight
+    # The next caller gets a new trial instead of the mock fallback
+    allowed, trial = breaker.allow_request()
+    assert allowed and trial is not None
+
+def test_half_open_trial_success_closes_breaker():
+    breaker = half_open_breaker()
+    transport = AsyncLLMTransport(breaker=breaker, max_retries=0)
+
+    async def ok(request):
+        return httpx.Response(200, json={"choices": []})
+
+    async def run():
+        transport.client = httpx.AsyncClient(transport=httpx.MockTransport(ok))
+        response = await transport.post("http://stub.invalid/v1/completions", json={})
+        await transport.aclose()
+        return response
+
+    assert asyncio.run(run()).status_code == 200
+    assert breaker.state == "closed"
+
+def test_call_started_while_closed_does_not_release_the_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    transport = AsyncLLMTransport(breaker=breaker, max_retries=0)
+
+    async def hang(request):
+        await asyncio.sleep(60)
+
+    async def run():
+        transport.client = httpx.AsyncClient(transport=httpx.MockTransport(hang))
+        task = asyncio.create_task(transport.post("http://stub.invalid/v1/completions", json={}))
+        await asyncio.sleep(0.05)
+        # Another call fails meanwhile and a third takes the half-open trial
+        breaker.record_failure()
+        allowed, trial = breaker.allow_request()
+        assert allowed and trial is not None
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await transport.aclose()
+
+    asyncio.run(run())
+
+    assert breaker.trial_in_flight
+    assert breaker.allow_request() == (False, None)
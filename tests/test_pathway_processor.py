@@ -0,0 +1,78 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+import embeddings
+from pathway_processor import PathwayProcessor
+from vector_store import VectorStore, content_hash
+
+class CountingEmbedder(embeddings.HashEmbeddingProvider):
+    def __init__(self, vector_dim):
+        super().__init__(vector_dim)
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return super().embed(texts)
+
+def stream(processor, chunks, doc_id, segment_size):
+    processor.stream_document(iter(chunks), doc_id, segment_size=segment_size)
+    # Stop only once every queued operation has been written
+    processor.documents_queue.put(None)
+    processor.processor_thread.join(timeout=10)
+    assert not processor.processor_thread.is_alive()
+
+def stored_texts(store, source):
+    return sorted(
+        store.chunks.text(faiss_id)
+        for faiss_ids in store.source_hash_ids(source).values()
+        for faiss_id in faiss_ids
+    )
+
+def test_stream_document_keeps_unchanged_chunks():
+    store = VectorStore(vector_dim=16)
+    embedder = CountingEmbedder(16)
+    processor = PathwayProcessor(store, embedder=embedder)
+    first = ["alpha chunk", "beta chunk", "gamma chunk"]
+    stream(processor, first, "notes.txt", segment_size=2)
+    before = store.source_hash_ids("notes.txt")
+
+    embedder.embedded.clear()
+    second = ["alpha chunk", "gamma chunk", "delta chunk", "alpha chunk"]
+    stream(processor, second, "notes.txt", segment_size=2)
+
+    assert stored_texts(store, "notes.txt") == sorted(second)
+    after = store.source_hash_ids("notes.txt")
+    assert after[content_hash("gamma chunk")] == before[content_hash("gamma chunk")]
+    assert set(before[content_hash("alpha chunk")]) < set(after[content_hash("alpha chunk")])
+    assert content_hash("beta chunk") not in after
+    # Only the new chunk and the extra copy of a stored one are embedded
+    assert sorted(embedder.embedded) == ["alpha chunk", "delta chunk"]
+
+def test_empty_stream_keeps_previous_version():
+    store = VectorStore(vector_dim=16)
+    processor = PathwayProcessor(store)
+    stream(processor, ["alpha chunk"], "notes.txt", segment_size=4)
+    assert processor.stream_document(iter([]), "notes.txt", segment_size=4) == 0
+
+    assert stored_texts(store, "notes.txt") == ["alpha chunk"]
+
+def test_failed_stream_keeps_previous_version():
+    store = VectorStore(vector_dim=16)
+    processor = PathwayProcessor(store)
+    first = ["alpha chunk", "beta chunk", "gamma chunk"]
+    stream(processor, first, "notes.txt", segment_size=2)
+
+    def broken_upload():
+        yield "alpha chunk"
+        yield "delta chunk"
+        yield "epsilon chunk"
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+
+    with pytest.raises(UnicodeDecodeError):
+        processor.stream_document(broken_upload(), "notes.txt", segment_size=2)
+    processor.documents_queue.put(None)
+    processor.processor_thread.join(timeout=10)
+
+    assert stored_texts(store, "notes.txt") == sorted(first)
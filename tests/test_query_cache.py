@@ -0,0 +1,16 @@
+from query_cache import QueryCache
+
+def test_answer_key_distinguishes_stitched_passages():
+    cache = QueryCache()
+    params = {"model": "m", "temperature": 0.7}
+    alone = [{"id": "a.txt_chunk_0_0", "text": "A"}]
+    stitched = [{"id": "a.txt_chunk_0_0", "chunk_ids": ["a.txt_chunk_0_0", "a.txt_chunk_1_1"], "text": "A B"}]
+
+    assert cache.answer_key("q", alone, params) != cache.answer_key("q", stitched, params)
+
+def test_answer_key_matches_same_context():
+    cache = QueryCache()
+    params = {"model": "m"}
+    context = [{"id": "x_0", "chunk_ids": ["x_0", "x_1"]}]
+
+    assert cache.answer_key("Q ", context, params) == cache.answer_key("q", [dict(context[0])], params)
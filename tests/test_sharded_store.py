@@ -0,0 +1,48 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+from sharded_store import ShardedVectorStore
+from vector_store import VectorStore
+
+WORDS = ["budget", "travel", "research", "vote", "amendment", "committee", "salary", "office"]
+
+def corpus(count=60, dim=16):
+    rng = np.random.default_rng(1)
+    document_ids = [f"doc{i}.txt_chunk_0" for i in range(count)]
+    texts = [" ".join(rng.choice(WORDS, size=6)) for _ in range(count)]
+    return document_ids, texts, rng.random((count, dim), dtype=np.float32)
+
+def fill(store):
+    document_ids, texts, embeddings = corpus()
+    store.add_documents(document_ids, texts, embeddings)
+    return embeddings
+
+def test_single_shard_hybrid_search_matches_vector_store():
+    store = VectorStore(vector_dim=16)
+    sharded = ShardedVectorStore(num_shards=1, vector_dim=16)
+    embeddings = fill(store)
+    fill(sharded)
+
+    expected, expected_distances = store.search(embeddings[3], top_k=5, query_text="budget vote")
+    results, distances = sharded.search(embeddings[3], top_k=5, query_text="budget vote")
+
+    assert [result["id"] for result in results] == [result["id"] for result in expected]
+    assert [result["score"] for result in results] == pytest.approx([result["score"] for result in expected])
+    assert distances == pytest.approx(expected_distances)
+    sharded.close()
+
+def test_hybrid_search_fuses_global_ranks_across_shards():
+    sharded = ShardedVectorStore(num_shards=3, vector_dim=16)
+    embeddings = fill(sharded)
+
+    results, _ = sharded.search(embeddings[7], top_k=5, query_text="research salary")
+
+    assert len(results) == 5
+    scores = [result["score"] for result in results]
+    assert scores == sorted(scores, reverse=True)
+    # No chunk can score more than first place in both global rankings
+    assert scores[0] <= 2.0 / (sharded.rrf_k + 1) + 1e-9
+    assert results[0]["vector_score"] is not None
+    sharded.close()
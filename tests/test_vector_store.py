@@ -0,0 +1,113 @@
+import os
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+import snapshot
+from vector_store import VectorStore
+
+def mapped_files():
+    with open("/proc/self/maps") as f:
+        return {line.split(None, 5)[5].strip() for line in f if len(line.split(None, 5)) == 6}
+
+def build_store(index_type="flat", count=64, dim=16):
+    store = VectorStore(vector_dim=dim, index_type=index_type)
+    rng = np.random.default_rng(0)
+    store.add_documents(
+        [f"doc.txt_chunk_{i}" for i in range(count)],
+        [f"chunk number {i}" for i in range(count)],
+        rng.random((count, dim), dtype=np.float32)
+    )
+    return store
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc/self/maps")
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_load_memory_maps_index(tmp_path, index_type):
+    if not hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        pytest.skip("FAISS build without IO_FLAG_MMAP_IFC")
+    path = str(tmp_path / "store")
+    build_store(index_type).save(path)
+
+    store = VectorStore.load(path, mmap=True)
+    index_path = os.path.join(path, snapshot.INDEX_FILE)
+
+    assert store.mapped_index_path == index_path
+    assert os.path.realpath(index_path) in mapped_files()
+    results, _ = store.search(np.ones(16, dtype=np.float32), top_k=3)
+    assert len(results) == 3
+
+def test_load_without_mmap_reads_into_memory(tmp_path):
+    path = str(tmp_path / "store")
+    build_store().save(path)
+
+    store = VectorStore.load(path, mmap=False)
+
+    assert store.mapped_index_path is None
+    # Writes go straight to the in-memory index
+    store.add_document("other.txt_chunk_0", "another chunk")
+    assert store.get_metrics()["document_count"] == 65
+
+def test_upsert_and_delete_source_containing_chunk_marker():
+    store = VectorStore(vector_dim=16)
+    source = "meeting_chunk_notes.txt"
+    texts = ["first part of the notes", "second part of the notes"]
+    document_ids = [f"{source}_chunk_{i}" for i in range(len(texts))]
+    embeddings = np.eye(2, 16, dtype=np.float32)
+
+    assert store.upsert_source(source, document_ids, texts, embeddings)["added"] == 2
+    # Uploading the same file again keeps the stored chunks
+    assert store.upsert_source(source, document_ids, texts, embeddings) == {"added": 0, "removed": 0, "unchanged": 2}
+    assert store.get_source_stats() == {source: 2}
+
+    assert store.delete_source(source) == 2
+    assert store.get_source_stats() == {}
+    assert store.get_metrics()["document_count"] == 0
+
+def test_hnsw_deletes_do_not_starve_search():
+    store = VectorStore(vector_dim=16, index_type="hnsw")
+    rng = np.random.default_rng(0)
+    count = 200
+    store.add_documents(
+        [f"doc{i}.txt_chunk_0" for i in range(count)],
+        [f"chunk number {i}" for i in range(count)],
+        rng.random((count, 16), dtype=np.float32)
+    )
+    for i in range(count - 10):
+        store.delete_source(f"doc{i}.txt")
+
+    results, _ = store.search(np.ones(16, dtype=np.float32), top_k=5)
+    assert len(results) == 5
+    assert store.deleted_count <= 0.2 * store.index.ntotal
+    assert store.index.ntotal - store.deleted_count == 10
+
+def test_large_batch_is_published_in_bounded_pieces(monkeypatch):
+    import vector_store
+    monkeypatch.setattr(vector_store, "MAX_EXCLUSIVE_ADDS", 16)
+    store = build_store(count=40)
+
+    assert store.index_version == 3
+    assert store.index.ntotal == 40
+    assert store.chunks.text(39) == "chunk number 39"
+    results, _ = store.search(np.ones(16, dtype=np.float32), top_k=40)
+    assert len(results) == 40
+
+def test_removals_compact_outside_the_remove_call():
+    store = VectorStore(vector_dim=16)
+    rng = np.random.default_rng(0)
+    count = 3000
+    store.add_documents(
+        [f"doc{i}.txt_chunk_0" for i in range(count)],
+        [f"chunk number {i}" for i in range(count)],
+        rng.random((count, 16), dtype=np.float32)
+    )
+    arena_before = len(store.chunks.arena)
+    store.remove_source_chunks("doc0.txt", [0])
+    for i in range(1, count - 10):
+        store.delete_source(f"doc{i}.txt")
+
+    assert len(store.chunks.arena) < arena_before
+    assert store.chunks.text(count - 1) == f"chunk number {count - 1}"
+    assert not store.lexical_index.needs_compaction()
+    ids, _ = store.lexical_index.search(f"{count - 1}")
+    assert ids.tolist() == [count - 1]
@@ -1,162 +1,755 @@
 import logging
+import os
 import numpy as np
 import threading
 import faiss
 import time
 import hashlib
+import embeddings
+import index_factory
+import snapshot
+from rwlock import ReadWriteLock
+from chunk_store import ChunkStore, encode_texts
+from chunking import whitespace_end
+from lexical_index import BM25Index, term_frequencies
 from collections import defaultdict
 
 logger = logging.getLogger(__name__)
 
+# Candidates taken from each ranking per result in hybrid search
+HYBRID_CANDIDATE_FACTOR = 4
+
+# Rebuild an index that cannot remove vectors (HNSW) once deleted vectors
+# make up this fraction of it
+REBUILD_DELETED_FRACTION = 0.2
+
+# Most new chunks added per exclusive section, so large writes do not stall
+# searches for long
+MAX_EXCLUSIVE_ADDS = 1024
+
+def fuse_rankings(vector_hits, lexical_hits, rrf_k, top_k):
+    """Reciprocal rank fusion of a vector ranking and a BM25 ranking.
+    
+    `vector_hits` are `(key, distance)` pairs, nearest first, and
+    `lexical_hits` `(key, BM25 score)` pairs, best first. A key scores the
+    sum of 1 / (rrf_k + rank) over the rankings it appears in. Returns the
+    best `top_k` as `(key, fused score, distance, BM25 score)`, with None
+    for a ranking the key is missing from.
+    """
+    fused = {}  # key -> [fused score, distance, BM25 score]
+    for rank, (key, distance) in enumerate(vector_hits):
+        fused[key] = [1.0 / (rrf_k + rank + 1), distance, None]
+    for rank, (key, lexical_score) in enumerate(lexical_hits):
+        entry = fused.setdefault(key, [0.0, None, None])
+        entry[0] += 1.0 / (rrf_k + rank + 1)
+        entry[2] = lexical_score
+    
+    best = sorted(fused.items(), key=lambda item: item[1][0], reverse=True)[:top_k]
+    return [(key, score, distance, lexical_score) for key, (score, distance, lexical_score) in best]
+
+def fused_result(result, score, distance, lexical_score):
+    """Copy of a search result carrying its fused score and both component scores."""
+    return dict(
+        result,
+        score=score,
+        vector_score=1.0 / (1.0 + distance) if distance is not None else None,
+        lexical_score=lexical_score
+    )
+
+def content_hash(text):
+    """Short content hash used to detect unchanged chunks."""
+    return hashlib.md5(text.encode()).hexdigest()[:8]
+
 class VectorStore:
-    def __init__(self, vector_dim=16):  # Low dim for example, real embeddings would be larger
+    def __init__(self, vector_dim=16, index_type="flat", nlist=100, nprobe=8,
+                 hnsw_m=32, ef_search=64, pq_m=8, pq_nbits=8, training_threshold=None,
+                 lexical_search=True, rrf_k=60):
         self.vector_dim = vector_dim
-        self.index = faiss.IndexFlatL2(vector_dim)  # Simple L2 distance index
-        self.document_store = {}  # Maps IDs to document text
-        self.id_map = {}  # Maps FAISS internal IDs to document IDs
-        self.document_metadata = defaultdict(dict)  # Additional document metadata
+        self.index_type = index_type
+        self.index_options = {"nlist": nlist, "hnsw_m": hnsw_m, "pq_m": pq_m, "pq_nbits": pq_nbits}
+        self.default_nprobe = nprobe
+        self.default_ef_search = ef_search
+        
+        if index_type in index_factory.TRAINED_INDEX_TYPES:
+            # IVF indexes need training data, so buffer vectors in a flat index
+            # until there are enough of them, then migrate
+            self.training_threshold = training_threshold or index_factory.training_size(index_type, nlist, pq_nbits)
+            self.index = index_factory.create_index("flat", vector_dim)
+            self.is_trained = False
+        else:
+            self.training_threshold = 0
+            self.index = index_factory.create_index(index_type, vector_dim, **self.index_options)
+            self.is_trained = True
+        # Chunk text and metadata in arrays indexed by FAISS id
+        self.chunks = ChunkStore()
+        # BM25 index over the same chunks, for hybrid keyword + vector search
+        self.lexical_index = BM25Index() if lexical_search else None
+        self.rrf_k = rrf_k
         self.next_id = 0
-        self.lock = threading.Lock()
+        # Searches share the lock; writers serialize on writer_lock and only
+        # take the lock exclusively to publish their changes
+        self.lock = ReadWriteLock()
+        self.writer_lock = threading.Lock()
         self.last_update_time = time.time()
+        # Bumped on every change to the indexed content, for cache invalidation
+        self.index_version = 0
+        # Vectors still in the index whose chunks have been deleted (HNSW only)
+        self.deleted_count = 0
+        # Path of the snapshot index while self.index is a read-only memory map
+        self.mapped_index_path = None
+        # Called with the keys of removed chunks after every write that
+        # removes some, e.g. to evict answers cached from them
+        self.removal_listeners = []
+        # Counters republished by every write, so metrics never take the lock
+        self.stats = {}
+        self._publish_stats()
         
-        logger.info(f"Initialized VectorStore with dimension {vector_dim}")
+        logger.info(f"Initialized VectorStore with dimension {vector_dim} and {index_type} index")
         
     def add_document(self, document_id, text, embedding=None):
         """Add a document to the vector store."""
-        with self.lock:
-            # If embedding is not provided, create an embedding based on text hash
-            if embedding is None:
-                embedding = self._create_hash_embedding(text)
-            else:
-                # Ensure embedding has the right size and type
-                if len(embedding) != self.vector_dim:
-                    logger.warning(f"Resizing embedding from {len(embedding)} to {self.vector_dim} dimensions")
-                    # Resize embedding to match index dimension
-                    resized_embedding = np.zeros(self.vector_dim, dtype=np.float32)
-                    min_dim = min(len(embedding), self.vector_dim)
-                    resized_embedding[:min_dim] = embedding[:min_dim]
-                    embedding = resized_embedding
-                embedding = np.array(embedding).astype(np.float32)
-            
-            # Reshape to 2D array for FAISS
-            embedding = embedding.reshape(1, -1)
-            
-            # Add to FAISS index
-            faiss_id = self.next_id
-            self.index.add(embedding)
-            
-            # Update mappings
-            doc_key = f"{document_id}_{faiss_id}"
-            self.id_map[faiss_id] = doc_key
-            self.document_store[doc_key] = text
+        # If embedding is not provided, create an embedding based on text hash
+        if embedding is None:
+            embedding = self._create_hash_embedding(text)
+        
+        doc_keys = self.add_documents([document_id], [text], np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+        return doc_keys[0]
+    
+    def add_documents(self, document_ids, texts, embeddings, spans=None, source_text=None):
+        """Add a batch of documents to the vector store with a single FAISS call.
+        
+        `embeddings` is an (N, dim) matrix whose rows line up with `document_ids`
+        and `texts`. If the texts are slices of one document, pass the
+        document as `source_text` and the `(start, end)` slices as `spans` to
+        store a single copy of it. Returns the list of document keys in the
+        same order.
+        """
+        if len(document_ids) != len(texts):
+            raise ValueError(f"Got {len(document_ids)} document ids for {len(texts)} texts")
+        if not document_ids:
+            return []
+        
+        embeddings = self._prepare_matrix(embeddings, len(document_ids))
+        
+        # Writers are serialized by writer_lock; the shared lock is only held
+        # exclusively while the index and mappings are actually mutated, so
+        # searches keep running while a batch is being prepared
+        with self.writer_lock:
+            doc_keys = [f"{document_id}_{self.next_id + offset}" for offset, document_id in enumerate(document_ids)]
+            doc_count = self._apply_changes(document_ids, texts, embeddings, spans=spans, source_text=source_text)
+        
+        logger.info(f"Added {len(doc_keys)} documents to vector store. Total documents: {doc_count}")
+        return doc_keys
+    
+    def upsert_source(self, source, document_ids, texts, embeddings=None, embedded=None, embed_fn=None,
+                      spans=None, source_text=None):
+        """Make the chunks stored for `source` match `texts`.
+        
+        Chunks are matched on content hash: unchanged chunks are kept as they
+        are, chunks that are no longer present are removed from the index and
+        new or changed chunks are added. `embeddings` may hold vectors for
+        some of the texts, with `embedded` marking which rows are valid;
+        `embed_fn(texts)` is called for any new chunk without one. With
+        `spans` and `source_text` (see add_documents) unchanged chunks are
+        moved onto the new text, so the old version can be released. Returns
+        counts of added, removed and unchanged chunks.
+        """
+        if len(document_ids) != len(texts):
+            raise ValueError(f"Got {len(document_ids)} document ids for {len(texts)} texts")
+        if embedded is None:
+            embedded = np.full(len(texts), embeddings is not None, dtype=bool)
+        
+        with self.writer_lock:
+            existing = self._source_hash_ids(source)
             
-            # Store metadata
-            source_doc = document_id.split('_chunk_')[0] if '_chunk_' in document_id else document_id
-            self.document_metadata[doc_key] = {
-                "source": source_doc,
-                "added_at": time.time(),
-                "content_hash": hashlib.md5(text.encode()).hexdigest()[:8]
-            }
+            # Keep as many stored copies of each hash as the new version has
+            new_indices = []
+            kept = defaultdict(int)
+            retarget = {}  # kept FAISS id -> its span in the new text
+            for i, text in enumerate(texts):
+                chunk_hash = content_hash(text)
+                if kept[chunk_hash] < len(existing.get(chunk_hash, ())):
+                    if spans is not None:
+                        retarget[existing[chunk_hash][kept[chunk_hash]]] = spans[i]
+                    kept[chunk_hash] += 1
+                else:
+                    new_indices.append(i)
+            stale_ids = [
+                faiss_id
+                for chunk_hash, faiss_ids in existing.items()
+                for faiss_id in faiss_ids[kept[chunk_hash]:]
+            ]
+            unchanged = len(texts) - len(new_indices)
             
-            self.next_id += 1
-            self.last_update_time = time.time()
+            if not new_indices and not stale_ids:
+                logger.info(f"Source {source} unchanged ({unchanged} chunks)")
+                return {"added": 0, "removed": 0, "unchanged": unchanged}
             
-            # Log document addition with current count
-            doc_count = self.index.ntotal
-            logger.info(f"Added document {doc_key} to vector store. Total documents: {doc_count}")
+            # Only embed the new chunks that arrived without an embedding
+            new_embeddings = np.zeros((len(new_indices), self.vector_dim), dtype=np.float32)
+            missing = [row for row, i in enumerate(new_indices) if not embedded[i]]
+            for row, i in enumerate(new_indices):
+                if embedded[i]:
+                    new_embeddings[row] = self._prepare_matrix(embeddings[i], 1)[0]
+            if missing:
+                if embed_fn is None:
+                    raise ValueError(f"No embeddings for {len(missing)} new chunks of source {source}")
+                new_embeddings[missing] = self._prepare_matrix(
+                    embed_fn([texts[new_indices[row]] for row in missing]), len(missing)
+                )
             
-            return doc_key
+            doc_count = self._apply_changes(
+                [document_ids[i] for i in new_indices],
+                [texts[i] for i in new_indices],
+                new_embeddings,
+                remove_ids=stale_ids,
+                spans=[spans[i] for i in new_indices] if spans is not None else None,
+                source_text=source_text,
+                retarget=retarget
+            )
+        
+        logger.info(f"Upserted source {source}: {len(new_indices)} added, {len(stale_ids)} removed, "
+                    f"{unchanged} unchanged. Total documents: {doc_count}")
+        return {"added": len(new_indices), "removed": len(stale_ids), "unchanged": unchanged}
+    
+    def delete_source(self, source):
+        """Delete every chunk of a source document. Returns the number removed."""
+        with self.writer_lock:
+            stale_ids = self.chunks.ids_for_source(source)
+            if not len(stale_ids):
+                return 0
+            self._apply_changes([], [], None, remove_ids=stale_ids)
+        
+        logger.info(f"Deleted {len(stale_ids)} chunks of source {source}")
+        return len(stale_ids)
+    
+    def source_hashes(self, source):
+        """Content hashes of the chunks currently stored for `source`."""
+        with self.writer_lock:
+            return set(self._source_hash_ids(source))
+    
+    def source_hash_ids(self, source):
+        """Map of content hash -> FAISS ids of the chunks currently stored for `source`."""
+        with self.writer_lock:
+            return self._source_hash_ids(source)
+    
+    def remove_source_chunks(self, source, faiss_ids):
+        """Delete the given chunks of `source`, as returned by source_hash_ids.
+        
+        Ids that no longer belong to `source` are ignored. Returns the number
+        removed.
+        """
+        with self.writer_lock:
+            owned = set(self.chunks.ids_for_source(source).tolist())
+            stale_ids = [faiss_id for faiss_id in faiss_ids if faiss_id in owned]
+            if not stale_ids:
+                return 0
+            self._apply_changes([], [], None, remove_ids=np.array(stale_ids, dtype=np.int64))
+        
+        logger.info(f"Removed {len(stale_ids)} stale chunks of source {source}")
+        return len(stale_ids)
+    
+    def _source_hash_ids(self, source):
+        """Map of content hash -> FAISS ids for a source's live chunks. Needs writer_lock."""
+        faiss_ids = self.chunks.ids_for_source(source)
+        hash_ids = {}
+        for faiss_id, chunk_hash in zip(faiss_ids.tolist(), self.chunks.hashes[faiss_ids]):
+            hash_ids.setdefault(chunk_hash.decode("ascii"), []).append(faiss_id)
+        return hash_ids
+    
+    def _apply_changes(self, document_ids, texts, embeddings, remove_ids=(), spans=None, source_text=None,
+                       retarget=None):
+        """Publish new chunks and removed ids.
+        
+        Everything that does not touch shared state (tokenizing, encoding
+        text, compaction) runs before or after the exclusive sections, and
+        new chunks are added at most MAX_EXCLUSIVE_ADDS per section, so
+        searches never wait long. A change of up to MAX_EXCLUSIVE_ADDS new
+        chunks is published in one section. With `spans` and `source_text`
+        the new chunks, and the kept chunks in `retarget` (FAISS id -> span),
+        are stored as slices of one copy of `source_text`. Needs writer_lock.
+        Returns the number of live chunks afterwards.
+        """
+        self._ensure_writable_index()
+        faiss_ids = np.arange(self.next_id, self.next_id + len(document_ids), dtype=np.int64)
+        hashes = [content_hash(text) for text in texts]
+        retarget = retarget or {}
+        
+        # Tokenize outside the exclusive section; the removed chunks' texts
+        # cannot change while writer_lock is held
+        term_counts = removed_term_counts = None
+        if self.lexical_index is not None:
+            term_counts = [term_frequencies(text) for text in texts]
+            remove_ids = [faiss_id for faiss_id in remove_ids if self.chunks.is_alive(faiss_id)]
+            removed_term_counts = [term_frequencies(self.chunks.text(faiss_id)) for faiss_id in remove_ids]
+        removed_keys = []
+        if self.removal_listeners:
+            removed_keys = [self.chunks.key(faiss_id) for faiss_id in remove_ids if self.chunks.is_alive(faiss_id)]
+        
+        # Encode texts outside the exclusive section too
+        kept_ids = list(retarget)
+        space_ends = kept_space_ends = encoded = None
+        if source_text is not None and spans is not None and (len(faiss_ids) or retarget):
+            encoded = encode_texts(spans=[retarget[faiss_id] for faiss_id in kept_ids] + list(spans),
+                                   source_text=source_text)
+            # Where the whitespace after each spanned chunk ends, so adjacent
+            # chunks can be told apart from ones with text between them
+            space_ends = [whitespace_end(source_text, end) for _, end in spans]
+            kept_space_ends = [whitespace_end(source_text, end) for _, end in retarget.values()]
+        elif len(faiss_ids):
+            encoded = encode_texts(texts)
+            spans = None
+        
+        added_at = time.time()
+        pieces = range(0, max(len(faiss_ids), 1), MAX_EXCLUSIVE_ADDS)
+        for start in pieces:
+            piece = slice(start, start + MAX_EXCLUSIVE_ADDS)
+            with self.lock.write_locked():
+                if start == 0:
+                    if len(remove_ids):
+                        self._remove_locked(remove_ids, removed_term_counts)
+                    if encoded is not None:
+                        offsets, lengths = self.chunks.append_encoded(encoded)
+                        self.chunks.set_text(
+                            kept_ids, (offsets[:len(kept_ids)], lengths[:len(kept_ids)]),
+                            [retarget[i] for i in kept_ids], kept_space_ends
+                        )
+                        offsets, lengths = offsets[len(kept_ids):], lengths[len(kept_ids):]
+                
+                piece_ids = faiss_ids[piece]
+                if len(piece_ids):
+                    self.index.add_with_ids(embeddings[piece], piece_ids)
+                    self.chunks.add(
+                        piece_ids, document_ids[piece], hashes[piece], added_at,
+                        (offsets[piece], lengths[piece]),
+                        spans[piece] if spans is not None else None,
+                        space_ends[piece] if space_ends is not None else None
+                    )
+                    if self.lexical_index is not None:
+                        self.lexical_index.add(piece_ids, term_counts[piece])
+                    self.next_id = int(piece_ids[-1]) + 1
+                
+                self.last_update_time = time.time()
+                self.index_version += 1
+                doc_count = self.index.ntotal - self.deleted_count
+                self._publish_stats()
+        
+        if removed_keys:
+            for listener in self.removal_listeners:
+                listener(removed_keys)
+        
+        self._compact_if_needed()
+        if not self.is_trained and self.index.ntotal >= self.training_threshold:
+            self._train_and_migrate()
+        elif self.deleted_count > REBUILD_DELETED_FRACTION * self.index.ntotal:
+            self._rebuild_index()
+        
+        return doc_count
+    
+    def _compact_if_needed(self):
+        """Compact the chunk text arena and BM25 postings once removals warrant it.
+        
+        Needs writer_lock. The compacted copies are built under the shared
+        lock, so searches continue, and swapped in under the exclusive lock.
+        """
+        compact_chunks = self.chunks.needs_compaction()
+        compact_postings = self.lexical_index is not None and self.lexical_index.needs_compaction()
+        if not compact_chunks and not compact_postings:
+            return
+        
+        with self.lock.read_locked():
+            chunk_plan = self.chunks.plan_compaction() if compact_chunks else None
+            postings_plan = self.lexical_index.plan_compaction() if compact_postings else None
+        with self.lock.write_locked():
+            if chunk_plan is not None:
+                self.chunks.finish_compaction(chunk_plan)
+            if postings_plan is not None:
+                self.lexical_index.finish_compaction(postings_plan)
+            self._publish_stats()
+    
+    def _remove_locked(self, faiss_ids, term_counts=None):
+        """Drop chunks from the index, chunk store and lexical index. Needs the exclusive lock.
+        
+        `term_counts` are the chunks' term frequencies, needed to unindex them
+        from the lexical index.
+        """
+        if self.lexical_index is not None:
+            self.lexical_index.remove(faiss_ids, term_counts)
+        removed = self.chunks.remove(faiss_ids)
+        if not len(removed):
+            return
+        if index_factory.supports_removal(self.index_type) or not self.is_trained:
+            self.index.remove_ids(removed)
+        else:
+            # HNSW cannot remove vectors; they are skipped at search time
+            # until _rebuild_index drops them
+            self.deleted_count += len(removed)
+    
+    def _train_and_migrate(self):
+        """Train the configured IVF index on the buffered vectors and switch to it.
+        
+        Must be called with writer_lock held. Training runs on a copy while
+        searches continue against the flat buffer; the trained index is then
+        published under the exclusive lock. Vectors are re-added in FAISS id
+        order, so existing ids stay valid.
+        """
+        start_time = time.time()
+        with self.lock.read_locked():
+            vectors, ids = index_factory.export_vectors(self.index)
+        
+        trained_index = index_factory.create_index(self.index_type, self.vector_dim, **self.index_options)
+        trained_index.train(vectors)
+        trained_index.add_with_ids(vectors, ids)
+        
+        with self.lock.write_locked():
+            self.index = trained_index
+            self.is_trained = True
+            self.index_version += 1
+            self._publish_stats()
+        logger.info(f"Trained {self.index_type} index on {len(vectors)} vectors in {time.time() - start_time:.2f}s")
+    
+    def _rebuild_index(self):
+        """Rebuild the index from its live vectors, dropping deleted ones.
+        
+        For index types that cannot remove vectors, whose deleted vectors
+        would otherwise crowd live ones out of search results. Must be called
+        with writer_lock held; like _train_and_migrate it builds the new index
+        while searches continue and publishes it under the exclusive lock.
+        """
+        start_time = time.time()
+        with self.lock.read_locked():
+            vectors, ids = index_factory.export_vectors(self.index)
+        live = self.chunks.alive[ids]
+        
+        rebuilt_index = index_factory.create_index(self.index_type, self.vector_dim, **self.index_options)
+        rebuilt_index.add_with_ids(vectors[live], ids[live])
+        
+        with self.lock.write_locked():
+            self.index = rebuilt_index
+            self.mapped_index_path = None
+            self.deleted_count = 0
+            self.index_version += 1
+            self._publish_stats()
+        logger.info(f"Rebuilt {self.index_type} index without {len(ids) - int(live.sum())} deleted vectors "
+                    f"in {time.time() - start_time:.2f}s")
+    
+    def _build_lexical_index(self):
+        """Index the text of every live chunk, for snapshots saved without postings.
+        
+        Costs a pass over the whole corpus; saving the store again writes
+        postings that later loads map instead.
+        """
+        logger.warning("Snapshot has no BM25 postings; rebuilding the lexical index from chunk texts")
+        lexical_index = BM25Index()
+        faiss_ids = self.chunks.live_ids()
+        lexical_index.add(faiss_ids, [term_frequencies(self.chunks.text(i)) for i in faiss_ids.tolist()])
+        logger.info(f"Built BM25 index over {len(faiss_ids)} chunks")
+        return lexical_index
+    
+    def _ensure_writable_index(self):
+        """Swap a memory-mapped snapshot index for a writable in-memory copy.
+        
+        Must be called with writer_lock held, before the index is modified.
+        """
+        if self.mapped_index_path is None:
+            return
+        logger.info(f"Loading writable copy of index {self.mapped_index_path}")
+        writable_index = faiss.read_index(self.mapped_index_path)
+        with self.lock.write_locked():
+            self.index = writable_index
+            self.mapped_index_path = None
+    
+    def _prepare_matrix(self, embeddings, expected_rows):
+        """Coerce embeddings to a contiguous (N, vector_dim) float32 matrix."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        if embeddings.shape[0] != expected_rows:
+            raise ValueError(f"Got {embeddings.shape[0]} embeddings for {expected_rows} documents")
+        
+        # Ensure embeddings have the right size
+        if embeddings.shape[1] != self.vector_dim:
+            logger.warning(f"Resizing embeddings from {embeddings.shape[1]} to {self.vector_dim} dimensions")
+            resized = np.zeros((embeddings.shape[0], self.vector_dim), dtype=np.float32)
+            min_dim = min(embeddings.shape[1], self.vector_dim)
+            resized[:, :min_dim] = embeddings[:, :min_dim]
+            embeddings = resized
+        
+        return np.ascontiguousarray(embeddings)
     
     def _create_hash_embedding(self, text):
         """Create a deterministic embedding based on text hash."""
-        hash_bytes = hashlib.md5(text.encode()).digest()
-        embedding = np.array([float(byte) / 255.0 for byte in hash_bytes]).astype(np.float32)
-        
-        # Pad or truncate to vector_dim
-        if len(embedding) != self.vector_dim:
-            result = np.zeros(self.vector_dim, dtype=np.float32)
-            min_dim = min(len(embedding), self.vector_dim)
-            result[:min_dim] = embedding[:min_dim]
-            embedding = result
-            
-        # Normalize embedding
-        norm = np.linalg.norm(embedding)
-        if norm > 0:
-            embedding = embedding / norm
-            
-        return embedding
+        return embeddings.embed_one(text, self.vector_dim)
+    
+    def search(self, query_embedding, top_k=5, nprobe=None, ef_search=None, query_text=None):
+        """Search for similar documents by embedding.
+        
+        `nprobe` (IVF) and `ef_search` (HNSW) override the store defaults for
+        this query only. With `query_text` the results are a hybrid of the
+        vector search and a BM25 keyword search over the chunk texts.
+        """
+        query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        query_texts = [query_text] if query_text is not None else None
+        return self.search_batch(query_embedding, top_k, nprobe=nprobe, ef_search=ef_search,
+                                 query_texts=query_texts)[0]
     
-    def search(self, query_embedding, top_k=5):
-        """Search for similar documents by embedding."""
-        with self.lock:
+    def search_batch(self, query_embeddings, top_k=5, nprobe=None, ef_search=None, query_texts=None):
+        """Search for many query embeddings with one FAISS matrix search.
+        
+        `query_embeddings` is an (N, dim) matrix. Returns a list of N
+        `(results, distances)` pairs, each shaped like the return value of
+        `search`.
+        
+        If `query_texts` are given and the lexical index is enabled, each
+        query also runs a BM25 search over its text and the two rankings are
+        merged with reciprocal rank fusion: a chunk scores the sum of
+        1 / (rrf_k + rank) over the rankings it appears in. Fused results
+        carry the fused "score" plus "vector_score" and "lexical_score"; the
+        distance of a keyword-only hit is None.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        query_count = query_embeddings.shape[0]
+        if query_count == 0:
+            return []
+        
+        # Ensure query embeddings have the right format
+        query_embeddings = self._prepare_matrix(query_embeddings, query_count)
+        
+        with self.lock.read_locked():
             doc_count = self.index.ntotal
             
             if doc_count == 0:
                 logger.warning("Search attempted on empty vector store")
-                return [], []
+                return [([], []) for _ in range(query_count)]
             
-            logger.info(f"Searching among {doc_count} documents for top {top_k} matches")
-                
-            # Ensure query embedding has the right format
-            if isinstance(query_embedding, list):
-                query_embedding = np.array(query_embedding).astype(np.float32)
-                
-            # Resize if needed
-            if len(query_embedding) != self.vector_dim:
-                logger.warning(f"Resizing query embedding from {len(query_embedding)} to {self.vector_dim}")
-                resized_query = np.zeros(self.vector_dim, dtype=np.float32)
-                min_dim = min(len(query_embedding), self.vector_dim)
-                resized_query[:min_dim] = query_embedding[:min_dim]
-                query_embedding = resized_query
-                
-            # Reshape to 2D array for FAISS
-            query_embedding = query_embedding.reshape(1, -1)
+            logger.info(f"Searching among {doc_count} documents for top {top_k} matches of {query_count} queries")
             
-            # Perform search
-            distances, indices = self.index.search(query_embedding, min(top_k, doc_count))
+            hybrid = query_texts is not None and self.lexical_index is not None
+            distances, indices = self._search_index(query_embeddings, top_k, nprobe, ef_search, hybrid)
             
-            # Get document texts
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx >= 0 and idx in self.id_map:  # -1 indicates not enough results
-                    doc_key = self.id_map[idx]
-                    text = self.document_store.get(doc_key, "")
-                    metadata = self.document_metadata.get(doc_key, {})
-                    
-                    # Calculate similarity score (convert L2 distance to similarity)
-                    similarity = 1.0 / (1.0 + distances[0][i])
-                    
-                    result = {
-                        "id": doc_key,
-                        "text": text,
-                        "score": similarity,
-                        "source": metadata.get("source", "unknown"),
-                        "timestamp": metadata.get("added_at", 0)
-                    }
-                    results.append(result)
-                    
-                    logger.debug(f"Found match: {doc_key} with score {similarity:.4f}")
+            if hybrid:
+                return [
+                    self._fuse_results(distances[row], indices[row], query_texts[row], top_k)
+                    for row in range(query_count)
+                ]
+            return [
+                self._build_results(distances[row], indices[row], top_k)
+                for row in range(query_count)
+            ]
+    
+    def search_candidates(self, query_embeddings, top_k=5, nprobe=None, ef_search=None, query_texts=None):
+        """Unfused hybrid search candidates, for fusing results across stores.
+        
+        Returns one `(vector_hits, lexical_hits)` pair per query: up to
+        top_k * HYBRID_CANDIDATE_FACTOR `(result, distance)` pairs, nearest
+        first, and as many `(result, BM25 score)` pairs, best first. The
+        lexical list is empty without `query_texts` or a lexical index.
+        Fusing the two, keyed by result id, with `fuse_rankings` gives what
+        `search_batch` returns.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        query_count = query_embeddings.shape[0]
+        query_embeddings = self._prepare_matrix(query_embeddings, query_count)
+        candidate_k = top_k * HYBRID_CANDIDATE_FACTOR
+        
+        with self.lock.read_locked():
+            if self.index.ntotal == 0:
+                return [([], []) for _ in range(query_count)]
             
-            return results, distances[0].tolist()
+            distances, indices = self._search_index(query_embeddings, top_k, nprobe, ef_search, hybrid=True)
+            candidates = []
+            for row in range(query_count):
+                vector_hits = [
+                    (self._result(idx, 1.0 / (1.0 + float(distance))), float(distance))
+                    for distance, idx in zip(distances[row], indices[row])
+                    if idx >= 0 and self.chunks.is_alive(idx)
+                ][:candidate_k]
+                lexical_hits = []
+                if query_texts is not None and self.lexical_index is not None:
+                    lexical_ids, lexical_scores = self.lexical_index.search(query_texts[row], candidate_k)
+                    lexical_hits = [
+                        (self._result(idx, score), score)
+                        for idx, score in zip(lexical_ids.tolist(), lexical_scores.tolist())
+                    ]
+                candidates.append((vector_hits, lexical_hits))
+            return candidates
+    
+    def _search_index(self, query_embeddings, top_k, nprobe, ef_search, hybrid):
+        """Run the FAISS search for `top_k` results. Must be called with the lock held."""
+        params = index_factory.search_parameters(
+            self.index,
+            nprobe=nprobe or self.default_nprobe,
+            ef_search=ef_search or self.default_ef_search
+        )
+        # Deleted chunks keep their vectors until the index is rebuilt, so
+        # over-fetch a little to still return top_k live results
+        fetch_k = top_k + min(self.deleted_count, top_k * 4)
+        if hybrid:
+            fetch_k = max(fetch_k, top_k * HYBRID_CANDIDATE_FACTOR)
+        return self.index.search(query_embeddings, min(fetch_k, self.index.ntotal), params=params)
+    
+    def _build_results(self, distances, indices, top_k):
+        """Materialize search hits for one query. Must be called with the lock held.
+        
+        Returns `(results, distances)` for at most `top_k` live hits.
+        """
+        results = []
+        kept_distances = []
+        for i, idx in enumerate(indices):
+            if len(results) >= top_k:
+                break
+            if idx >= 0 and self.chunks.is_alive(idx):  # -1 indicates not enough results
+                # Calculate similarity score (convert L2 distance to similarity)
+                similarity = 1.0 / (1.0 + float(distances[i]))
+                results.append(self._result(idx, similarity))
+                kept_distances.append(float(distances[i]))
+        
+        return results, kept_distances
+    
+    def _fuse_results(self, distances, indices, query_text, top_k):
+        """Fuse one query's vector hits with its BM25 hits. Must be called with the lock held."""
+        vector_hits = [
+            (int(idx), float(distance))
+            for distance, idx in zip(distances, indices)
+            if idx >= 0 and self.chunks.is_alive(idx)
+        ]
+        lexical_ids, lexical_scores = self.lexical_index.search(query_text, top_k * HYBRID_CANDIDATE_FACTOR)
+        
+        results = []
+        kept_distances = []
+        for idx, score, distance, lexical_score in fuse_rankings(
+            vector_hits, zip(lexical_ids.tolist(), lexical_scores.tolist()), self.rrf_k, top_k
+        ):
+            results.append(fused_result(self._result(idx, score), score, distance, lexical_score))
+            kept_distances.append(distance)
+        
+        return results, kept_distances
+    
+    def _result(self, idx, score):
+        """Result dict for the chunk with FAISS id `idx`. Must be called with the lock held."""
+        doc_key = self.chunks.key(idx)
+        logger.debug(f"Found match: {doc_key} with score {score:.4f}")
+        start = int(self.chunks.doc_starts[idx])
+        return {
+            "id": doc_key,
+            "text": self.chunks.text(idx),
+            "score": score,
+            "source": self.chunks.source(idx),
+            "timestamp": float(self.chunks.added_at[idx]),
+            # Offsets in the source document, if the chunk was stored as a span of
+            # it, and the end of the whitespace that follows the chunk there
+            "span": (start, int(self.chunks.doc_ends[idx])) if start >= 0 else None,
+            "space_end": int(self.chunks.doc_space_ends[idx]) if start >= 0 else None
+        }
     
     def get_metrics(self):
-        """Get metrics about the vector store."""
-        with self.lock:
-            doc_count = self.index.ntotal
-            
-            # Count unique sources
-            sources = set()
-            for doc_key in self.document_store:
-                metadata = self.document_metadata.get(doc_key, {})
-                source = metadata.get("source", "unknown")
-                sources.add(source)
-            
-            logger.info(f"Vector store metrics: {doc_count} docs, {len(sources)} sources")
-                
-            return {
-                "document_count": doc_count,
-                "last_update": self.last_update_time,
-                "vector_dimension": self.vector_dim,
-                "unique_sources": len(sources),
-                "sources": list(sources)
+        """Get metrics about the vector store.
+        
+        Returns the counters published by the last write without taking the
+        lock, so it costs the same for any corpus size.
+        """
+        return dict(self.stats)
+    
+    def get_source_stats(self):
+        """Live chunk count per source.
+        
+        Takes the shared lock, so the counts match a single published write
+        rather than one still being applied.
+        """
+        with self.lock.read_locked():
+            return dict(self.chunks.source_counts)
+    
+    def _publish_stats(self):
+        """Replace the metrics snapshot. Call with the exclusive lock held after a change."""
+        self.stats = {
+            "document_count": self.index.ntotal - self.deleted_count,
+            "last_update": self.last_update_time,
+            "vector_dimension": self.vector_dim,
+            "index_type": self.index_type,
+            "index_trained": self.is_trained,
+            "index_version": self.index_version,
+            "unique_sources": len(self.chunks.source_counts),
+            "chunk_store_bytes": self.chunks.nbytes(),
+            "lexical_search": self.lexical_index is not None,
+            "rrf_k": self.rrf_k,
+            "lexical_index_bytes": self.lexical_index.nbytes() if self.lexical_index is not None else 0
+        }
+    
+    def save(self, path):
+        """Save the index, chunk texts and metadata to the directory `path`."""
+        with self.writer_lock:
+            manifest = {
+                "vector_dim": self.vector_dim,
+                "index_type": self.index_type,
+                "index_options": self.index_options,
+                "nprobe": self.default_nprobe,
+                "ef_search": self.default_ef_search,
+                "training_threshold": self.training_threshold,
+                "lexical_search": self.lexical_index is not None,
+                "rrf_k": self.rrf_k,
+                "is_trained": self.is_trained,
+                "next_id": self.next_id,
+                "last_update_time": self.last_update_time
             }
+            snapshot.write_snapshot(
+                path,
+                lambda index_path: faiss.write_index(self.index, index_path),
+                manifest,
+                self.chunks,
+                lexical_index=self.lexical_index
+            )
+    
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a store saved with `save`.
+        
+        With `mmap` the FAISS index is memory-mapped (see
+        index_factory.mmap_read_flag) and chunk texts and metadata are read
+        lazily from memory-mapped files, so loading does not depend on corpus
+        size and worker processes share the same pages.
+        """
+        start_time = time.time()
+        manifest = snapshot.read_manifest(path)
+        store = cls(
+            vector_dim=manifest["vector_dim"],
+            index_type=manifest["index_type"],
+            nprobe=manifest["nprobe"],
+            ef_search=manifest["ef_search"],
+            training_threshold=manifest["training_threshold"],
+            lexical_search=manifest.get("lexical_search", True),
+            rrf_k=manifest.get("rrf_k", 60),
+            **manifest["index_options"]
+        )
+        
+        index_path = os.path.join(path, snapshot.INDEX_FILE)
+        mmap_flag = index_factory.mmap_read_flag(manifest["index_type"], manifest["is_trained"]) if mmap else None
+        if mmap and mmap_flag is None:
+            logger.warning(f"This FAISS build cannot memory-map a {manifest['index_type']} index; "
+                           f"reading {index_path} into memory")
+        store.index = None
+        if mmap_flag is not None:
+            try:
+                store.index = faiss.read_index(index_path, mmap_flag)
+                # Only a mapped index needs a writable copy before the first write
+                store.mapped_index_path = index_path
+            except RuntimeError as e:
+                logger.warning(f"Could not memory-map {index_path}, reading it into memory: {str(e)}")
+        if store.index is None:
+            store.index = faiss.read_index(index_path)
+        
+        store.chunks = ChunkStore.load(path, mmap_mode=mmap)
+        if store.lexical_index is not None:
+            store.lexical_index = BM25Index.load(path, mmap=mmap) or store._build_lexical_index()
+        
+        store.is_trained = manifest["is_trained"]
+        store.next_id = manifest["next_id"]
+        store.deleted_count = store.index.ntotal - store.chunks.count
+        store.last_update_time = manifest["last_update_time"]
+        store._publish_stats()
+        
+        logger.info(f"Loaded VectorStore with {store.index.ntotal} vectors from {path} in {time.time() - start_time:.2f}s")
+        return store